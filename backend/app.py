@@ -1,8 +1,22 @@
 import sys
 sys.dont_write_bytecode = True
+import database.mongo
+import database.postgres
 import flask
 import rag
-import test_rag
+import ragutil.answer_cache
+import ragutil.context_assembly
+import ragutil.context_compression
+import ragutil.llm_cache
+import ragutil.pipeline_metrics
+import ragutil.semantic_cache
+import ragutil.speculation
+import ragutil.warmup
+import util.embedding
+import util.embedding_cache
+import util.embedding_client
+import util.metrics
+import util.tracing
 
 import dotenv
 
@@ -21,18 +35,22 @@ app = flask.app.Flask(__name__)
 app.secret_key = "hallo welt"
 
 
+@app.before_request
+def count_request_started() -> None:
+    ragutil.pipeline_metrics.in_flight_requests.inc()
+
+@app.teardown_request
+def count_request_finished(_) -> None:
+    # Streamed responses tear down once the stream is consumed (stream_with_context)
+    ragutil.pipeline_metrics.in_flight_requests.dec()
+
+
 
 @app.get("/")
 def get_index() -> str:
     with open("backend/index.html", "r", encoding="utf-8") as file:
         return file.read()
 
-@app.get("/debug")
-def get_index_debug() -> str:
-    with open("backend/index.html", "r", encoding="utf-8") as file:
-        r = file.read()
-        return r.replace('const API_URL = "./api"', 'const API_URL = "./api-debug"').replace('<title>Der DHBW Datenbank Design Deputy</title>', '<title>Der DHBW Datenbank Design Deputy - Debug</title>').replace('<h1>Der DHBW Datenbank Design Deputy</h1>', '<h1>Der DHBW Datenbank Design Deputy - DEBUG</h1>').replace('--color-surface: #05181B;', '--color-surface: #180505;')
-
 @app.post("/api")
 def post_api() -> str:
     body = flask.request.get_json()
@@ -40,82 +58,97 @@ def post_api() -> str:
         return "", 400
     user_input: str = body["user_input"]
 
-    return rag.rag_process(user_input)
+    try:
+        keyword_extractor: str = rag.select_keyword_extractor(body.get("keyword_extractor"))
+    except ValueError as error:
+        return str(error), 400
+
+    return rag.rag_process(user_input, keyword_extractor)
 
-@app.post("/api-debug")
-def post_api_debug() -> str:
+@app.post("/api/stream")
+def post_api_stream() -> flask.Response:
     body = flask.request.get_json()
     if "user_input" not in body:
         return "", 400
     user_input: str = body["user_input"]
 
-    results: list[float] = [0.0, 0.0, 0.0]
-    NUM_OF_TRIES: int = 100
-
-    for _ in range(NUM_OF_TRIES):
-        r = test_rag.rag_process(user_input)
-
-        for i, e in enumerate(r):
-            results[i] += e
-    
-    avg: list[float] = [
-        i / NUM_OF_TRIES * 1000
-        for i in results
-    ]
-
-    return f"""
-    <h3>{NUM_OF_TRIES} Run test</h3>
-    <p>
-    <h5>Total Times</h5>
-        <table>
-            <tr>
-                <th style="min-width: 200px;">Category</th>
-                <th>Time [s]</th>
-            </tr>
-            <tr>
-                <td>Total Scenario Search</td>
-                <td>{results[0]:.4f}</td>
-            </tr>
-            <tr>
-                <td>Total Chunks Search</td>
-                <td>{results[1]:.4f}</td>
-            </tr>
-            <tr>
-                <td>Total Search</td>
-                <td>{results[2]:.4f}</td>
-            </tr>
-        </table>
-        <br>
-    </p>
-    <p>
-    <h5>Average Times</h5>
-        <table>
-            <tr>
-                <th style="min-width: 200px;">Category</th>
-                <th>Time [ms]</th>
-            </tr>
-            <tr>
-                <td>Average Scenario Search</td>
-                <td>{avg[0]:.0f}</td>
-            </tr>
-            <tr>
-                <td>Average Chunks Search</td>
-                <td>{avg[1]:.0f}</td>
-            </tr>
-            <tr>
-                <td>Total Average Search</td>
-                <td>{avg[2]:.0f}</td>
-            </tr>
-        </table>
-        <br>
-    </p>
-    """
-
-    return f"{results}\n{avg}"
+    try:
+        keyword_extractor: str = rag.select_keyword_extractor(body.get("keyword_extractor"))
+    except ValueError as error:
+        return str(error), 400
+
+    return flask.Response(
+        flask.stream_with_context(rag.stream_rag_process(user_input, keyword_extractor)),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # nginx must not buffer the events
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+@app.get("/debug/pools")
+def get_pool_stats() -> dict[str, any]:
+    return {
+        "mongo": database.mongo.get_pool_stats(),
+        "postgres": database.postgres.get_pool_stats()
+    }
+
+@app.get("/debug/cache")
+def get_cache_stats() -> dict[str, any]:
+    return {
+        "answers": ragutil.answer_cache.get_stats(),
+        "semantic_answers": ragutil.semantic_cache.get_stats(),
+        "llm": ragutil.llm_cache.get_stats(),
+        "embeddings": util.embedding_cache.get_stats()
+    }
+
+@app.get("/debug/embedding")
+def get_embedding_stats() -> dict[str, any]:
+    return {
+        "backend": util.embedding.EMBEDDING_BACKEND,
+        "batching": util.embedding.batcher.stats(),
+        "service": util.embedding_client.client.stats() if util.embedding_client.is_enabled() else None
+    }
+
+@app.get("/debug/context")
+def get_context_stats() -> dict[str, any]:
+    return {
+        "budget": ragutil.context_assembly.get_stats(),
+        "compression": ragutil.context_compression.get_stats()
+    }
+
+@app.get("/debug/speculation")
+def get_speculation_stats() -> dict[str, any]:
+    return ragutil.speculation.get_stats()
+
+@app.get("/debug/traces")
+def get_traces() -> dict[str, any]:
+    limit: int = flask.request.args.get("limit", 20, type=int)
+    name: str = flask.request.args.get("name")
+
+    return {
+        "traces": util.tracing.get_traces(limit, name)
+    }
+
+@app.get("/metrics")
+def get_metrics() -> flask.Response:
+    return flask.Response(util.metrics.render(), mimetype=util.metrics.CONTENT_TYPE)
+
+@app.get("/debug/warmup")
+def get_warmup_stats() -> dict[str, any]:
+    return ragutil.warmup.get_stats()
 
 @app.get("/health")
 def get_health() -> tuple[str, int]:
+    # Not ready before the warmup (ragutil.warmup) finished
+    if not ragutil.warmup.is_ready():
+        return "", 503
     return "", 200
 
 
-app.run("0.0.0.0", 8001, True)
+# Development server only, production runs on gunicorn (gunicorn.conf.py).
+# The reloader would start a second process and load the model twice.
+if __name__ == "__main__":
+    ragutil.warmup.start()
+    app.run("0.0.0.0", 8001, True, use_reloader=False)
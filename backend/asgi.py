@@ -0,0 +1,177 @@
+"""
+ASGI entry point for the asyncio pipeline (rag_async), next to the Flask app.
+Serves the same routes as app.py (including /api/stream and /metrics) without the debug endpoints.
+
+Usage (from the repository root, like app.py):
+    uvicorn --app-dir backend asgi:app --host 0.0.0.0 --port 8002
+"""
+import sys
+sys.dont_write_bytecode = True
+import json
+import logging
+
+import dotenv
+
+dotenv.load_dotenv()
+
+import database.mongo
+import rag
+import rag_async
+import ragutil.pipeline_metrics
+import ragutil.warmup
+import util.metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout),
+    ],
+)
+
+
+async def read_body(receive) -> bytes:
+    body: bytes = b""
+
+    while True:
+        message: dict[str, any] = await receive()
+        body += message.get("body", b"")
+
+        if not message.get("more_body", False):
+            return body
+
+
+async def send_response(send, status: int, body: str = "", content_type: str = "text/html; charset=utf-8") -> None:
+    encoded: bytes = body.encode("utf-8")
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-length", str(len(encoded)).encode("latin-1")),
+        ],
+    })
+    await send({
+        "type": "http.response.body",
+        "body": encoded,
+    })
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message: dict[str, any] = await receive()
+
+        if message["type"] == "lifespan.startup":
+            # In the background, /health reports ready once it finished
+            ragutil.warmup.start()
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            await rag_async.close()
+            await database.mongo.close_async()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def get_index(scope, receive, send) -> None:
+    with open("backend/index.html", "r", encoding="utf-8") as file:
+        await send_response(send, 200, file.read())
+
+
+async def post_api(scope, receive, send) -> None:
+    try:
+        body = json.loads(await read_body(receive))
+    except ValueError:
+        body = None
+
+    if not isinstance(body, dict) or "user_input" not in body:
+        await send_response(send, 400)
+        return
+    user_input: str = body["user_input"]
+
+    try:
+        keyword_extractor: str = rag.select_keyword_extractor(body.get("keyword_extractor"))
+    except ValueError as error:
+        await send_response(send, 400, str(error))
+        return
+
+    await send_response(send, 200, await rag_async.rag_process(user_input, keyword_extractor))
+
+
+async def post_api_stream(scope, receive, send) -> None:
+    try:
+        body = json.loads(await read_body(receive))
+    except ValueError:
+        body = None
+
+    if not isinstance(body, dict) or "user_input" not in body:
+        await send_response(send, 400)
+        return
+    user_input: str = body["user_input"]
+
+    try:
+        keyword_extractor: str = rag.select_keyword_extractor(body.get("keyword_extractor"))
+    except ValueError as error:
+        await send_response(send, 400, str(error))
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+
+    async for event in rag_async.stream_rag_process(user_input, keyword_extractor):
+        await send({
+            "type": "http.response.body",
+            "body": event.encode("utf-8"),
+            "more_body": True,
+        })
+
+    await send({
+        "type": "http.response.body",
+        "body": b"",
+    })
+
+
+async def get_metrics(scope, receive, send) -> None:
+    await send_response(send, 200, util.metrics.render(), util.metrics.CONTENT_TYPE)
+
+
+async def get_health(scope, receive, send) -> None:
+    await send_response(send, 200 if ragutil.warmup.is_ready() else 503)
+
+
+ROUTES: dict[tuple[str, str], any] = {
+    ("GET", "/"): get_index,
+    ("POST", "/api"): post_api,
+    ("POST", "/api/stream"): post_api_stream,
+    ("GET", "/metrics"): get_metrics,
+    ("GET", "/health"): get_health,
+}
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+
+    if handler is None:
+        await send_response(send, 404)
+        return
+
+    ragutil.pipeline_metrics.in_flight_requests.inc()
+    try:
+        await handler(scope, receive, send)
+    finally:
+        ragutil.pipeline_metrics.in_flight_requests.dec()
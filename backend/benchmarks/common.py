@@ -0,0 +1,52 @@
+"""
+Helpers shared by the benchmark scripts: the query set, chunk texts and percentiles.
+
+Imported as `benchmarks.common` after the script put the backend directory on
+sys.path. Nothing is loaded at import time, the scripts set their environment
+(caches, backends) before importing the pipeline.
+"""
+import os
+
+
+QUERIES_FILE: str = os.path.join(os.path.dirname(__file__), "queries.txt")
+
+
+def load_queries(path: str = QUERIES_FILE) -> list[str]:
+    """
+    One query per line, empty lines and `#` comments are skipped.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        return [
+            line.strip()
+            for line in file
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def load_chunk_texts(limit: int) -> list[str]:
+    """
+    The first `limit` chunk texts of rag::chunks (needs the imported databases).
+    """
+    import database.mongo
+
+    coll = database.mongo.get_collection("chunks")
+
+    return [
+        raw["chunk_text"]
+        for raw in coll.find({}, projection={"chunk_text": True}).limit(limit)
+    ]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """
+    Linear interpolation between the closest ranks, None for no values.
+    """
+    if not values:
+        return None
+
+    ordered: list[float] = sorted(values)
+    position: float = (len(ordered) - 1) * p / 100
+    lower: int = int(position)
+    upper: int = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
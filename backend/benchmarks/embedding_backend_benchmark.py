@@ -0,0 +1,122 @@
+"""
+Latency and throughput of the embedding backends (util.embedding) on the CPU,
+for batch sizes 1, 8, 32 and 128.
+
+Batch size 1 is a query-time call (semantic cache, speculative routing), 8-32
+the keywords or compression units of a request, 128 the import of the chunks.
+Every batch is one `encode` call, the texts are taken round robin from the
+query set (benchmarks/queries.txt) or, with `--chunks N`, from the first N
+chunk texts of rag::chunks (needs the imported databases).
+
+Run it on the node type the backend is deployed on and with the thread count
+of one worker (TORCH_NUM_THREADS in gunicorn.conf.py).
+
+Usage (from the backend directory):
+    python benchmarks/embedding_backend_benchmark.py --threads 4
+    python benchmarks/embedding_backend_benchmark.py --chunks 500 --repetitions 50 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dotenv
+
+dotenv.load_dotenv()
+
+import benchmarks.common
+import util.embedding
+
+
+BATCH_SIZES: list[int] = [1, 8, 32, 128]
+
+
+def build_batches(texts: list[str], batch_size: int, count: int) -> list[list[str]]:
+    batches: list[list[str]] = []
+    position: int = 0
+
+    for _ in range(count):
+        batches.append([texts[(position + i) % len(texts)] for i in range(batch_size)])
+        position += batch_size
+
+    return batches
+
+
+def measure(model, batches: list[list[str]]) -> list[float]:
+    timings: list[float] = []
+
+    for batch in batches:
+        start_time: float = time.perf_counter()
+        model.encode(batch, batch_size=len(batch), convert_to_numpy=True)
+        timings.append(time.perf_counter() - start_time)
+
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latency and throughput of the embedding backends")
+    parser.add_argument("--backends", nargs="+", choices=util.embedding.EMBEDDING_BACKENDS, default=list(util.embedding.EMBEDDING_BACKENDS))
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=BATCH_SIZES)
+    parser.add_argument("--repetitions", type=int, default=20, help="measured encode calls per batch size")
+    parser.add_argument("--warmup", type=int, default=3, help="encode calls per batch size before the measurement")
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads of torch and ONNX Runtime (0: library default)")
+    parser.add_argument("--queries", default=benchmarks.common.QUERIES_FILE, help="query set, one query per line")
+    parser.add_argument("--chunks", type=int, default=0, help="use the first N chunk texts of rag::chunks instead of the queries")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+
+    args: argparse.Namespace = parser.parse_args()
+
+    texts: list[str] = benchmarks.common.load_chunk_texts(args.chunks) if args.chunks > 0 else benchmarks.common.load_queries(args.queries)
+
+    if args.threads > 0:
+        import torch
+
+        torch.set_num_threads(args.threads)
+        # Read when the ONNX session is created (util.embedding.load_model)
+        util.embedding.EMBEDDING_ONNX_THREADS = args.threads
+
+    results: list[dict[str, any]] = []
+
+    for backend in args.backends:
+        load_start: float = time.perf_counter()
+        model = util.embedding.load_model(backend)
+        load_time: float = time.perf_counter() - load_start
+
+        for batch_size in args.batch_sizes:
+            measure(model, build_batches(texts, batch_size, args.warmup))
+            timings: list[float] = measure(model, build_batches(texts, batch_size, args.repetitions))
+
+            results.append({
+                "backend": backend,
+                "batch_size": batch_size,
+                "load_s": load_time,
+                "p50_ms": benchmarks.common.percentile(timings, 50) * 1000,
+                "p95_ms": benchmarks.common.percentile(timings, 95) * 1000,
+                "mean_ms": statistics.mean(timings) * 1000,
+                "per_text_ms": statistics.mean(timings) * 1000 / batch_size,
+                "texts_per_s": batch_size * len(timings) / sum(timings),
+            })
+
+    if args.json:
+        print(json.dumps({
+            "onnx_file": util.embedding.EMBEDDING_ONNX_FILE,
+            "threads": args.threads,
+            "cpus": os.cpu_count(),
+            "texts": "chunks" if args.chunks > 0 else "queries",
+            "results": results,
+        }, indent=2))
+        return
+
+    print(f"{'Backend':>7} | {'Batch':>5} | {'p50 [ms]':>9} | {'p95 [ms]':>9} | {'Per text [ms]':>13} | {'Texts/s':>8}")
+    print("-" * 68)
+
+    for result in results:
+        print(f"{result['backend']:>7} | {result['batch_size']:>5} | {result['p50_ms']:>9.2f} | {result['p95_ms']:>9.2f} | {result['per_text_ms']:>13.3f} | {result['texts_per_s']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
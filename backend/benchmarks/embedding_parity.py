@@ -0,0 +1,104 @@
+"""
+Agreement of the ONNX backend (int8 quantized, util.embedding) with the torch backend.
+
+Encodes the same texts with both backends and compares:
+- the cosine similarity of each ONNX vector with its torch vector
+- the retrieval: per query the top k chunks by cosine similarity, how many of
+  the torch top k the ONNX vectors find as well (overlap@k)
+
+The texts are the query set (benchmarks/queries.txt) and, with `--chunks N`,
+the first N chunk texts of rag::chunks (needs the imported databases).
+Exits with status 1 if the minimum cosine is below `--min-cosine`.
+
+Usage (from the backend directory):
+    python benchmarks/embedding_parity.py --chunks 500
+    EMBEDDING_ONNX_FILE=onnx/model_qint8_avx512_vnni.onnx python benchmarks/embedding_parity.py
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dotenv
+
+dotenv.load_dotenv()
+
+import numpy
+
+import benchmarks.common
+import util.embedding
+
+
+def normalize(embeddings: numpy.ndarray) -> numpy.ndarray:
+    norms: numpy.ndarray = numpy.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / numpy.maximum(norms, 1e-12)
+
+
+def top_k(queries: numpy.ndarray, documents: numpy.ndarray, k: int) -> numpy.ndarray:
+    return numpy.argsort(-(queries @ documents.T), axis=1, kind="stable")[:, :k]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cosine agreement of the ONNX and the torch embedding backend")
+    parser.add_argument("--queries", default=benchmarks.common.QUERIES_FILE, help="query set, one query per line")
+    parser.add_argument("--chunks", type=int, default=0, help="also compare the first N chunk texts of rag::chunks")
+    parser.add_argument("--top-k", type=int, default=5, help="k of the retrieval overlap (needs --chunks)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="fail below this minimum cosine similarity")
+
+    args: argparse.Namespace = parser.parse_args()
+
+    queries: list[str] = benchmarks.common.load_queries(args.queries)
+    chunks: list[str] = benchmarks.common.load_chunk_texts(args.chunks) if args.chunks > 0 else []
+    texts: list[str] = queries + chunks
+
+    embeddings: dict[str, numpy.ndarray] = {}
+    for backend in ("torch", "onnx"):
+        model = util.embedding.load_model(backend)
+        embeddings[backend] = normalize(model.encode(texts, batch_size=args.batch_size, convert_to_numpy=True).astype(numpy.float32))
+
+    cosines: numpy.ndarray = numpy.einsum("ij,ij->i", embeddings["torch"], embeddings["onnx"])
+
+    result: dict[str, any] = {
+        "onnx_file": util.embedding.EMBEDDING_ONNX_FILE,
+        "texts": len(texts),
+        "queries": len(queries),
+        "chunks": len(chunks),
+        "cosine": {
+            "min": float(cosines.min()),
+            "p1": float(numpy.percentile(cosines, 1)),
+            "mean": float(cosines.mean()),
+        },
+        "worst": [
+            {"text": texts[i][:80], "cosine": float(cosines[i])}
+            for i in numpy.argsort(cosines)[:5]
+        ],
+    }
+
+    if chunks:
+        k: int = min(args.top_k, len(chunks))
+        expected: numpy.ndarray = top_k(embeddings["torch"][:len(queries)], embeddings["torch"][len(queries):], k)
+        actual: numpy.ndarray = top_k(embeddings["onnx"][:len(queries)], embeddings["onnx"][len(queries):], k)
+
+        overlaps: list[float] = [
+            len(set(expected_row) & set(actual_row)) / k
+            for expected_row, actual_row in zip(expected.tolist(), actual.tolist())
+        ]
+        result[f"overlap_at_{k}"] = {
+            "mean": sum(overlaps) / len(overlaps),
+            "min": min(overlaps),
+            "top_1_agreement": float((expected[:, 0] == actual[:, 0]).mean()),
+        }
+
+    result["passed"] = result["cosine"]["min"] >= args.min_cosine
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if not result["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
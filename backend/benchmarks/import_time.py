@@ -0,0 +1,122 @@
+"""
+Import time of the server modules, from `python -X importtime`.
+
+Every module is imported in a fresh interpreter (nothing cached in sys.modules),
+the report lists the total and the slowest direct imports of the module by
+cumulative time (including everything they import themselves).
+
+The heavy dependencies (sentence_transformers/torch, pgvector, marko) are loaded
+on first use (ragutil.warmup), none of them should show up for `app` or `asgi`.
+Run it with the .env of the server, app.py and asgi.py load it at import time.
+
+Usage (from the backend directory):
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py app util.embedding --top 20 --output import_time.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+BACKEND_DIRECTORY: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_MODULES: tuple[str, ...] = ("app", "asgi", "rag", "util.embedding")
+HEAVY_MODULES: tuple[str, ...] = ("torch", "sentence_transformers", "transformers", "pgvector", "marko")
+
+
+def measure(module: str) -> list[dict[str, any]]:
+    """
+    The `-X importtime` lines of importing `module`, in import order.
+    """
+    completed: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIRECTORY,
+        capture_output=True,
+        text=True
+    )
+
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+
+    imports: list[dict[str, any]] = []
+
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+
+        imports.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+
+    return imports
+
+
+def report(module: str, top: int) -> dict[str, any]:
+    imports: list[dict[str, any]] = measure(module)
+    position: int = max(i for i, entry in enumerate(imports) if entry["module"] == module and entry["depth"] == 0)
+    measured: dict[str, any] = imports[position]
+
+    # A module is printed after its imports: the direct imports of the measured
+    # module are the depth 1 lines since the previous top-level import
+    start: int = max((i + 1 for i in range(position) if imports[i]["depth"] == 0), default=0)
+    listed: list[dict[str, any]] = [
+        entry
+        for entry in imports[start:position]
+        if entry["depth"] == 1
+    ]
+    listed.sort(key=lambda entry: entry["cumulative_ms"], reverse=True)
+
+    loaded: set[str] = {entry["module"].split(".")[0] for entry in imports}
+
+    return {
+        "module": module,
+        "total_ms": measured["cumulative_ms"],
+        "modules_imported": len(imports),
+        "heavy_modules_imported": [name for name in HEAVY_MODULES if name in loaded],
+        "slowest": [
+            {"module": entry["module"], "cumulative_ms": entry["cumulative_ms"], "self_ms": entry["self_ms"]}
+            for entry in listed[:top]
+        ],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import time report of the backend modules")
+    parser.add_argument("modules", nargs="*", default=list(DEFAULT_MODULES))
+    parser.add_argument("--top", type=int, default=15, help="slowest imports listed per module")
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+
+    args: argparse.Namespace = parser.parse_args()
+
+    reports: list[dict[str, any]] = [
+        report(module, args.top)
+        for module in args.modules
+    ]
+
+    output: str = json.dumps({"python": sys.version.split()[0], "reports": reports}, indent=2)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+
+    if args.json:
+        print(output)
+        return
+
+    for result in reports:
+        print(f"import {result['module']}: {result['total_ms']:.1f} ms, {result['modules_imported']} modules, heavy: {', '.join(result['heavy_modules_imported']) or '-'}")
+        for entry in result["slowest"]:
+            print(f"  {entry['cumulative_ms']:>10.1f} ms  {entry['module']}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compares per-keyword embedding against one batched encode call
+for 1-10 keywords (as returned by the keyword extraction).
+
+Usage (from the backend directory):
+    python benchmarks/keyword_embedding_benchmark.py [repetitions]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import util.embedding
+
+
+KEYWORDS: list[str] = [
+    "Backrezepte",
+    "Datenbank",
+    "Verwaltung",
+    "Anleitung",
+    "Zutaten",
+    "Rezeptdatenbank",
+    "Nährwerte",
+    "Zubereitung",
+    "Rezeptsoftware",
+    "Bäckerei"
+]
+
+
+def measure(function, keywords: list[str], repetitions: int) -> list[float]:
+    timings: list[float] = []
+
+    for _ in range(repetitions):
+        start_time: float = time.perf_counter()
+        function(keywords)
+        timings.append(time.perf_counter() - start_time)
+
+    return timings
+
+
+def per_keyword(keywords: list[str]) -> None:
+    for keyword in keywords:
+        util.embedding.build_embedding(keyword)
+
+
+def batched(keywords: list[str]) -> None:
+    util.embedding.build_embeddings(keywords)
+
+
+def main() -> None:
+    repetitions: int = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    # Warmup, the first encode call initializes the torch kernels
+    batched(KEYWORDS)
+    per_keyword(KEYWORDS)
+
+    print(f"{'Keywords':>8} | {'Per keyword [ms]':>16} | {'Batched [ms]':>12} | {'Speedup':>7}")
+    print("-" * 54)
+
+    for number_of_keywords in range(1, len(KEYWORDS) + 1):
+        keywords: list[str] = KEYWORDS[:number_of_keywords]
+
+        loop_ms: float = statistics.median(measure(per_keyword, keywords, repetitions)) * 1000
+        batch_ms: float = statistics.median(measure(batched, keywords, repetitions)) * 1000
+
+        print(f"{number_of_keywords:>8} | {loop_ms:>16.2f} | {batch_ms:>12.2f} | {loop_ms / batch_ms:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
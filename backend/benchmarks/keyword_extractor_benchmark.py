@@ -0,0 +1,87 @@
+"""
+Compares the local keyword extractor (ragutil.keyword_extraction) with the
+LLM extractor (Perplexity, rag.extract_keywords): latency and whether both
+keyword lists route to the same scenarios.
+
+`ingest/promts.txt` only holds the prompt templates, the user prompts are
+read from `benchmarks/queries.txt` (one per line).
+
+Needs the imported databases (start_setup.py) and PERPLEXITY_API_KEY.
+The embedding cache is disabled so that the local timings include encoding.
+
+Usage (from the backend directory):
+    python benchmarks/keyword_extractor_benchmark.py [queries_file]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dotenv
+
+dotenv.load_dotenv()
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "0")
+
+import benchmarks.common
+import rag
+import ragutil.keyword_extraction
+import ragutil.scenario_index
+import ragutil.scenario_search
+
+
+NUMBER_OF_SCENARIOS: int = 2
+
+
+def main() -> None:
+    queries: list[str] = benchmarks.common.load_queries(sys.argv[1] if len(sys.argv) > 1 else benchmarks.common.QUERIES_FILE)
+    snapshot: ragutil.scenario_index.ScenarioSnapshot = ragutil.scenario_index.load()
+
+    # Warmup (model, tokenizer)
+    ragutil.keyword_extraction.extract_keywords(queries[0])
+
+    llm_timings: list[float] = []
+    local_timings: list[float] = []
+    top_1_agreements: int = 0
+    overlaps: list[float] = []
+    compared: int = 0
+
+    for query in queries:
+        start_time: float = time.perf_counter()
+        llm_keywords: list[str] = rag.extract_keywords(rag.perplexity_client, query, False)
+        llm_timings.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        local_keywords: list[str] = ragutil.keyword_extraction.extract_keywords(query)
+        local_timings.append(time.perf_counter() - start_time)
+
+        print(f"\n{query[:80]}")
+        print(f"  LLM:   {llm_keywords}")
+        print(f"  Local: {local_keywords}")
+
+        if not llm_keywords:
+            print("  LLM extraction failed, skipped")
+            continue
+
+        llm_ids: list[int] = [s.id for s in ragutil.scenario_search.match_keywords(llm_keywords, NUMBER_OF_SCENARIOS, snapshot)]
+        local_ids: list[int] = [s.id for s in ragutil.scenario_search.match_keywords(local_keywords, NUMBER_OF_SCENARIOS, snapshot)]
+
+        compared += 1
+        top_1_agreements += int(llm_ids[:1] == local_ids[:1])
+        overlaps.append(len(set(llm_ids) & set(local_ids)) / max(len(llm_ids), 1))
+
+        print(f"  Scenarios LLM {llm_ids} / local {local_ids}")
+
+    print("\n" + "-" * 56)
+    print(f"{'Queries':<32} {len(queries):>10}")
+    print(f"{'LLM median latency [ms]':<32} {statistics.median(llm_timings) * 1000:>10.1f}")
+    print(f"{'Local median latency [ms]':<32} {statistics.median(local_timings) * 1000:>10.1f}")
+
+    if compared:
+        print(f"{'Top-1 scenario agreement':<32} {top_1_agreements / compared:>10.1%}")
+        print(f"{f'Top-{NUMBER_OF_SCENARIOS} scenario overlap':<32} {statistics.mean(overlaps):>10.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Load test for the query path, replaces the sequential /api-debug loop.
+
+Sends the queries of a fixed query set (default `benchmarks/queries.txt`, one per
+line, `ingest/promts.txt` only holds the prompt templates) with N concurrent
+clients, after a warmup, until an iteration or duration limit is reached.
+Prints the results as JSON: throughput, errors and latency percentiles
+(p50/p95/p99), in-process also per pipeline stage (from util.tracing).
+
+Targets:
+- http: POST requests against a running server (app.py, asgi.py or a production
+  entry point). HTTP errors and the error messages of the pipeline
+  (rag.ERROR_MESSAGES, returned with status 200) are counted as errors. Start
+  the server with ANSWER_CACHE_ENABLED=0 SEMANTIC_CACHE_ENABLED=0 to measure
+  uncached requests.
+- process: rag.rag_process in this process, needs the imported databases
+  (start_setup.py) and PERPLEXITY_API_KEY unless `--keyword-extractor local`
+  and LLM_CACHE_FINAL_RESULTS=1 with a warm cache. The answer caches are
+  disabled unless `--answer-cache` is given.
+
+Usage (from the backend directory):
+    python benchmarks/load_test.py --concurrency 8 --warmup 10 --iterations 200
+    python benchmarks/load_test.py --target process --keyword-extractor local --duration 60
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dotenv
+import requests
+
+dotenv.load_dotenv()
+
+import benchmarks.common
+
+
+DEFAULT_URL: str = "http://localhost:8001/api"
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """
+    Latency summary in milliseconds.
+    """
+    if not values:
+        return {}
+
+    return {
+        "min": min(values) * 1000,
+        "mean": statistics.mean(values) * 1000,
+        "p50": benchmarks.common.percentile(values, 50) * 1000,
+        "p95": benchmarks.common.percentile(values, 95) * 1000,
+        "p99": benchmarks.common.percentile(values, 99) * 1000,
+        "max": max(values) * 1000,
+    }
+
+
+class HttpTarget(object):
+
+    def __init__(self, url: str, keyword_extractor: str, timeout: float):
+        # Only for the error messages, importing it loads neither torch nor the databases
+        import rag
+
+        self.error_messages: tuple[str, ...] = rag.ERROR_MESSAGES
+        self.url: str = url
+        self.keyword_extractor: str = keyword_extractor
+        self.timeout: float = timeout
+        # One session (keep-alive connection) per client thread
+        self._local: threading.local = threading.local()
+
+    def _get_session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def __call__(self, query: str) -> bool:
+        body: dict[str, str] = {"user_input": query}
+        if self.keyword_extractor is not None:
+            body["keyword_extractor"] = self.keyword_extractor
+
+        response: requests.Response = self._get_session().post(self.url, json=body, timeout=self.timeout)
+        return response.status_code == 200 and response.text not in self.error_messages
+
+
+class ProcessTarget(object):
+    """
+    Calls the pipeline in this process, the stage durations are collected from its traces.
+    """
+
+    def __init__(self, keyword_extractor: str, answer_cache: bool):
+        if not answer_cache:
+            # Repeated queries would only measure the answer caches
+            os.environ.setdefault("ANSWER_CACHE_ENABLED", "0")
+            os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "0")
+
+        # Imported after the cache settings above, they are read at import time
+        import rag
+        import ragutil.warmup
+        import util.tracing
+
+        self.rag = rag
+        self.keyword_extractor: str = rag.select_keyword_extractor(keyword_extractor)
+        self.recording: bool = False
+        self.stages: dict[str, list[float]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+        # Model, pools and snapshot are loaded before the first measured request
+        ragutil.warmup.warmup()
+        util.tracing.add_listener(self._observe)
+
+    def _observe(self, trace) -> None:
+        if not self.recording:
+            return
+
+        root = trace.spans[0]
+
+        with self._lock:
+            for child in root.children:
+                if child.duration is not None:
+                    self.stages.setdefault(child.name, []).append(child.duration)
+
+    def __call__(self, query: str) -> bool:
+        answer: str = self.rag.rag_process(query, self.keyword_extractor)
+        return answer not in self.rag.ERROR_MESSAGES
+
+
+class LoadTest(object):
+
+    def __init__(self, target, queries: list[str], concurrency: int):
+        self.target = target
+        self.queries: list[str] = queries
+        self.concurrency: int = concurrency
+
+        self._lock: threading.Lock = threading.Lock()
+        self._next_query: int = 0
+
+    def _take(self, remaining: list[int], deadline: float) -> str:
+        """
+        Next query of the round robin, None once the limit is reached.
+        """
+        with self._lock:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return None
+                remaining[0] -= 1
+
+            query: str = self.queries[self._next_query % len(self.queries)]
+            self._next_query += 1
+            return query
+
+    def run(self, iterations: int = None, duration: float = None) -> tuple[list[float], int, float]:
+        """
+        Returns the latencies of the successful requests, the number of errors and the wall time.
+        """
+        latencies: list[float] = []
+        errors: list[int] = [0]
+        remaining: list[int] = [iterations] if iterations is not None else None
+
+        start_time: float = time.perf_counter()
+        deadline: float = start_time + duration if duration is not None else None
+
+        def client() -> None:
+            while True:
+                query: str = self._take(remaining, deadline)
+                if query is None:
+                    return
+
+                request_start: float = time.perf_counter()
+                try:
+                    ok: bool = self.target(query)
+                except Exception as e:
+                    print(f"Request failed: {e!r}", file=sys.stderr)
+                    ok = False
+                latency: float = time.perf_counter() - request_start
+
+                with self._lock:
+                    if ok:
+                        latencies.append(latency)
+                    else:
+                        errors[0] += 1
+
+        clients: list[threading.Thread] = [
+            threading.Thread(target=client, name=f"load-test-{i}")
+            for i in range(self.concurrency)
+        ]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+
+        return latencies, errors[0], time.perf_counter() - start_time
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test for the RAG query path")
+    parser.add_argument("--target", choices=("http", "process"), default="http")
+    parser.add_argument("--url", default=DEFAULT_URL, help="API endpoint of the http target")
+    parser.add_argument("--queries", default=benchmarks.common.QUERIES_FILE, help="query set, one query per line")
+    parser.add_argument("--keyword-extractor", choices=("llm", "local"), default=None)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=5, help="requests before the measurement, not recorded")
+    parser.add_argument("--iterations", type=int, default=None, help="measured requests (default 100 without --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="measured seconds")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer caches enabled (process target)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="http request timeout in seconds")
+    parser.add_argument("--output", default=None, help="also write the JSON result to this file")
+
+    args: argparse.Namespace = parser.parse_args()
+
+    if args.iterations is None and args.duration is None:
+        args.iterations = 100
+
+    return args
+
+
+def main() -> None:
+    args: argparse.Namespace = parse_args()
+    queries: list[str] = benchmarks.common.load_queries(args.queries)
+
+    # The pipeline prints its routing results, stdout is reserved for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.target == "process":
+            target = ProcessTarget(args.keyword_extractor, args.answer_cache)
+        else:
+            target = HttpTarget(args.url, args.keyword_extractor, args.timeout)
+
+        load_test: LoadTest = LoadTest(target, queries, args.concurrency)
+
+        if args.warmup > 0:
+            load_test.run(iterations=args.warmup)
+
+        if args.target == "process":
+            target.recording = True
+
+        latencies, errors, wall_time = load_test.run(args.iterations, args.duration)
+
+    result: dict[str, any] = {
+        "config": {
+            "target": args.target,
+            "url": args.url if args.target == "http" else None,
+            "keyword_extractor": args.keyword_extractor,
+            "answer_cache": args.answer_cache if args.target == "process" else None,
+            "queries": len(queries),
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "iterations": args.iterations,
+            "duration": args.duration,
+        },
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "error_rate": errors / (len(latencies) + errors) if latencies or errors else 0.0,
+        "wall_time_s": wall_time,
+        "throughput_rps": len(latencies) / wall_time if wall_time else 0.0,
+        "latency_ms": summarize(latencies),
+    }
+
+    if args.target == "process":
+        result["stages_ms"] = {
+            name: summarize(durations)
+            for name, durations in target.stages.items()
+        }
+
+    output: str = json.dumps(result, indent=2)
+    print(output)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Compares N separate `$vectorSearch` aggregates (sequential and on the retrieval
+thread pool) against one batched aggregate with `$unionWith` sub-pipelines,
+for N = 5, 10 and 20 scenario questions.
+
+Needs the imported databases (start_setup.py).
+
+Usage (from the backend directory):
+    python benchmarks/multi_vector_search_benchmark.py [repetitions]
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import dotenv
+
+dotenv.load_dotenv()
+
+import ragutil.chunks_search
+import ragutil.scenario_index
+import util.scenario
+
+
+NUMBER_OF_CHUNKS: int = 2
+QUESTION_COUNTS: list[int] = [5, 10, 20]
+
+
+def measure(function, questions: list[util.scenario.ScenarioQuestion], repetitions: int) -> list[float]:
+    timings: list[float] = []
+
+    for _ in range(repetitions):
+        start_time: float = time.perf_counter()
+        function(questions)
+        timings.append(time.perf_counter() - start_time)
+
+    return timings
+
+
+def sequential(questions: list[util.scenario.ScenarioQuestion]) -> list[list]:
+    return [
+        ragutil.chunks_search.search_chunks_for_scenario_question(question, NUMBER_OF_CHUNKS)
+        for question in questions
+    ]
+
+
+def concurrent(questions: list[util.scenario.ScenarioQuestion]) -> list[list]:
+    return ragutil.chunks_search._search_concurrently(questions, NUMBER_OF_CHUNKS)
+
+
+def batched(questions: list[util.scenario.ScenarioQuestion]) -> list[list]:
+    return ragutil.chunks_search.search_chunks_for_scenario_questions(questions, NUMBER_OF_CHUNKS)
+
+
+def main() -> None:
+    repetitions: int = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    snapshot: ragutil.scenario_index.ScenarioSnapshot = ragutil.scenario_index.load()
+    all_questions: list[util.scenario.ScenarioQuestion] = snapshot.questions
+
+    if len(all_questions) < max(QUESTION_COUNTS):
+        print(f"Only {len(all_questions)} scenario questions imported, need {max(QUESTION_COUNTS)}")
+        return
+
+    # Warmup (connection pool, search index caches) and a sanity check of the batched results
+    questions: list[util.scenario.ScenarioQuestion] = all_questions[:max(QUESTION_COUNTS)]
+    if [[c.chunk_id for c in r] for r in sequential(questions)] != [[c.chunk_id for c in r] for r in batched(questions)]:
+        print("Warning: batched results differ from the separate searches")
+    concurrent(questions)
+
+    print(f"{'N':>3} | {'Sequential [ms]':>15} | {'Concurrent [ms]':>15} | {'Batched [ms]':>12}")
+    print("-" * 56)
+
+    for question_count in QUESTION_COUNTS:
+        questions = all_questions[:question_count]
+
+        sequential_ms: float = statistics.median(measure(sequential, questions, repetitions)) * 1000
+        concurrent_ms: float = statistics.median(measure(concurrent, questions, repetitions)) * 1000
+        batched_ms: float = statistics.median(measure(batched, questions, repetitions)) * 1000
+
+        print(f"{question_count:>3} | {sequential_ms:>15.2f} | {concurrent_ms:>15.2f} | {batched_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
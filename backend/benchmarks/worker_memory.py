@@ -0,0 +1,105 @@
+"""
+Memory per process of a running gunicorn server (gunicorn.conf.py): the master and its workers.
+
+RSS counts every resident page, including the ones shared copy-on-write with the
+master, so it overstates the cost of a worker. PSS splits shared pages between
+the processes sharing them; the sum of PSS is the real memory use of the server.
+Private_Dirty is what a worker has written on its own (or copied from the master).
+
+Read from /proc/<pid>/smaps_rollup (Linux 4.14+), run it against a server with
+the default settings and against one with GUNICORN_PRELOAD=0 to compare.
+Send a few requests first (benchmarks/load_test.py), the workers only touch
+most of the model pages once they encode.
+
+Usage (from the backend directory):
+    python benchmarks/worker_memory.py <master pid> [--json]
+"""
+import json
+import os
+import sys
+
+
+FIELDS: tuple[str, ...] = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def read_rollup(pid: int) -> dict[str, float]:
+    """
+    The FIELDS of the process in MiB.
+    """
+    values: dict[str, float] = {}
+
+    with open(f"/proc/{pid}/smaps_rollup", "r", encoding="utf-8") as file:
+        for line in file:
+            name, _, rest = line.partition(":")
+
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+
+    return values
+
+
+def get_children(pid: int) -> list[int]:
+    children: list[int] = []
+
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(f"/proc/{entry}/stat", "r", encoding="utf-8") as file:
+                # The command name may contain spaces, the fields after it do not
+                parent: int = int(file.read().rpartition(")")[2].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+
+        if parent == pid:
+            children.append(int(entry))
+
+    return sorted(children)
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    master: int = int(sys.argv[1])
+    processes: list[tuple[str, int]] = [("master", master)] + [
+        ("worker", pid)
+        for pid in get_children(master)
+    ]
+
+    rows: list[dict[str, any]] = [
+        {"role": role, "pid": pid, **read_rollup(pid)}
+        for role, pid in processes
+    ]
+    workers: list[dict[str, any]] = [row for row in rows if row["role"] == "worker"]
+
+    summary: dict[str, any] = {
+        "workers": len(workers),
+        "total_pss": sum(row["Pss"] for row in rows),
+        "total_rss": sum(row["Rss"] for row in rows),
+        "avg_worker_rss": sum(row["Rss"] for row in workers) / len(workers) if workers else 0.0,
+        "avg_worker_pss": sum(row["Pss"] for row in workers) / len(workers) if workers else 0.0,
+        "avg_worker_private_dirty": sum(row["Private_Dirty"] for row in workers) / len(workers) if workers else 0.0,
+    }
+
+    if "--json" in sys.argv:
+        print(json.dumps({"processes": rows, "summary_mib": summary}, indent=2))
+        return
+
+    print(f"{'Role':<8} {'PID':>8} " + " ".join(f"{field:>14}" for field in FIELDS))
+    for row in rows:
+        print(f"{row['role']:<8} {row['pid']:>8} " + " ".join(f"{row.get(field, 0.0):>14.1f}" for field in FIELDS))
+
+    print("-" * 56)
+    print(f"{'Workers':<32} {summary['workers']:>10}")
+    print(f"{'Total PSS [MiB]':<32} {summary['total_pss']:>10.1f}")
+    print(f"{'Total RSS [MiB]':<32} {summary['total_rss']:>10.1f}")
+    print(f"{'Avg worker RSS [MiB]':<32} {summary['avg_worker_rss']:>10.1f}")
+    print(f"{'Avg worker PSS [MiB]':<32} {summary['avg_worker_pss']:>10.1f}")
+    print(f"{'Avg worker Private_Dirty [MiB]':<32} {summary['avg_worker_private_dirty']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,211 @@
-import contextlib
+import logging
 import os
+import threading
 import pymongo
+import pymongo.asynchronous.collection
+import pymongo.collection
+import pymongo.monitoring
 
 
 MONGO_HOST: str = os.getenv("MONGO_HOST", "127.0.0.1")
+MONGO_PORT: int = int(os.getenv("MONGO_PORT", "27017"))
+MONGO_MAX_POOL_SIZE: int = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE: int = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS: int = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_CONNECT_TIMEOUT_MS: int = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS: int = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS: int = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
 
-@contextlib.contextmanager
-def create_connection():
-    mongo_client: pymongo.MongoClient = pymongo.MongoClient(f"mongodb://127.0.0.1:27017/?directConnection=true&appName=mongosh")
-    yield mongo_client
-    mongo_client.close()
+
+class PoolStatistics(pymongo.monitoring.ConnectionPoolListener):
+    """
+    Collects connection pool events of the process-wide client for monitoring.
+    """
+
+    def __init__(self):
+        self._lock: threading.Lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.open_connections: int = 0
+            self.checked_out: int = 0
+            self.total_checkouts: int = 0
+            self.failed_checkouts: int = 0
+            self.created_connections: int = 0
+            self.closed_connections: int = 0
+            self.pool_clears: int = 0
+            self.total_wait_time: float = 0.0
+            self.max_wait_time: float = 0.0
+
+    def to_dict(self) -> dict[str, any]:
+        with self._lock:
+            return {
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "total_checkouts": self.total_checkouts,
+                "failed_checkouts": self.failed_checkouts,
+                "created_connections": self.created_connections,
+                "closed_connections": self.closed_connections,
+                "pool_clears": self.pool_clears,
+                "total_wait_time": self.total_wait_time,
+                "max_wait_time": self.max_wait_time,
+            }
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            self.open_connections += 1
+            self.created_connections += 1
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        with self._lock:
+            self.open_connections -= 1
+            self.closed_connections += 1
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        with self._lock:
+            self.failed_checkouts += 1
+
+    def connection_checked_out(self, event) -> None:
+        # `duration` (seconds waited for the connection) is set by pymongo >= 4.7
+        duration: float = getattr(event, "duration", None) or 0.0
+
+        with self._lock:
+            self.checked_out += 1
+            self.total_checkouts += 1
+            self.total_wait_time += duration
+            self.max_wait_time = max(self.max_wait_time, duration)
+
+    def connection_checked_in(self, event) -> None:
+        with self._lock:
+            self.checked_out -= 1
+
+
+pool_statistics: PoolStatistics = PoolStatistics()
+
+_client: pymongo.MongoClient = None
+_client_pid: int = None
+_client_lock: threading.Lock = threading.Lock()
+# Used by the asyncio pipeline (rag_async), bound to the event loop it is first used in
+_async_client: pymongo.AsyncMongoClient = None
+
+
+def _reset_after_fork() -> None:
+    """
+    A MongoClient must not be used across fork(), its sockets and monitor
+    threads belong to the parent. The child creates its own client on first use.
+    """
+    global _client, _client_pid, _client_lock, _async_client
+
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+    _async_client = None
+    pool_statistics.reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _client_options() -> dict[str, any]:
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "event_listeners": [pool_statistics],
+    }
+
+
+def _connection_string() -> str:
+    return f"mongodb://{MONGO_HOST}:{MONGO_PORT}/?directConnection=true&appName=rag-backend"
+
+
+def get_client() -> pymongo.MongoClient:
+    """
+    Returns the process-wide client. It owns a connection pool and is
+    safe to share between threads, so it is never closed by callers.
+    """
+    global _client, _client_pid
+
+    client: pymongo.MongoClient = _client
+
+    if client is not None and _client_pid == os.getpid():
+        return client
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            logging.info(f"Connecting to MongoDB at {MONGO_HOST}:{MONGO_PORT} (maxPoolSize={MONGO_MAX_POOL_SIZE})")
+
+            _client = pymongo.MongoClient(_connection_string(), **_client_options())
+            _client_pid = os.getpid()
+
+        return _client
+
+
+def get_collection(collection_name: str, database_name: str = "rag") -> pymongo.collection.Collection:
+    return get_client()[database_name][collection_name]
+
+
+def get_async_client() -> pymongo.AsyncMongoClient:
+    """
+    Process-wide asyncio client (pymongo >= 4.9). Must only be used from one event loop,
+    the ASGI server runs exactly one per worker.
+    """
+    global _async_client
+
+    if _async_client is None:
+        _async_client = pymongo.AsyncMongoClient(_connection_string(), **_client_options())
+
+    return _async_client
+
+
+def get_async_collection(collection_name: str, database_name: str = "rag") -> pymongo.asynchronous.collection.AsyncCollection:
+    return get_async_client()[database_name][collection_name]
+
+
+async def close_async() -> None:
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+
+
+def get_pool_stats() -> dict[str, any]:
+    return pool_statistics.to_dict()
+
+
+def close() -> None:
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+
+        _client = None
+        _client_pid = None
@@ -1,29 +1,327 @@
 import contextlib
 import os
+import threading
+import time
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 
 POSTGRES_HOST: str = os.getenv("POSTGRES_HOST", "127.0.0.1")
+POSTGRES_PORT: str = os.getenv("POSTGRES_PORT", "5432")
 POSTGRES_USER: str = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", "password")
 
+POSTGRES_POOL_MIN_SIZE: int = int(os.getenv("POSTGRES_POOL_MIN_SIZE", "1"))
+POSTGRES_POOL_MAX_SIZE: int = int(os.getenv("POSTGRES_POOL_MAX_SIZE", "10"))
+# Seconds a checkout waits for a free connection before failing
+POSTGRES_POOL_TIMEOUT: float = float(os.getenv("POSTGRES_POOL_TIMEOUT", "10"))
+# Seconds after which a connection is closed and replaced on its next checkout
+POSTGRES_MAX_LIFETIME: float = float(os.getenv("POSTGRES_MAX_LIFETIME", "1800"))
+# Connections idle for longer than this are pinged before being handed out
+POSTGRES_HEALTH_CHECK_IDLE: float = float(os.getenv("POSTGRES_HEALTH_CHECK_IDLE", "30"))
+
+
+class PoolTimeoutError(psycopg2.pool.PoolError):
+    pass
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection with the bookkeeping the pool needs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at: float = time.monotonic()
+        self.last_used: float = self.created_at
+        self.vector_registered: bool = False
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool in the style of psycopg2.pool.ThreadedConnectionPool.
+    Unlike the psycopg2 pool a checkout blocks (up to POSTGRES_POOL_TIMEOUT) when all
+    connections are in use, connections are health-checked, recycled after
+    POSTGRES_MAX_LIFETIME and pgvector is registered once per physical connection.
+    """
+
+    def __init__(self, database_name: str, min_size: int = POSTGRES_POOL_MIN_SIZE, max_size: int = POSTGRES_POOL_MAX_SIZE):
+        self.database_name: str = database_name
+        self.min_size: int = min_size
+        self.max_size: int = max_size
+
+        self._idle: list[PooledConnection] = []
+        self._size: int = 0
+        self._condition: threading.Condition = threading.Condition()
+
+        self._checkouts: int = 0
+        self._waits: int = 0
+        self._timeouts: int = 0
+        self._total_wait_time: float = 0.0
+        self._max_wait_time: float = 0.0
+        self._created: int = 0
+        self._recycled: int = 0
+        self._broken: int = 0
+
+    def _connect(self) -> PooledConnection:
+        connection: PooledConnection = psycopg2.connect(
+            database=self.database_name,
+            host=POSTGRES_HOST,
+            user=POSTGRES_USER,
+            password=POSTGRES_PASSWORD,
+            port=POSTGRES_PORT,
+            connection_factory=PooledConnection
+        )
+
+        try:
+            self._register_vector(connection)
+        except Exception:
+            self._close(connection)
+            raise
+
+        with self._condition:
+            self._created += 1
+        return connection
+
+    @staticmethod
+    def _register_vector(connection: PooledConnection) -> None:
+        # Imported on the first connection, not with the module
+        import pgvector.psycopg2
+
+        try:
+            pgvector.psycopg2.register_vector(connection)
+            connection.vector_registered = True
+        except psycopg2.ProgrammingError:
+            # Extension not created yet (fresh database before setup), retried on the next checkout
+            pass
+        finally:
+            connection.rollback()
+
+    @staticmethod
+    def _close(connection: PooledConnection) -> None:
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    @staticmethod
+    def _check(connection: PooledConnection) -> str:
+        """
+        Returns why the connection must not be handed out ("broken", "recycled") or None.
+        """
+        if connection.closed:
+            return "broken"
+
+        now: float = time.monotonic()
+
+        if now - connection.created_at > POSTGRES_MAX_LIFETIME:
+            return "recycled"
+
+        if now - connection.last_used > POSTGRES_HEALTH_CHECK_IDLE:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                connection.rollback()
+            except psycopg2.Error:
+                return "broken"
+
+        return None
+
+    def getconn(self, timeout: float = POSTGRES_POOL_TIMEOUT) -> PooledConnection:
+        start_time: float = time.perf_counter()
+        waited: bool = False
+
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    waited = True
+                    remaining: float = timeout - (time.perf_counter() - start_time)
+
+                    if remaining <= 0 or not self._condition.wait(remaining):
+                        if not self._idle and self._size >= self.max_size:
+                            self._timeouts += 1
+                            raise PoolTimeoutError(f"No PostgreSQL connection available after {timeout:.1f}s (max_size={self.max_size})")
+
+                if self._idle:
+                    connection: PooledConnection = self._idle.pop()
+                else:
+                    # Reserve the slot, connecting happens outside of the lock
+                    connection = None
+                    self._size += 1
+
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+            else:
+                reason: str = self._check(connection)
+
+                if reason is not None:
+                    self._close(connection)
+                    with self._condition:
+                        self._size -= 1
+                        if reason == "recycled":
+                            self._recycled += 1
+                        else:
+                            self._broken += 1
+                        self._condition.notify()
+                    continue
+
+            break
+
+        if not connection.vector_registered:
+            try:
+                self._register_vector(connection)
+            except Exception:
+                # The connection has left the pool, give its slot back
+                self.putconn(connection, discard=True)
+                raise
+
+        wait_time: float = time.perf_counter() - start_time
+
+        with self._condition:
+            self._checkouts += 1
+            self._total_wait_time += wait_time
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            if waited:
+                self._waits += 1
+
+        return connection
+
+    def putconn(self, connection: PooledConnection, discard: bool = False) -> None:
+        if not discard and not connection.closed:
+            status: int = connection.get_transaction_status()
+
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if discard or connection.closed:
+            self._close(connection)
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            return
+
+        connection.last_used = time.monotonic()
+
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def fill(self) -> None:
+        """
+        Opens connections up to min_size, e.g. during startup.
+        """
+        connections: list[PooledConnection] = []
+
+        with self._condition:
+            missing: int = self.min_size - self._size
+
+        for _ in range(max(missing, 0)):
+            connections.append(self.getconn())
+
+        for connection in connections:
+            self.putconn(connection)
+
+    def closeall(self) -> None:
+        with self._condition:
+            for connection in self._idle:
+                self._close(connection)
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def stats(self) -> dict[str, any]:
+        with self._condition:
+            return {
+                "database": self.database_name,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "total_wait_time": self._total_wait_time,
+                "max_wait_time": self._max_wait_time,
+                "avg_wait_time": self._total_wait_time / self._checkouts if self._checkouts else 0.0,
+                "created_connections": self._created,
+                "recycled_connections": self._recycled,
+                "broken_connections": self._broken,
+            }
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock: threading.Lock = threading.Lock()
+# Connections inherited through fork() belong to the parent, closing (or garbage
+# collecting) them in the child would terminate the parent's sessions
+_inherited_pools: list[ConnectionPool] = []
+
+
+def _reset_after_fork() -> None:
+    global _pools, _pools_lock
+
+    _inherited_pools.extend(_pools.values())
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_pool(database_name: str = "rag") -> ConnectionPool:
+    pool: ConnectionPool = _pools.get(database_name)
+
+    if pool is not None:
+        return pool
+
+    with _pools_lock:
+        if database_name not in _pools:
+            _pools[database_name] = ConnectionPool(database_name)
+        return _pools[database_name]
+
+
+def get_pool_stats() -> list[dict[str, any]]:
+    return [
+        pool.stats()
+        for pool in list(_pools.values())
+    ]
+
+
+def close_pools() -> None:
+    for pool in list(_pools.values()):
+        pool.closeall()
+
+
 @contextlib.contextmanager
 def create_connection(database_name: str):
-    connection = psycopg2.connect(
-        database=database_name,
-        host=POSTGRES_HOST,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-        port="5432"
-    )
-    yield connection
-    connection.close()
+    """
+    Checks a connection out of the pool of `database_name` and returns it afterwards.
+    Uncommitted work is rolled back on return.
+    """
+    pool: ConnectionPool = get_pool(database_name)
+    connection: PooledConnection = pool.getconn()
+
+    try:
+        yield connection
+    finally:
+        # Broken connections (closed != 0) are discarded by putconn
+        pool.putconn(connection)
 
 
-def execute(query: str, database_name: str = "rag") -> None:
+def execute(query: str, database_name: str = "rag", args: tuple[any] = None) -> None:
 
     with create_connection(database_name=database_name) as connection:
         cursor = connection.cursor()
-        cursor.execute(query)
+        cursor.execute(query, args)
         connection.commit()
 
 
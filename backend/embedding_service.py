@@ -0,0 +1,179 @@
+"""
+Local embedding service: one process per host owns the model (util.embedding),
+the API workers and the import scripts send their texts over a Unix socket
+instead of loading torch and the model themselves.
+
+Protocol and client: util.embedding_client. The vectors are written into the
+shared memory segment of the requesting connection, not serialized. Every
+connection is served by its own thread, the encode calls of all connections
+are merged into shared batches (util.embedding_batcher, enabled by default here).
+
+Usage (from the backend directory):
+    python embedding_service.py --socket /run/rag/embedding.sock
+
+    # API workers and import on the same host
+    EMBEDDING_SERVICE_SOCKET=/run/rag/embedding.sock gunicorn --config backend/gunicorn.conf.py app:app
+    EMBEDDING_SERVICE_SOCKET=/run/rag/embedding.sock python start_setup.py
+
+The socket file is created with the permissions of the umask, clients need write access.
+"""
+import sys
+sys.dont_write_bytecode = True
+import argparse
+import logging
+import multiprocessing.resource_tracker
+import multiprocessing.shared_memory
+import os
+import signal
+import socket
+import socketserver
+import time
+
+import dotenv
+
+dotenv.load_dotenv()
+
+# Concurrent connections share the model, their encode calls are batched
+os.environ.setdefault("EMBEDDING_BATCHING", "1")
+
+import numpy
+
+import util.embedding
+import util.embedding_client
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s | %(levelname)s | %(message)s",
+    handlers=[
+        logging.StreamHandler(sys.stdout),
+    ],
+)
+
+
+DEFAULT_SOCKET: str = util.embedding_client.EMBEDDING_SERVICE_SOCKET or "/tmp/rag-embedding.sock"
+
+
+def attach_segment(name: str) -> multiprocessing.shared_memory.SharedMemory:
+    """
+    Attaches to a segment created (and unlinked) by a client.
+    """
+    segment: multiprocessing.shared_memory.SharedMemory = multiprocessing.shared_memory.SharedMemory(name=name)
+
+    # Python < 3.13 registers attached segments with the resource tracker as well,
+    # it would unlink the client's segments when the service exits
+    multiprocessing.resource_tracker.unregister(segment._name, "shared_memory")
+
+    return segment
+
+
+class EncodeHandler(socketserver.BaseRequestHandler):
+    """
+    Serves one client connection until it is closed.
+    """
+
+    def setup(self) -> None:
+        self.segment: multiprocessing.shared_memory.SharedMemory = None
+
+    def handle(self) -> None:
+        while True:
+            request: dict[str, any] = util.embedding_client.receive_message(self.request)
+            if request is None:
+                return
+
+            try:
+                response: dict[str, any] = self.process(request)
+            except Exception as e:
+                logging.exception(f"Request `{request.get('op')}` failed")
+                response = {"error": repr(e)}
+
+            util.embedding_client.send_message(self.request, response)
+
+    def finish(self) -> None:
+        if self.segment is not None:
+            self.segment.close()
+
+    def _get_segment(self, name: str) -> multiprocessing.shared_memory.SharedMemory:
+        # Anyone who can connect could name an unrelated segment
+        if not util.embedding_client.is_segment_name(name):
+            raise ValueError(f"Not an embedding client segment: {name!r}")
+
+        # The client only replaces its segment when it needs a larger one
+        if self.segment is None or self.segment.name != name:
+            if self.segment is not None:
+                self.segment.close()
+            self.segment = attach_segment(name)
+
+        return self.segment
+
+    def process(self, request: dict[str, any]) -> dict[str, any]:
+        if request["op"] == "info":
+            return {
+                "model": util.embedding.DEFAULT_MODEL,
+                "backend": util.embedding.EMBEDDING_BACKEND,
+                "dimension": util.embedding.get_model().get_sentence_embedding_dimension(),
+                "pid": os.getpid(),
+            }
+
+        if request["op"] == "count_tokens":
+            return {"counts": util.embedding.count_tokens_with_model(request["contents"])}
+
+        if request["op"] == "encode":
+            segment: multiprocessing.shared_memory.SharedMemory = self._get_segment(request["shared_memory"])
+            embeddings: numpy.ndarray = numpy.ascontiguousarray(util.embedding.encode_with_model(request["contents"]), dtype=numpy.float32)
+
+            if embeddings.nbytes > segment.size:
+                return {"error": f"Shared memory of {segment.size} bytes too small for {embeddings.nbytes} bytes"}
+
+            target: numpy.ndarray = numpy.ndarray(embeddings.shape, dtype=numpy.float32, buffer=segment.buf)
+            target[:] = embeddings
+            # The view must be gone before the segment can be closed
+            del target
+
+            return {"rows": embeddings.shape[0], "dimension": embeddings.shape[1]}
+
+        return {"error": f"Unknown operation `{request['op']}`"}
+
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads: bool = True
+    # All request threads of all workers may connect at once (default 5)
+    request_queue_size: int = 128
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local embedding service over a Unix socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="path of the Unix socket (EMBEDDING_SERVICE_SOCKET of the clients)")
+
+    args: argparse.Namespace = parser.parse_args()
+
+    start_time: float = time.perf_counter()
+    util.embedding.get_model()
+    # The first forward pass initializes the kernels
+    util.embedding.encode_with_model(["warmup"])
+    logging.info(f"Loaded {util.embedding.DEFAULT_MODEL} ({util.embedding.EMBEDDING_BACKEND}) in {time.perf_counter() - start_time:.3f}s")
+
+    if os.path.exists(args.socket):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(args.socket)
+            sys.exit(f"Another embedding service is listening on {args.socket}")
+        except ConnectionRefusedError:
+            # Left behind by a previous run that did not shut down cleanly
+            os.unlink(args.socket)
+
+    # Stopped by docker/systemd: leave serve_forever through the finally below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with EmbeddingServer(args.socket, EncodeHandler) as server:
+        logging.info(f"Embedding service listening on {args.socket}")
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Production entry point for app.py: pre-fork workers with a preloaded app.
+
+The master imports app.py once (preload_app) and loads the SentenceTransformer
+of util.embedding and the scenario snapshot (ragutil.scenario_index), both are
+loaded lazily and not by the import itself. They are shared with the workers
+copy-on-write. Before forking, the master moves all objects into the permanent
+GC generation (gc.freeze), so the workers' garbage collection does not write to
+the shared pages. Every worker runs its own warmup (ragutil.warmup), its /health
+reports ready afterwards.
+
+Usage (from the repository root, like app.py):
+    gunicorn --config backend/gunicorn.conf.py app:app
+
+Settings (environment):
+- GUNICORN_BIND: address, default 0.0.0.0:8001
+- WEB_CONCURRENCY: worker processes, default 2
+- GUNICORN_THREADS: request threads per worker, default 4
+- TORCH_NUM_THREADS: torch intra-op threads per worker, default CPUs / workers
+  (also the default of EMBEDDING_ONNX_THREADS with EMBEDDING_BACKEND=onnx)
+- EMBEDDING_BATCHING: 0 disables merging the encode calls of concurrent
+  request threads (util.embedding_batcher), enabled by default here
+- GUNICORN_PRELOAD: 0 loads the app in every worker instead
+"""
+import gc
+import os
+
+
+# app.py is imported as top-level module, like `python backend/app.py`
+pythonpath: str = os.path.dirname(os.path.abspath(__file__))
+
+bind: str = os.getenv("GUNICORN_BIND", "0.0.0.0:8001")
+workers: int = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads: int = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class: str = "gthread"
+# GUNICORN_PRELOAD=0 loads the app in every worker (for comparing the memory use)
+preload_app: bool = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+# Perplexity answers take up to the request timeout of ragutil.perplexity (60s) twice
+timeout: int = int(os.getenv("GUNICORN_TIMEOUT", "150"))
+graceful_timeout: int = 30
+keepalive: int = 5
+
+TORCH_NUM_THREADS: int = int(os.getenv("TORCH_NUM_THREADS", "0")) or max(1, (os.cpu_count() or 1) // workers)
+# Read by util.embedding, the config is loaded before the app
+os.environ.setdefault("EMBEDDING_ONNX_THREADS", str(TORCH_NUM_THREADS))
+# The request threads of a worker share the model, their encode calls are batched
+os.environ.setdefault("EMBEDDING_BATCHING", "1")
+
+
+def when_ready(server) -> None:
+    """
+    Runs in the master after the app was preloaded, before the first worker is forked.
+    """
+    if not preload_app:
+        return
+
+    import ragutil.warmup
+
+    # No inference in the master, the torch thread pools would not survive the fork
+    ragutil.warmup.preload()
+
+    gc.collect()
+    gc.freeze()
+
+    server.log.info(f"Preloaded app frozen ({gc.get_freeze_count()} objects), forking {workers} workers")
+
+
+def post_worker_init(worker) -> None:
+    """
+    Runs in the worker once the app is loaded (with or without preload).
+    """
+    import ragutil.warmup
+    import util.embedding_client
+
+    # With the embedding service (embedding_service.py) the workers do not load torch
+    if not util.embedding_client.is_enabled():
+        import torch
+
+        torch.set_num_threads(TORCH_NUM_THREADS)
+
+    ragutil.warmup.start()
+
+    embedding: str = f"embedding service at {util.embedding_client.EMBEDDING_SERVICE_SOCKET}" if util.embedding_client.is_enabled() else f"{TORCH_NUM_THREADS} torch threads"
+    worker.log.info(f"Worker {worker.pid}: {threads} request threads, {embedding}")
@@ -1,39 +1,257 @@
 import json
 import logging
-import marko
-import time
+import os
 
+import numpy
+
+import ragutil.answer_cache
 import ragutil.chunks_search
+import ragutil.context_assembly
+import ragutil.context_compression
+import ragutil.keyword_extraction
 import ragutil.perplexity
+import ragutil.scenario_index
 import ragutil.scenario_search
+import ragutil.semantic_cache
+import ragutil.speculation
 import util.chunk
 import util.scenario
+import util.tracing
 
 
 
 DEBUG: bool = False
 
+KEYWORDS_ERROR: str = "Perplexity hat nicht geantworte [Keywords]"
+LOCAL_KEYWORDS_ERROR: str = "Im User Promt wurden keine Stichworte gefunden [Keywords]"
+FINAL_RESULT_ERROR: str = "Perplexity hat nicht geantwortet [Zusammenfassung]"
+# Returned instead of an answer (with status 200)
+ERROR_MESSAGES: tuple[str, ...] = (KEYWORDS_ERROR, LOCAL_KEYWORDS_ERROR, FINAL_RESULT_ERROR)
+
+# Answer the two Perplexity calls from the local LLM cache (ragutil.llm_cache)
+LLM_CACHE_KEYWORDS: bool = os.getenv("LLM_CACHE_KEYWORDS", "0") == "1"
+LLM_CACHE_FINAL_RESULTS: bool = os.getenv("LLM_CACHE_FINAL_RESULTS", "0") == "1"
+
+# "llm": Perplexity extracts the keywords, "local": ragutil.keyword_extraction (no API call)
+KEYWORD_EXTRACTORS: tuple[str, ...] = ("llm", "local")
+KEYWORD_EXTRACTOR: str = os.getenv("KEYWORD_EXTRACTOR", "llm")
+
+
+ScenarioChunks = ragutil.speculation.ScenarioChunks
 
 perplexity_client: ragutil.perplexity.PerplexityQuerier = ragutil.perplexity.PerplexityQuerier()
 
 
-def rag_process(user_input: str) -> str:
+def rag_process(user_input: str, keyword_extractor: str = None) -> str:
     logging.info(f"Started RAG Process for `{user_input}`")
+    keyword_extractor = select_keyword_extractor(keyword_extractor)
+
+    with util.tracing.trace("rag", keyword_extractor=keyword_extractor, input_characters=len(user_input)) as trace:
+        # The snapshot version identifies the imported scenarios and chunks
+        snapshot: ragutil.scenario_index.ScenarioSnapshot = ragutil.scenario_index.get_snapshot()
+
+        cached_answer, input_embedding = lookup_answer(user_input, keyword_extractor, snapshot)
+        if cached_answer is not None:
+            return render_cached_answer(trace, cached_answer)
+
+        # Route on the raw input and retrieve its chunks while waiting for the keywords
+        speculation: ragutil.speculation.SpeculativeRetrieval = None
+        if use_speculation(keyword_extractor):
+            speculation = ragutil.speculation.SpeculativeRetrieval(user_input, input_embedding, 2, snapshot, retrieve_scenario_chunks)
+
+        # 1. KI-Keyword extraktion
+        keywords: list[str] = find_keywords(user_input, keyword_extractor)
+
+        if not keywords:
+            if speculation is not None:
+                speculation.cancel()
+            error: str = keywords_error(keyword_extractor)
+            trace.set("error", error)
+            return error
+
+        # 2. Szenarien Vektorsuche
+        scenarios: list[util.scenario.Scenario] = route_scenarios(keywords, snapshot)
+
+        # 3. Chunks Vektorsuche
+        scenario_chunks: list[ScenarioChunks] = retrieve(scenarios, snapshot, speculation)
+
+        query_part, scenario_info_string = build_query_part(scenarios, scenario_chunks)
+
+        # 4. LLM Aufbereitung
+        with util.tracing.span("final_answer"):
+            result = process_final_results(perplexity_client, user_input, query_part)
+        logging.info("Returning results")
+
+        return finish_answer(trace, user_input, keyword_extractor, snapshot, input_embedding, result, keywords, scenario_info_string)
+
+
+def stage_timings(trace: util.tracing.Span) -> dict[str, float]:
+    """
+    Durations of the pipeline stages in seconds, taken from the spans of the request trace.
+    """
+    return {
+        "perplexity_keywords": trace.child_duration("keywords"),
+        "scenario_search": trace.child_duration("scenario_search"),
+        "chunk_search": trace.child_duration("chunk_search") + trace.child_duration("prompt_build"),
+        "perplexity_answer": trace.child_duration("final_answer"),
+    }
+
+
+def format_event(event: str, data: any) -> str:
+    """
+    One server-sent event, the data is JSON encoded.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def build_sources(scenarios: list[util.scenario.Scenario], scenario_chunks: list[ScenarioChunks]) -> list[dict[str, any]]:
+    sources: list[dict[str, any]] = []
 
-    start_time_1: float = time.perf_counter()
-    # 1. KI-Keyword extraktion
-    keywords: list[str] = extract_keywords(perplexity_client, user_input)
+    for scenario, (_, question_chunks) in zip(scenarios, scenario_chunks):
+        chunk_names: list[str] = []
 
-    if not keywords:
-        return "Perplexity hat nicht geantworte [Keywords]"
-    start_time_2: float = time.perf_counter()
+        for chunks in question_chunks:
+            for chunk in chunks:
+                chunk_name: str = f"{chunk.metadata.source_file}:{chunk.chunk_index}"
+                if chunk_name not in chunk_names:
+                    chunk_names.append(chunk_name)
 
-    joined_keywords: str = ",".join(keywords)
-    logging.info(f"Retrieved Keywords: `{joined_keywords}`")
+        sources.append({
+            "scenario": scenario.name,
+            "chunks": chunk_names
+        })
 
+    return sources
+
+
+def build_scenario_event(scenarios: list[util.scenario.Scenario]) -> list[dict[str, any]]:
+    return [
+        {"id": scenario.id, "name": scenario.name}
+        for scenario in scenarios
+    ]
+
+
+def stream_rag_process(user_input: str, keyword_extractor: str = None):
+    """
+    Generator variant of rag_process for /api/stream, yields server-sent events:
+    - keywords, scenarios, sources: as soon as the stage is done
+    - token: the answer markdown piece by piece, as Perplexity generates it
+    - answer: the rendered HTML answer (same as /api), also the only event for cached answers
+    - error: the pipeline stopped
+    - done: stage timings, always last
+    """
+    keyword_extractor = select_keyword_extractor(keyword_extractor)
+
+    with util.tracing.trace("rag_stream", keyword_extractor=keyword_extractor, input_characters=len(user_input)) as trace:
+        snapshot: ragutil.scenario_index.ScenarioSnapshot = ragutil.scenario_index.get_snapshot()
+
+        cached_answer, input_embedding = lookup_answer(user_input, keyword_extractor, snapshot)
+        if cached_answer is not None:
+            yield format_event("answer", {"html": render_cached_answer(trace, cached_answer), "cached": True})
+            yield format_event("done", stage_timings(trace))
+            return
+
+        speculation: ragutil.speculation.SpeculativeRetrieval = None
+        if use_speculation(keyword_extractor):
+            speculation = ragutil.speculation.SpeculativeRetrieval(user_input, input_embedding, 2, snapshot, retrieve_scenario_chunks)
+
+        # 1. KI-Keyword extraktion
+        keywords: list[str] = find_keywords(user_input, keyword_extractor)
+
+        if not keywords:
+            if speculation is not None:
+                speculation.cancel()
+            error: str = keywords_error(keyword_extractor)
+            trace.set("error", error)
+            yield format_event("error", {"message": error})
+            yield format_event("done", {})
+            return
+        yield format_event("keywords", keywords)
+
+        # 2. Szenarien Vektorsuche
+        scenarios: list[util.scenario.Scenario] = route_scenarios(keywords, snapshot)
+        yield format_event("scenarios", build_scenario_event(scenarios))
+
+        # 3. Chunks Vektorsuche
+        scenario_chunks: list[ScenarioChunks] = retrieve(scenarios, snapshot, speculation)
+        query_part, scenario_info_string = build_query_part(scenarios, scenario_chunks)
+        yield format_event("sources", build_sources(scenarios, scenario_chunks))
+
+        # 4. LLM Aufbereitung, weitergereicht sobald generiert
+        pieces: list[str] = []
+        with util.tracing.span("final_answer"):
+            try:
+                for piece in perplexity_client.prompt_stream(build_final_prompt(user_input, query_part), LLM_CACHE_FINAL_RESULTS):
+                    pieces.append(piece)
+                    yield format_event("token", {"text": piece})
+            except Exception:
+                logging.exception("Streaming the final answer failed")
+                pieces = None
+
+            if pieces is not None:
+                with util.tracing.span("markdown"):
+                    result: str = render_markdown("".join(pieces))
+
+        if pieces is None:
+            trace.set("error", FINAL_RESULT_ERROR)
+            yield format_event("error", {"message": FINAL_RESULT_ERROR})
+            yield format_event("done", {})
+            return
+
+        answer: str = finish_answer(trace, user_input, keyword_extractor, snapshot, input_embedding, result, keywords, scenario_info_string)
+
+        yield format_event("answer", {"html": answer, "cached": False})
+        yield format_event("done", stage_timings(trace))
+
+
+def lookup_answer(user_input: str, keyword_extractor: str, snapshot: ragutil.scenario_index.ScenarioSnapshot) -> tuple[ragutil.answer_cache.CachedAnswer, numpy.ndarray]:
+    """
+    Returns the cached answer (None on a miss) and the input embedding, which
+    the speculative routing and `finish_answer` reuse. Marks the trace on a hit.
+    Answers of the other keyword extractor are not hits.
+    """
+    cached_answer: ragutil.answer_cache.CachedAnswer = ragutil.answer_cache.get(user_input, keyword_extractor, snapshot.version)
+    if cached_answer is not None:
+        logging.info("Answered from the answer cache")
+        util.tracing.set_attributes(cache="answer")
+        return cached_answer, None
+
+    # Paraphrases of answered inputs
+    input_embedding: numpy.ndarray = ragutil.semantic_cache.embed(user_input)
+
+    cached_answer = ragutil.semantic_cache.get(input_embedding, keyword_extractor, snapshot.version)
+    if cached_answer is not None:
+        logging.info("Answered from the semantic answer cache")
+        util.tracing.set_attributes(cache="semantic")
+
+    return cached_answer, input_embedding
+
+
+def use_speculation(keyword_extractor: str) -> bool:
+    # Only worth it while waiting on the LLM
+    return ragutil.speculation.SPECULATIVE_ROUTING and keyword_extractor == "llm"
+
+
+def find_keywords(user_input: str, keyword_extractor: str) -> list[str]:
+    with util.tracing.span("keywords", extractor=keyword_extractor) as span:
+        if keyword_extractor == "local":
+            keywords: list[str] = ragutil.keyword_extraction.extract_keywords(user_input)
+        else:
+            keywords = extract_keywords(perplexity_client, user_input)
+        span.set("keywords", len(keywords or []))
+
+    if keywords:
+        joined_keywords: str = ",".join(keywords)
+        logging.info(f"Retrieved Keywords: `{joined_keywords}`")
+
+    return keywords
+
+
+def route_scenarios(keywords: list[str], snapshot: ragutil.scenario_index.ScenarioSnapshot) -> list[util.scenario.Scenario]:
+    with util.tracing.span("scenario_search", keywords=len(keywords)) as span:
+        scenarios: list[util.scenario.Scenario] = ragutil.scenario_search.match_keywords(keywords, 2, snapshot)
+        span.set("scenarios", len(scenarios))
 
-    # 2. Szenarien Vektorsuche
-    scenarios: list[util.scenario.Scenario] = ragutil.scenario_search.match_keywords(keywords, 2)
     names: list[str] = [
         scenario.name
         for scenario in scenarios
@@ -41,44 +259,99 @@ def rag_process(user_input: str) -> str:
     joined_names: str = ", ".join(names)
     logging.info(f"Mapped Scenarios: `{joined_names}`")
 
-    start_time_3: float = time.perf_counter()
-    # 3. Chunks Vektorsuche
+    return scenarios
+
+
+def retrieve(scenarios: list[util.scenario.Scenario], snapshot: ragutil.scenario_index.ScenarioSnapshot, speculation: ragutil.speculation.SpeculativeRetrieval = None) -> list[ScenarioChunks]:
+    with util.tracing.span("chunk_search", speculative=speculation is not None):
+        if speculation is not None:
+            scenario_chunks: list[ScenarioChunks] = speculation.resolve(scenarios, snapshot)
+        else:
+            scenario_chunks = retrieve_scenario_chunks(scenarios, snapshot)
     logging.info("Retrieved chunks")
 
-    total_prompt_blocks: list[str] = []
-    scenariO_chunk_blocks: list[str] = []
+    return scenario_chunks
+
+
+def finish_answer(trace: util.tracing.Span, user_input: str, keyword_extractor: str, snapshot: ragutil.scenario_index.ScenarioSnapshot, input_embedding: numpy.ndarray, result: str, keywords: list[str], scenario_info_string: str) -> str:
+    """
+    Renders the answer and stores its parts in the answer caches.
+    """
+    # Failed answers are not cached, the next request retries
+    if result != FINAL_RESULT_ERROR:
+        cached_answer: ragutil.answer_cache.CachedAnswer = ragutil.answer_cache.CachedAnswer(result, keywords, scenario_info_string)
+        ragutil.answer_cache.put(user_input, keyword_extractor, snapshot.version, cached_answer)
+        ragutil.semantic_cache.put(input_embedding, keyword_extractor, snapshot.version, user_input, cached_answer)
+    else:
+        trace.set("error", FINAL_RESULT_ERROR)
 
-    for scenario in scenarios:
-        prompt_block: tuple[str, str] = process_scenario(scenario)
-        total_prompt_blocks.append(prompt_block[1])
+    return render_result(result, keywords, scenario_info_string, stage_timings(trace))
 
-        res = prompt_block[0]
 
+def render_cached_answer(trace: util.tracing.Span, cached_answer: ragutil.answer_cache.CachedAnswer) -> str:
+    """
+    The footer shows the timings of this request, not those of the cached one.
+    """
+    return render_result(cached_answer.result, cached_answer.keywords, cached_answer.scenario_info_string, stage_timings(trace))
 
-        scenario_name: str = scenario.name
 
-        desc: str = f"# # {scenario_name}<br>\n# # -{res}"
+def build_query_part(scenarios: list[util.scenario.Scenario], scenario_chunks: list[ScenarioChunks]) -> tuple[str, str]:
+    """
+    Returns the knowledge block for the final prompt and the scenario/chunk info for the answer footer.
+    The chunks are compressed (ragutil.context_compression, optional) and reduced to
+    the prompt token budget (ragutil.context_assembly) first.
+    """
+    with util.tracing.span("prompt_build") as span:
+        if ragutil.context_compression.CONTEXT_COMPRESSION:
+            with util.tracing.span("context_compression") as compression_span:
+                scenario_chunks, compression_report = ragutil.context_compression.compress(scenario_chunks)
+                compression_span.set("characters_before", compression_report.characters_before)
+                compression_span.set("characters_after", compression_report.characters_after)
 
-        scenariO_chunk_blocks.append(desc)
+        scenario_chunks, assembly_report = ragutil.context_assembly.fit_to_budget(scenarios, scenario_chunks)
+        span.set("tokens", assembly_report.tokens_after)
+        span.set("tokens_saved", assembly_report.tokens_saved)
+        span.set("chunks", assembly_report.chunks_kept)
 
-    query_part: str = "\n\n".join(total_prompt_blocks)
-    
-    start_time_4: float = time.perf_counter()
+        total_prompt_blocks: list[str] = []
+        scenariO_chunk_blocks: list[str] = []
+
+        for scenario, (questions, question_chunks) in zip(scenarios, scenario_chunks):
+            prompt_block: tuple[str, str] = process_scenario(scenario, questions, question_chunks)
+            total_prompt_blocks.append(prompt_block[1])
+
+            res = prompt_block[0]
+
+
+            scenario_name: str = scenario.name
+
+            desc: str = f"# # {scenario_name}<br>\n# # -{res}"
+
+            scenariO_chunk_blocks.append(desc)
 
-    # 4. LLM Aufbereitung
-    result = process_final_results(perplexity_client, user_input, query_part)
-    logging.info("Returning results")
+        query_part: str = "\n\n".join(total_prompt_blocks)
+        scenario_info_string = "<br>\n# # <br>\n".join(scenariO_chunk_blocks)
 
-    end_time: float = time.perf_counter()
+        span.set("characters", len(query_part))
 
-    delta_perflexity_1: float = start_time_2 - start_time_1
-    delta_scenarios: float = start_time_3 - start_time_2
-    delta_chunks: float = start_time_4 - start_time_3
-    delta_perflexity_2: float = end_time - start_time_4
-    rag_delta: float = start_time_4 - start_time_2
-    delta: float = end_time - start_time_1
+    return query_part, scenario_info_string
 
-    scenario_info_string = "<br>\n# # <br>\n".join(scenariO_chunk_blocks)
+
+def render_markdown(text: str) -> str:
+    # Imported on the first answer, not with the module
+    import marko
+
+    return marko.convert(text)
+
+
+def render_result(result: str, keywords: list[str], scenario_info_string: str, timings: dict[str, float]) -> str:
+    delta_perflexity_1: float = timings["perplexity_keywords"]
+    delta_scenarios: float = timings["scenario_search"]
+    delta_chunks: float = timings["chunk_search"]
+    delta_perflexity_2: float = timings["perplexity_answer"]
+
+    rag_delta: float = delta_scenarios + delta_chunks
+    delta: float = delta_perflexity_1 + rag_delta + delta_perflexity_2
 
     return result + f"""
     <br>
@@ -104,9 +377,39 @@ def rag_process(user_input: str) -> str:
 
 
 
-def process_scenario(scenario: util.scenario.Scenario) -> tuple[str, str]:
+def retrieve_scenario_chunks(scenarios: list[util.scenario.Scenario], snapshot: ragutil.scenario_index.ScenarioSnapshot) -> list[ScenarioChunks]:
+    """
+    Fans out the chunk retrieval of all questions of all scenarios at once.
+    Returns (questions, chunks per question) for every scenario, in order.
+    """
+    scenario_questions: list[list[util.scenario.ScenarioQuestion]] = [
+        snapshot.get_questions(scenario.id)
+        for scenario in scenarios
+    ]
+    all_questions: list[util.scenario.ScenarioQuestion] = [
+        question
+        for questions in scenario_questions
+        for question in questions
+    ]
+
+    all_chunks: list[list[util.chunk.DocumentChunk]] = ragutil.chunks_search.retrieve_chunks_for_scenario_questions(all_questions, 2, snapshot)
+
+    return split_by_scenario(scenario_questions, all_chunks)
+
+
+def split_by_scenario(scenario_questions: list[list[util.scenario.ScenarioQuestion]], all_chunks: list[list[util.chunk.DocumentChunk]]) -> list[ScenarioChunks]:
+    results: list[ScenarioChunks] = []
+    offset: int = 0
+
+    for questions in scenario_questions:
+        results.append((questions, all_chunks[offset:offset + len(questions)]))
+        offset += len(questions)
+
+    return results
+
+
+def process_scenario(scenario: util.scenario.Scenario, questions: list[util.scenario.ScenarioQuestion], question_chunks: list[list[util.chunk.DocumentChunk]]) -> tuple[str, str]:
     total_chunks: list[util.chunk.DocumentChunk] = []
-    questions: list[util.scenario.ScenarioQuestion] = scenario.get_scenario_questions()
 
     scenario_blocks: list[str] = []
 
@@ -115,9 +418,7 @@ def process_scenario(scenario: util.scenario.Scenario) -> tuple[str, str]:
     if DEBUG:
         print(scenario.name)
 
-    for question in questions:
-        chunks: list[util.chunk.DocumentChunk] = ragutil.chunks_search.retrieve_chunks_for_scenario_question(question, 2)
-
+    for question, chunks in zip(questions, question_chunks):
         reduced_chunks: list[util.chunk.DocumentChunk] = [
             i
             for i in chunks
@@ -179,25 +480,57 @@ def build_question_block(question: util.scenario.ScenarioQuestion, chunks: list[
 
 
 
-def extract_keywords(perplexity_client: ragutil.perplexity.PerplexityQuerier, user_input: str) -> list[str]:
-    prompt: str = f"""
+def keywords_error(keyword_extractor: str) -> str:
+    """
+    The local extractor found no keywords, it did not call Perplexity.
+    """
+    if keyword_extractor == "local":
+        return LOCAL_KEYWORDS_ERROR
+    return KEYWORDS_ERROR
+
+
+def select_keyword_extractor(keyword_extractor: str = None) -> str:
+    """
+    Per request choice, KEYWORD_EXTRACTOR if none was given.
+    """
+    if keyword_extractor is None:
+        keyword_extractor = KEYWORD_EXTRACTOR
+
+    if keyword_extractor not in KEYWORD_EXTRACTORS:
+        raise ValueError(f"Unknown keyword extractor `{keyword_extractor}`, expected one of {KEYWORD_EXTRACTORS}")
+
+    return keyword_extractor
+
+
+def build_keywords_prompt(user_input: str) -> str:
+    return f"""
         Folgendes ist ein User Promt, dieser Soll auf ALLE möglichen Stichworte die auf dessen Szenario zutreffen, runtergrebrochen werden.
         MAXIMAL aber 10 Stichworte. In der AUSGABE von DIR, sollen NUR diese Stichworte rauskommen, KEINERLEI ERKLÄRUNG oder sonstiges.
         Diese Stichworte bitte als JSON-Parsable Array. Sonst keinen Text!
 
         {user_input}
         """
+
+
+def extract_keywords(perplexity_client: ragutil.perplexity.PerplexityQuerier, user_input: str, use_cache: bool = LLM_CACHE_KEYWORDS) -> list[str]:
+    prompt: str = build_keywords_prompt(user_input)
     
     try:
-        response = perplexity_client.prompt(prompt)
+        response = perplexity_client.prompt(prompt, use_cache)
+    except:
+        return None
 
+    try:
         return json.loads(response)
     except:
+        # Do not keep serving an unparsable answer from the cache
+        if use_cache:
+            perplexity_client.forget(prompt)
         return None
 
 
-def process_final_results(perplexity_client: ragutil.perplexity.PerplexityQuerier, user_input: str, query_part: str) -> str:
-    prompt: str = f"""
+def build_final_prompt(user_input: str, query_part: str) -> str:
+    return f"""
         DER USER PROMT:
         {user_input}
 
@@ -225,8 +558,14 @@ def process_final_results(perplexity_client: ragutil.perplexity.PerplexityQuerie
 
         {query_part}
         """
+
+
+def process_final_results(perplexity_client: ragutil.perplexity.PerplexityQuerier, user_input: str, query_part: str, use_cache: bool = LLM_CACHE_FINAL_RESULTS) -> str:
+    prompt: str = build_final_prompt(user_input, query_part)
+
     try:
-        response = perplexity_client.prompt(prompt)
-        return marko.convert(response)
+        response = perplexity_client.prompt(prompt, use_cache)
+        with util.tracing.span("markdown", characters=len(response)):
+            return render_markdown(response)
     except:
-        return "Perplexity hat nicht geantwortet [Zusammenfassung]"
+        return FINAL_RESULT_ERROR
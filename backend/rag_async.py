@@ -0,0 +1,220 @@
+"""
+asyncio variant of rag.rag_process, served by asgi.py.
+
+While waiting on Perplexity or MongoDB a request does not hold a thread, so one
+worker process can keep hundreds of requests in flight. The prompts, the scenario
+routing, the cache lookup and store and the prompt assembly are shared with rag.py,
+the blocking ones run in worker threads.
+
+PostgreSQL is not on this path at all: scenarios, questions and the materialized
+chunk ids come from the in-process snapshot (ragutil.scenario_index), only its
+periodic version check runs in a worker thread.
+Embedding (torch) and the token counting of the prompt assembly are CPU-bound
+and run in worker threads as well.
+"""
+import asyncio
+import json
+import logging
+
+import rag
+import ragutil.chunks_search
+import ragutil.perplexity
+import ragutil.scenario_index
+import ragutil.speculation
+import util.chunk
+import util.scenario
+import util.tracing
+
+
+perplexity_client: ragutil.perplexity.PerplexityQuerier = ragutil.perplexity.PerplexityQuerier()
+
+
+async def rag_process(user_input: str, keyword_extractor: str = None) -> str:
+    logging.info(f"Started async RAG Process for `{user_input}`")
+    keyword_extractor = rag.select_keyword_extractor(keyword_extractor)
+
+    with util.tracing.trace("rag", keyword_extractor=keyword_extractor, input_characters=len(user_input)) as trace:
+        # The snapshot version identifies the imported scenarios and chunks
+        snapshot: ragutil.scenario_index.ScenarioSnapshot = await asyncio.to_thread(ragutil.scenario_index.get_snapshot)
+
+        cached_answer, input_embedding = await asyncio.to_thread(rag.lookup_answer, user_input, keyword_extractor, snapshot)
+        if cached_answer is not None:
+            return rag.render_cached_answer(trace, cached_answer)
+
+        # Route on the raw input and retrieve its chunks while waiting for the keywords
+        speculation: ragutil.speculation.AsyncSpeculativeRetrieval = None
+        if rag.use_speculation(keyword_extractor):
+            speculation = ragutil.speculation.AsyncSpeculativeRetrieval(user_input, input_embedding, 2, snapshot, retrieve_scenario_chunks)
+
+        # 1. KI-Keyword extraktion
+        keywords: list[str] = await find_keywords(user_input, keyword_extractor)
+
+        if not keywords:
+            if speculation is not None:
+                speculation.cancel()
+            error: str = rag.keywords_error(keyword_extractor)
+            trace.set("error", error)
+            return error
+
+        # 2. Szenarien Vektorsuche
+        scenarios: list[util.scenario.Scenario] = await asyncio.to_thread(rag.route_scenarios, keywords, snapshot)
+
+        # 3. Chunks Vektorsuche
+        scenario_chunks: list[rag.ScenarioChunks] = await retrieve(scenarios, snapshot, speculation)
+
+        query_part, scenario_info_string = await asyncio.to_thread(rag.build_query_part, scenarios, scenario_chunks)
+
+        # 4. LLM Aufbereitung
+        with util.tracing.span("final_answer"):
+            result: str = await process_final_results(perplexity_client, user_input, query_part)
+        logging.info("Returning results")
+
+        return rag.finish_answer(trace, user_input, keyword_extractor, snapshot, input_embedding, result, keywords, scenario_info_string)
+
+
+async def stream_rag_process(user_input: str, keyword_extractor: str = None):
+    """
+    Async generator variant of rag.stream_rag_process, same events.
+    """
+    keyword_extractor = rag.select_keyword_extractor(keyword_extractor)
+
+    with util.tracing.trace("rag_stream", keyword_extractor=keyword_extractor, input_characters=len(user_input)) as trace:
+        snapshot: ragutil.scenario_index.ScenarioSnapshot = await asyncio.to_thread(ragutil.scenario_index.get_snapshot)
+
+        cached_answer, input_embedding = await asyncio.to_thread(rag.lookup_answer, user_input, keyword_extractor, snapshot)
+        if cached_answer is not None:
+            yield rag.format_event("answer", {"html": rag.render_cached_answer(trace, cached_answer), "cached": True})
+            yield rag.format_event("done", rag.stage_timings(trace))
+            return
+
+        speculation: ragutil.speculation.AsyncSpeculativeRetrieval = None
+        if rag.use_speculation(keyword_extractor):
+            speculation = ragutil.speculation.AsyncSpeculativeRetrieval(user_input, input_embedding, 2, snapshot, retrieve_scenario_chunks)
+
+        # 1. KI-Keyword extraktion
+        keywords: list[str] = await find_keywords(user_input, keyword_extractor)
+
+        if not keywords:
+            if speculation is not None:
+                speculation.cancel()
+            error: str = rag.keywords_error(keyword_extractor)
+            trace.set("error", error)
+            yield rag.format_event("error", {"message": error})
+            yield rag.format_event("done", {})
+            return
+        yield rag.format_event("keywords", keywords)
+
+        # 2. Szenarien Vektorsuche
+        scenarios: list[util.scenario.Scenario] = await asyncio.to_thread(rag.route_scenarios, keywords, snapshot)
+        yield rag.format_event("scenarios", rag.build_scenario_event(scenarios))
+
+        # 3. Chunks Vektorsuche
+        scenario_chunks: list[rag.ScenarioChunks] = await retrieve(scenarios, snapshot, speculation)
+        query_part, scenario_info_string = await asyncio.to_thread(rag.build_query_part, scenarios, scenario_chunks)
+        yield rag.format_event("sources", rag.build_sources(scenarios, scenario_chunks))
+
+        # 4. LLM Aufbereitung, weitergereicht sobald generiert
+        pieces: list[str] = []
+        with util.tracing.span("final_answer"):
+            try:
+                async for piece in perplexity_client.prompt_stream_async(rag.build_final_prompt(user_input, query_part), rag.LLM_CACHE_FINAL_RESULTS):
+                    pieces.append(piece)
+                    yield rag.format_event("token", {"text": piece})
+            except Exception:
+                logging.exception("Streaming the final answer failed")
+                pieces = None
+
+            if pieces is not None:
+                with util.tracing.span("markdown"):
+                    result: str = rag.render_markdown("".join(pieces))
+
+        if pieces is None:
+            trace.set("error", rag.FINAL_RESULT_ERROR)
+            yield rag.format_event("error", {"message": rag.FINAL_RESULT_ERROR})
+            yield rag.format_event("done", {})
+            return
+
+        answer: str = rag.finish_answer(trace, user_input, keyword_extractor, snapshot, input_embedding, result, keywords, scenario_info_string)
+
+        yield rag.format_event("answer", {"html": answer, "cached": False})
+        yield rag.format_event("done", rag.stage_timings(trace))
+
+
+async def find_keywords(user_input: str, keyword_extractor: str) -> list[str]:
+    """
+    rag.find_keywords, the LLM call awaited on the event loop.
+    """
+    if keyword_extractor == "local":
+        return await asyncio.to_thread(rag.find_keywords, user_input, keyword_extractor)
+
+    with util.tracing.span("keywords", extractor=keyword_extractor) as span:
+        keywords: list[str] = await extract_keywords(perplexity_client, user_input)
+        span.set("keywords", len(keywords or []))
+
+    if keywords:
+        joined_keywords: str = ",".join(keywords)
+        logging.info(f"Retrieved Keywords: `{joined_keywords}`")
+
+    return keywords
+
+
+async def retrieve(scenarios: list[util.scenario.Scenario], snapshot: ragutil.scenario_index.ScenarioSnapshot, speculation: ragutil.speculation.AsyncSpeculativeRetrieval = None) -> list[rag.ScenarioChunks]:
+    with util.tracing.span("chunk_search", speculative=speculation is not None):
+        if speculation is not None:
+            scenario_chunks: list[rag.ScenarioChunks] = await speculation.resolve(scenarios, snapshot)
+        else:
+            scenario_chunks = await retrieve_scenario_chunks(scenarios, snapshot)
+    logging.info("Retrieved chunks")
+
+    return scenario_chunks
+
+
+async def retrieve_scenario_chunks(scenarios: list[util.scenario.Scenario], snapshot: ragutil.scenario_index.ScenarioSnapshot) -> list[rag.ScenarioChunks]:
+    scenario_questions: list[list[util.scenario.ScenarioQuestion]] = [
+        snapshot.get_questions(scenario.id)
+        for scenario in scenarios
+    ]
+    all_questions: list[util.scenario.ScenarioQuestion] = [
+        question
+        for questions in scenario_questions
+        for question in questions
+    ]
+
+    all_chunks: list[list[util.chunk.DocumentChunk]] = await ragutil.chunks_search.retrieve_chunks_for_scenario_questions_async(all_questions, 2, snapshot)
+
+    return rag.split_by_scenario(scenario_questions, all_chunks)
+
+
+async def extract_keywords(perplexity_client: ragutil.perplexity.PerplexityQuerier, user_input: str, use_cache: bool = rag.LLM_CACHE_KEYWORDS) -> list[str]:
+    prompt: str = rag.build_keywords_prompt(user_input)
+
+    try:
+        response: str = await perplexity_client.prompt_async(prompt, use_cache)
+    except Exception:
+        logging.exception("Keyword extraction failed")
+        return None
+
+    try:
+        return json.loads(response)
+    except ValueError:
+        logging.exception("Keyword extraction returned no JSON")
+        # Do not keep serving an unparsable answer from the cache
+        if use_cache:
+            await asyncio.to_thread(perplexity_client.forget, prompt)
+        return None
+
+
+async def process_final_results(perplexity_client: ragutil.perplexity.PerplexityQuerier, user_input: str, query_part: str, use_cache: bool = rag.LLM_CACHE_FINAL_RESULTS) -> str:
+    prompt: str = rag.build_final_prompt(user_input, query_part)
+
+    try:
+        response: str = await perplexity_client.prompt_async(prompt, use_cache)
+        with util.tracing.span("markdown", characters=len(response)):
+            return rag.render_markdown(response)
+    except Exception:
+        logging.exception("Final answer failed")
+        return rag.FINAL_RESULT_ERROR
+
+
+async def close() -> None:
+    await perplexity_client.aclose()
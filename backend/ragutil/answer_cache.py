@@ -0,0 +1,145 @@
+"""
+Exact-match cache for finished RAG answers.
+
+Keyed by the normalized user input, the keyword extractor (rag.KEYWORD_EXTRACTORS)
+and the data version of the scenario snapshot, so every re-import of scenarios
+or chunks (util.data_version) implicitly invalidates all older answers. Entries
+expire after a TTL and the least recently used entry is evicted once the cache is full.
+
+An entry holds the parts of the answer (CachedAnswer), not the rendered HTML:
+the footer with the stage timings is rendered for every request, a hit shows
+its own timings instead of those of the request that was cached.
+"""
+import collections
+import dataclasses
+import os
+import re
+import threading
+import time
+import unicodedata
+
+
+ANSWER_CACHE_ENABLED: bool = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_MAX_SIZE: int = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "512"))
+ANSWER_CACHE_TTL_SECONDS: float = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+
+_WHITESPACE: re.Pattern = re.compile(r"\s+")
+
+
+@dataclasses.dataclass
+class CachedAnswer(object):
+    result: str
+    keywords: list[str]
+    scenario_info_string: str
+
+
+def normalize_input(user_input: str) -> str:
+    """
+    Unicode (NFKC), whitespace and case differences do not change the answer.
+    """
+    normalized: str = unicodedata.normalize("NFKC", user_input)
+    return _WHITESPACE.sub(" ", normalized).strip().casefold()
+
+
+class AnswerCache(object):
+
+    def __init__(self, max_size: int = ANSWER_CACHE_MAX_SIZE, ttl: float = ANSWER_CACHE_TTL_SECONDS):
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+
+        # key -> (expires_at, answer), ordered from least to most recently used
+        self._entries: collections.OrderedDict[tuple[str, str, any], tuple[float, CachedAnswer]] = collections.OrderedDict()
+        self._version: any = None
+        self._lock: threading.Lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.expirations: int = 0
+        self.evictions: int = 0
+        self.invalidations: int = 0
+
+    def _check_version(self, version: any) -> None:
+        # Entries of older versions can never be hit again, drop them right away
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+
+    def get(self, user_input: str, keyword_extractor: str, version: any) -> CachedAnswer:
+        key: tuple[str, str, any] = (normalize_input(user_input), keyword_extractor, version)
+
+        with self._lock:
+            self._check_version(version)
+            entry: tuple[float, CachedAnswer] = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, answer = entry
+
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return answer
+
+    def put(self, user_input: str, keyword_extractor: str, version: any, answer: CachedAnswer) -> None:
+        if self.max_size <= 0:
+            return
+
+        key: tuple[str, str, any] = (normalize_input(user_input), keyword_extractor, version)
+
+        with self._lock:
+            self._check_version(version)
+
+            self._entries[key] = (time.monotonic() + self.ttl, answer)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, any]:
+        with self._lock:
+            lookups: int = self.hits + self.misses
+
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+answer_cache: AnswerCache = AnswerCache()
+
+
+def get(user_input: str, keyword_extractor: str, version: any) -> CachedAnswer:
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    return answer_cache.get(user_input, keyword_extractor, version)
+
+
+def put(user_input: str, keyword_extractor: str, version: any, answer: CachedAnswer) -> None:
+    if ANSWER_CACHE_ENABLED:
+        answer_cache.put(user_input, keyword_extractor, version, answer)
+
+
+def get_stats() -> dict[str, any]:
+    return answer_cache.stats()
@@ -1,9 +1,47 @@
-import pgvector.psycopg2.vector
-import torch
+import asyncio
+import concurrent.futures
+import dataclasses
+import logging
+import numpy
+import os
+import pymongo.errors
+import threading
 
 import database.mongo
+import ragutil.scenario_index
 import util.chunk
 import util.scenario
+import util.tracing
+
+
+# Upper bound of concurrent Mongo searches per process (shared by all requests)
+RETRIEVAL_WORKERS: int = int(os.getenv("RAG_RETRIEVAL_WORKERS", "8"))
+# Searches all live questions with one aggregate ($unionWith) instead of one aggregate each
+BATCHED_VECTOR_SEARCH: bool = os.getenv("RAG_BATCHED_VECTOR_SEARCH", "1") == "1"
+
+# Set once the server rejected $vectorSearch inside $unionWith (MongoDB < 8.0)
+_batched_search_unsupported: bool = False
+# Unrecognized pipeline stage, stage only valid first in a pipeline
+_UNSUPPORTED_STAGE_CODES: frozenset[int] = frozenset({40324, 40602})
+
+_executor: concurrent.futures.ThreadPoolExecutor = None
+_executor_pid: int = None
+_executor_lock: threading.Lock = threading.Lock()
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Created lazily and per process, worker threads do not survive fork().
+    """
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="chunk-retrieval")
+            _executor_pid = os.getpid()
+
+        return _executor
+
 
 def build_pipeline_from_vector_list(vector_list: list[float], number_of_chunks: int = 5) -> list:
     pipeline = [
@@ -15,31 +53,315 @@ def build_pipeline_from_vector_list(vector_list: list[float], number_of_chunks:
             "numCandidates": 100,
             "limit": number_of_chunks
             }
-        }
+        },
+        {"$project": {"embedding": 0}},
+        # Used to prioritize the chunks within the prompt token budget (ragutil.context_assembly)
+        {"$addFields": {"score": {"$meta": "vectorSearchScore"}}}
     ]
 
     return pipeline
 
-def build_pipeline_from_embedding(tensor: torch.Tensor) -> list:
-    vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(tensor)
+def build_pipeline_from_embedding(embedding: numpy.ndarray) -> list:
+    import pgvector.psycopg2.vector
+
+    vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding)
     return build_pipeline_from_vector_list(vector.to_list())
 
 
-def retrieve_chunks_for_scenario_question(scenario_question: util.scenario.ScenarioQuestion, number_of_chunks: int = 5) -> list[util.chunk.DocumentChunk]:
+def build_pipeline_from_vector_lists(vector_lists: list[list[float]], number_of_chunks: int = 5) -> list:
+    """
+    One pipeline for N query vectors: the first search runs on the collection itself,
+    every further one as a `$unionWith` sub-pipeline. Each result is tagged with
+    `query_index` (position in `vector_lists`).
+    """
+    def tagged_pipeline(query_index: int, vector_list: list[float]) -> list:
+        return build_pipeline_from_vector_list(vector_list, number_of_chunks) + [
+            {"$addFields": {"query_index": query_index}}
+        ]
+
+    pipeline: list = tagged_pipeline(0, vector_lists[0])
+
+    for query_index, vector_list in enumerate(vector_lists[1:], start=1):
+        pipeline.append(
+            {
+                "$unionWith": {
+                    "coll": "chunks",
+                    "pipeline": tagged_pipeline(query_index, vector_list)
+                }
+            }
+        )
+
+    return pipeline
+
+
+def retrieve_chunks_for_scenario_question(scenario_question: util.scenario.ScenarioQuestion, number_of_chunks: int = 5, snapshot: ragutil.scenario_index.ScenarioSnapshot = None) -> list[util.chunk.DocumentChunk]:
+    if snapshot is not None:
+        chunk_ids: list[str] = snapshot.get_materialized_chunk_ids(scenario_question.id, number_of_chunks)
+
+        if chunk_ids is not None:
+            chunks: list[util.chunk.DocumentChunk] = util.chunk.DocumentChunk.load_from_ids(chunk_ids)
+
+            # None if chunks were removed since the materialization, search live instead
+            if chunks is not None:
+                return _with_scores(chunks, snapshot.get_materialized_chunk_scores(scenario_question.id, number_of_chunks))
+
+    return search_chunks_for_scenario_question(scenario_question, number_of_chunks)
+
+
+def search_chunks_for_scenario_question(scenario_question: util.scenario.ScenarioQuestion, number_of_chunks: int = 5) -> list[util.chunk.DocumentChunk]:
     vector_list: list[float] = scenario_question.embedding
 
     pipeline: list = build_pipeline_from_vector_list(vector_list, number_of_chunks)
 
-    with database.mongo.create_connection() as conn:
-        db = conn["rag"]
-        coll = db["chunks"]
+    coll = database.mongo.get_collection("chunks")
 
+    with util.tracing.span("question_search", question_id=scenario_question.id, vectors=1) as span:
         raw_chunks: list[dict[str, any]] = list(coll.aggregate(pipeline))
 
-    chunks: list[util.chunk.DocumentChunk] = []
+        chunks: list[util.chunk.DocumentChunk] = []
+
+        for raw_chunk in raw_chunks:
+            chunk: util.chunk.DocumentChunk = util.chunk.DocumentChunk.from_dict(raw_chunk)
+            chunks.append(chunk)
+
+        span.set("chunks", len(chunks))
 
-    for raw_chunk in raw_chunks:
-        chunk: util.chunk.DocumentChunk = util.chunk.DocumentChunk.from_dict(raw_chunk)
-        chunks.append(chunk)
-    
     return chunks
+
+
+def search_chunks_for_scenario_questions(scenario_questions: list[util.scenario.ScenarioQuestion], number_of_chunks: int = 5) -> list[list[util.chunk.DocumentChunk]]:
+    """
+    Searches the chunks of N questions within one server round trip.
+    The result has the same order as `scenario_questions`, each list is ordered by score.
+    """
+    if not scenario_questions:
+        return []
+
+    pipeline: list = build_pipeline_from_vector_lists(
+        [scenario_question.embedding for scenario_question in scenario_questions],
+        number_of_chunks
+    )
+
+    coll = database.mongo.get_collection("chunks")
+
+    results: list[list[util.chunk.DocumentChunk]] = [[] for _ in scenario_questions]
+
+    with util.tracing.span("batched_search", vectors=len(scenario_questions)) as span:
+        for raw_chunk in coll.aggregate(pipeline):
+            results[raw_chunk["query_index"]].append(util.chunk.DocumentChunk.from_dict(raw_chunk))
+
+        span.set("chunks", sum(len(chunks) for chunks in results))
+
+    return results
+
+
+def _handle_batched_search_error(error: pymongo.errors.OperationFailure) -> None:
+    """
+    Disables the batched search for the process only if the server cannot run it at all.
+    Anything else (timeout, authentication, index still building) only falls back for this call.
+    """
+    global _batched_search_unsupported
+
+    message: str = (error.details or {}).get("errmsg", str(error))
+
+    if error.code in _UNSUPPORTED_STAGE_CODES or "$unionWith" in message:
+        logging.warning(f"Batched vector search not supported, falling back to concurrent searches: {error}")
+        _batched_search_unsupported = True
+    else:
+        logging.warning(f"Batched vector search failed, falling back to concurrent searches for this request: {error}")
+
+
+def _search_concurrently(scenario_questions: list[util.scenario.ScenarioQuestion], number_of_chunks: int) -> list[list[util.chunk.DocumentChunk]]:
+    executor: concurrent.futures.ThreadPoolExecutor = _get_executor()
+
+    futures: list[concurrent.futures.Future] = [
+        executor.submit(util.tracing.bind(search_chunks_for_scenario_question), scenario_question, number_of_chunks)
+        for scenario_question in scenario_questions
+    ]
+
+    return [
+        future.result()
+        for future in futures
+    ]
+
+
+def _with_scores(chunks: list[util.chunk.DocumentChunk], scores: list[float]) -> list[util.chunk.DocumentChunk]:
+    # Copies, the same chunk object may be shared by several questions with different scores
+    return [
+        dataclasses.replace(chunk, score=score)
+        for chunk, score in zip(chunks, scores)
+    ]
+
+
+def _get_materialized_chunk_ids(scenario_questions: list[util.scenario.ScenarioQuestion], number_of_chunks: int, snapshot: ragutil.scenario_index.ScenarioSnapshot) -> dict[int, tuple[list[str], list[float]]]:
+    materialized_ids: dict[int, tuple[list[str], list[float]]] = {}
+
+    if snapshot is not None:
+        for i, scenario_question in enumerate(scenario_questions):
+            chunk_ids: list[str] = snapshot.get_materialized_chunk_ids(scenario_question.id, number_of_chunks)
+
+            if chunk_ids is not None:
+                materialized_ids[i] = (chunk_ids, snapshot.get_materialized_chunk_scores(scenario_question.id, number_of_chunks))
+
+    return materialized_ids
+
+
+def _apply_materialized_chunks(results: list[list[util.chunk.DocumentChunk]], materialized_ids: dict[int, tuple[list[str], list[float]]], chunks_by_id: dict[str, util.chunk.DocumentChunk]) -> None:
+    for i, (chunk_ids, scores) in materialized_ids.items():
+        # Chunks removed since the materialization are searched live instead
+        if all(chunk_id in chunks_by_id for chunk_id in chunk_ids):
+            results[i] = _with_scores(
+                [
+                    chunks_by_id[chunk_id]
+                    for chunk_id in chunk_ids
+                ],
+                scores
+            )
+
+
+def _get_pending(results: list[list[util.chunk.DocumentChunk]]) -> list[int]:
+    return [
+        i
+        for i, result in enumerate(results)
+        if result is None
+    ]
+
+
+def retrieve_chunks_for_scenario_questions(scenario_questions: list[util.scenario.ScenarioQuestion], number_of_chunks: int = 5, snapshot: ragutil.scenario_index.ScenarioSnapshot = None) -> list[list[util.chunk.DocumentChunk]]:
+    """
+    Retrieves the chunks of all questions at once, the result has the same order as `scenario_questions`.
+    Materialized questions are resolved with a single `_id` lookup, all others are
+    searched with one batched aggregate, or concurrently on the retrieval thread pool
+    if the server does not support it.
+    """
+    results: list[list[util.chunk.DocumentChunk]] = [None] * len(scenario_questions)
+
+    materialized_ids: dict[int, tuple[list[str], list[float]]] = _get_materialized_chunk_ids(scenario_questions, number_of_chunks, snapshot)
+
+    if materialized_ids:
+        all_ids: list[str] = [
+            chunk_id
+            for chunk_ids, _ in materialized_ids.values()
+            for chunk_id in chunk_ids
+        ]
+        with util.tracing.span("materialized_lookup", questions=len(materialized_ids), ids=len(all_ids)) as span:
+            chunks_by_id: dict[str, util.chunk.DocumentChunk] = util.chunk.DocumentChunk.load_by_ids(all_ids)
+            span.set("chunks", len(chunks_by_id))
+
+        _apply_materialized_chunks(results, materialized_ids, chunks_by_id)
+
+    pending: list[int] = _get_pending(results)
+
+    if not pending:
+        return results
+
+    pending_questions: list[util.scenario.ScenarioQuestion] = [
+        scenario_questions[i]
+        for i in pending
+    ]
+    pending_results: list[list[util.chunk.DocumentChunk]] = None
+
+    if len(pending) == 1:
+        pending_results = [search_chunks_for_scenario_question(pending_questions[0], number_of_chunks)]
+    elif BATCHED_VECTOR_SEARCH and not _batched_search_unsupported:
+        try:
+            pending_results = search_chunks_for_scenario_questions(pending_questions, number_of_chunks)
+        except pymongo.errors.OperationFailure as e:
+            _handle_batched_search_error(e)
+
+    if pending_results is None:
+        pending_results = _search_concurrently(pending_questions, number_of_chunks)
+
+    for i, chunks in zip(pending, pending_results):
+        results[i] = chunks
+
+    return results
+
+
+async def search_chunks_for_scenario_question_async(scenario_question: util.scenario.ScenarioQuestion, number_of_chunks: int = 5) -> list[util.chunk.DocumentChunk]:
+    pipeline: list = build_pipeline_from_vector_list(scenario_question.embedding, number_of_chunks)
+
+    coll = database.mongo.get_async_collection("chunks")
+
+    with util.tracing.span("question_search", question_id=scenario_question.id, vectors=1) as span:
+        cursor = await coll.aggregate(pipeline)
+        raw_chunks: list[dict[str, any]] = await cursor.to_list()
+        span.set("chunks", len(raw_chunks))
+
+    return [
+        util.chunk.DocumentChunk.from_dict(raw_chunk)
+        for raw_chunk in raw_chunks
+    ]
+
+
+async def search_chunks_for_scenario_questions_async(scenario_questions: list[util.scenario.ScenarioQuestion], number_of_chunks: int = 5) -> list[list[util.chunk.DocumentChunk]]:
+    if not scenario_questions:
+        return []
+
+    pipeline: list = build_pipeline_from_vector_lists(
+        [scenario_question.embedding for scenario_question in scenario_questions],
+        number_of_chunks
+    )
+
+    coll = database.mongo.get_async_collection("chunks")
+
+    results: list[list[util.chunk.DocumentChunk]] = [[] for _ in scenario_questions]
+
+    with util.tracing.span("batched_search", vectors=len(scenario_questions)) as span:
+        cursor = await coll.aggregate(pipeline)
+        async for raw_chunk in cursor:
+            results[raw_chunk["query_index"]].append(util.chunk.DocumentChunk.from_dict(raw_chunk))
+
+        span.set("chunks", sum(len(chunks) for chunks in results))
+
+    return results
+
+
+async def retrieve_chunks_for_scenario_questions_async(scenario_questions: list[util.scenario.ScenarioQuestion], number_of_chunks: int = 5, snapshot: ragutil.scenario_index.ScenarioSnapshot = None) -> list[list[util.chunk.DocumentChunk]]:
+    """
+    asyncio variant of `retrieve_chunks_for_scenario_questions`, same results and fallbacks.
+    The per-question fallback overlaps on the event loop instead of the thread pool.
+    """
+    results: list[list[util.chunk.DocumentChunk]] = [None] * len(scenario_questions)
+
+    materialized_ids: dict[int, tuple[list[str], list[float]]] = _get_materialized_chunk_ids(scenario_questions, number_of_chunks, snapshot)
+
+    if materialized_ids:
+        all_ids: list[str] = [
+            chunk_id
+            for chunk_ids, _ in materialized_ids.values()
+            for chunk_id in chunk_ids
+        ]
+        with util.tracing.span("materialized_lookup", questions=len(materialized_ids), ids=len(all_ids)) as span:
+            chunks_by_id: dict[str, util.chunk.DocumentChunk] = await util.chunk.DocumentChunk.load_by_ids_async(all_ids)
+            span.set("chunks", len(chunks_by_id))
+
+        _apply_materialized_chunks(results, materialized_ids, chunks_by_id)
+
+    pending: list[int] = _get_pending(results)
+
+    if not pending:
+        return results
+
+    pending_questions: list[util.scenario.ScenarioQuestion] = [
+        scenario_questions[i]
+        for i in pending
+    ]
+    pending_results: list[list[util.chunk.DocumentChunk]] = None
+
+    if len(pending) > 1 and BATCHED_VECTOR_SEARCH and not _batched_search_unsupported:
+        try:
+            pending_results = await search_chunks_for_scenario_questions_async(pending_questions, number_of_chunks)
+        except pymongo.errors.OperationFailure as e:
+            _handle_batched_search_error(e)
+
+    if pending_results is None:
+        pending_results = await asyncio.gather(*[
+            search_chunks_for_scenario_question_async(scenario_question, number_of_chunks)
+            for scenario_question in pending_questions
+        ])
+
+    for i, chunks in zip(pending, pending_results):
+        results[i] = chunks
+
+    return results
@@ -0,0 +1,233 @@
+"""
+Fits the retrieved chunks into a token budget for the final prompt.
+
+Scenario descriptions and questions are always kept. The chunks are added
+in order of their similarity score until RAG_CONTEXT_TOKEN_BUDGET is used up;
+the chunk that no longer fits completely is cut after its last fitting
+sentence, all remaining chunks are dropped. Within a question block the
+chunks keep their retrieval order.
+
+Tokens are counted with the tokenizer of the embedding model (util.embedding).
+Chunks imported with a token count (`DocumentChunk.tokenizer`) are not re-tokenized.
+"""
+import dataclasses
+import logging
+import os
+import re
+import threading
+
+import util.chunk
+import util.embedding
+import util.scenario
+
+
+# 0 disables the budget
+CONTEXT_TOKEN_BUDGET: int = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))
+# A truncated chunk shorter than this is dropped instead
+MIN_TRUNCATED_TOKENS: int = int(os.getenv("RAG_CONTEXT_MIN_TRUNCATED_TOKENS", "32"))
+
+_SENTENCE_END: re.Pattern = re.compile(r"(?<=[.!?])\s+|\n+")
+
+ScenarioChunks = tuple[list[util.scenario.ScenarioQuestion], list[list[util.chunk.DocumentChunk]]]
+
+
+@dataclasses.dataclass
+class AssemblyReport(object):
+    budget: int
+    tokens_before: int
+    tokens_after: int
+    chunks_kept: int
+    chunks_truncated: int
+    chunks_dropped: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+_stats_lock: threading.Lock = threading.Lock()
+_stats: dict[str, int] = {
+    "prompts": 0,
+    "tokens_before": 0,
+    "tokens_after": 0,
+    "chunks_truncated": 0,
+    "chunks_dropped": 0,
+}
+
+
+def get_stats() -> dict[str, any]:
+    with _stats_lock:
+        stats: dict[str, any] = dict(_stats)
+
+    stats["budget"] = CONTEXT_TOKEN_BUDGET
+    stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+    stats["avg_tokens_after"] = stats["tokens_after"] / stats["prompts"] if stats["prompts"] else 0.0
+
+    return stats
+
+
+def count_chunk_tokens(chunks: list[util.chunk.DocumentChunk]) -> tuple[list[int], list[int]]:
+    """
+    Tokens of the heading prefix and of the text of every chunk block. Stored token counts
+    are reused, only chunks imported without one and the headings are tokenized.
+    """
+    heading_tokens: list[int] = util.embedding.count_tokens([f"{chunk.metadata.heading}: " for chunk in chunks])
+
+    missing: list[int] = [
+        i
+        for i, chunk in enumerate(chunks)
+        if chunk.tokenizer != util.embedding.DEFAULT_MODEL
+    ]
+    counted: list[int] = util.embedding.count_tokens([chunks[i].chunk_text for i in missing])
+
+    text_tokens: list[int] = [chunk.token_count for chunk in chunks]
+    for i, count in zip(missing, counted):
+        text_tokens[i] = count
+
+    return heading_tokens, text_tokens
+
+
+def split_sentences(text: str) -> list[str]:
+    return [
+        sentence
+        for sentence in _SENTENCE_END.split(text)
+        if sentence.strip()
+    ]
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> tuple[str, int]:
+    """
+    Cuts `text` after the last complete sentence within `max_tokens`.
+    Returns the text and its token count, ("", 0) if not even the first sentence fits.
+    """
+    sentences: list[str] = split_sentences(text)
+    sentence_tokens: list[int] = util.embedding.count_tokens(sentences)
+
+    kept: list[str] = []
+    total: int = 0
+
+    for sentence, tokens in zip(sentences, sentence_tokens):
+        if total + tokens > max_tokens:
+            break
+
+        kept.append(sentence)
+        total += tokens
+
+    return " ".join(kept), total
+
+
+def deduplicate(question_chunks: list[list[util.chunk.DocumentChunk]]) -> list[list[util.chunk.DocumentChunk]]:
+    # Same as rag.process_scenario: a chunk is only listed at the first question of a scenario that found it
+    seen: list[util.chunk.DocumentChunk] = []
+    reduced: list[list[util.chunk.DocumentChunk]] = []
+
+    for chunks in question_chunks:
+        reduced_chunks: list[util.chunk.DocumentChunk] = [
+            chunk
+            for chunk in chunks
+            if chunk not in seen
+        ]
+        seen.extend(reduced_chunks)
+        reduced.append(reduced_chunks)
+
+    return reduced
+
+
+def fit_to_budget(scenarios: list[util.scenario.Scenario], scenario_chunks: list[ScenarioChunks], budget: int = CONTEXT_TOKEN_BUDGET) -> tuple[list[ScenarioChunks], AssemblyReport]:
+    """
+    Returns the scenario chunks reduced to the budget (same structure, deduplicated per scenario)
+    and a report of the tokens saved.
+    """
+    scenario_chunks = [
+        (questions, deduplicate(question_chunks))
+        for questions, question_chunks in scenario_chunks
+    ]
+
+    # (scenario, question, position) of every chunk
+    positions: list[tuple[int, int, int]] = [
+        (s, q, c)
+        for s, (_, question_chunks) in enumerate(scenario_chunks)
+        for q, chunks in enumerate(question_chunks)
+        for c in range(len(chunks))
+    ]
+    chunks: list[util.chunk.DocumentChunk] = [
+        scenario_chunks[s][1][q][c]
+        for s, q, c in positions
+    ]
+    # Blocks are formatted like rag.build_question_block: "<heading>: <text>"
+    heading_tokens, text_tokens = count_chunk_tokens(chunks)
+    chunk_tokens: list[int] = [
+        heading + text
+        for heading, text in zip(heading_tokens, text_tokens)
+    ]
+
+    fixed_tokens: int = sum(util.embedding.count_tokens(
+        [scenario.description for scenario in scenarios] +
+        [question.question for questions, _ in scenario_chunks for question in questions]
+    ))
+
+    tokens_before: int = fixed_tokens + sum(chunk_tokens)
+
+    if budget <= 0 or tokens_before <= budget:
+        report: AssemblyReport = AssemblyReport(budget, tokens_before, tokens_before, len(chunks), 0, 0)
+        _record(report)
+        return scenario_chunks, report
+
+    # Best score first, chunks without a score (None) last, ties keep the retrieval order
+    order: list[int] = sorted(
+        range(len(chunks)),
+        key=lambda i: (chunks[i].score is None, -(chunks[i].score or 0.0), i)
+    )
+
+    remaining: int = budget - fixed_tokens
+    kept: dict[int, util.chunk.DocumentChunk] = {}
+    truncated: int = 0
+
+    for i in order:
+        if chunk_tokens[i] <= remaining:
+            kept[i] = chunks[i]
+            remaining -= chunk_tokens[i]
+            continue
+
+        if remaining - heading_tokens[i] >= MIN_TRUNCATED_TOKENS:
+            text, tokens = truncate_to_tokens(chunks[i].chunk_text, remaining - heading_tokens[i])
+
+            if tokens >= MIN_TRUNCATED_TOKENS:
+                kept[i] = dataclasses.replace(chunks[i], chunk_text=text, token_count=tokens, character_count=len(text), tokenizer=util.embedding.DEFAULT_MODEL)
+                chunk_tokens[i] = heading_tokens[i] + tokens
+                remaining -= chunk_tokens[i]
+                truncated += 1
+
+        # Everything after the first chunk that did not fit is dropped, lower scores must not overtake it
+        break
+
+    budgeted: list[ScenarioChunks] = [
+        (questions, [[] for _ in question_chunks])
+        for questions, question_chunks in scenario_chunks
+    ]
+    for i, (s, q, _) in enumerate(positions):
+        if i in kept:
+            budgeted[s][1][q].append(kept[i])
+
+    report = AssemblyReport(
+        budget=budget,
+        tokens_before=tokens_before,
+        tokens_after=fixed_tokens + sum(chunk_tokens[i] for i in kept),
+        chunks_kept=len(kept),
+        chunks_truncated=truncated,
+        chunks_dropped=len(chunks) - len(kept)
+    )
+    _record(report)
+
+    logging.info(f"Prompt context: {report.tokens_after}/{report.budget} tokens, saved {report.tokens_saved} ({report.chunks_truncated} truncated, {report.chunks_dropped} dropped chunks)")
+
+    return budgeted, report
+
+
+def _record(report: AssemblyReport) -> None:
+    with _stats_lock:
+        _stats["prompts"] += 1
+        _stats["tokens_before"] += report.tokens_before
+        _stats["tokens_after"] += report.tokens_after
+        _stats["chunks_truncated"] += report.chunks_truncated
+        _stats["chunks_dropped"] += report.chunks_dropped
@@ -0,0 +1,194 @@
+"""
+Optional extractive compression of the retrieved chunks (RAG_CONTEXT_COMPRESSION).
+
+Long chunks (Wikipedia paragraphs from ingest/txt, 5-row CSV batches) often
+contain only a sentence or two relevant to the scenario question. Every chunk
+is split into units (sentences, rows of JSON arrays), all units of a request are
+embedded in one batch, and per chunk only the RAG_COMPRESSION_MAX_UNITS units
+most similar to the embedding of its ScenarioQuestion are kept, in their
+original order.
+
+Runs between the chunk retrieval and the prompt token budget
+(ragutil.context_assembly). The compression ratio and the added latency are
+reported, so they can be weighed against the LLM time saved.
+"""
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy
+
+import ragutil.context_assembly
+import util.chunk
+import util.embedding
+import util.scenario
+
+
+CONTEXT_COMPRESSION: bool = os.getenv("RAG_CONTEXT_COMPRESSION", "0") == "1"
+MAX_UNITS: int = int(os.getenv("RAG_COMPRESSION_MAX_UNITS", "3"))
+
+ScenarioChunks = tuple[list[util.scenario.ScenarioQuestion], list[list[util.chunk.DocumentChunk]]]
+
+
+@dataclasses.dataclass
+class CompressionReport(object):
+    characters_before: int
+    characters_after: int
+    units_before: int
+    units_after: int
+    latency: float
+
+    @property
+    def compression_ratio(self) -> float:
+        """
+        Share of the characters kept, 1.0 means nothing was removed.
+        """
+        return self.characters_after / self.characters_before if self.characters_before else 1.0
+
+
+_stats_lock: threading.Lock = threading.Lock()
+_stats: dict[str, float] = {
+    "prompts": 0,
+    "characters_before": 0,
+    "characters_after": 0,
+    "units_before": 0,
+    "units_after": 0,
+    "total_latency": 0.0,
+}
+
+
+def get_stats() -> dict[str, any]:
+    with _stats_lock:
+        stats: dict[str, any] = dict(_stats)
+
+    stats["enabled"] = CONTEXT_COMPRESSION
+    stats["max_units"] = MAX_UNITS
+    stats["compression_ratio"] = stats["characters_after"] / stats["characters_before"] if stats["characters_before"] else 1.0
+    stats["avg_latency"] = stats["total_latency"] / stats["prompts"] if stats["prompts"] else 0.0
+
+    return stats
+
+
+def split_units(text: str) -> tuple[list[str], str]:
+    """
+    Splits a chunk text into the units compression selects from.
+    Returns the units and the separator to join the kept ones with:
+    - JSON arrays (csv/json chunker): one unit per element
+    - JSON strings (md chunker): sentences of the decoded text
+    - everything else: sentences
+    """
+    stripped: str = text.strip()
+
+    if stripped.startswith("[") or stripped.startswith('"'):
+        try:
+            value: any = json.loads(stripped)
+        except ValueError:
+            value = None
+
+        if isinstance(value, list):
+            return [json.dumps(element, ensure_ascii=False) for element in value], ", "
+        if isinstance(value, str):
+            text = value
+
+    return ragutil.context_assembly.split_sentences(text), " "
+
+
+def _join(units: list[str], separator: str, is_array: bool) -> str:
+    joined: str = separator.join(units)
+    return f"[{joined}]" if is_array else joined
+
+
+def compress(scenario_chunks: list[ScenarioChunks], max_units: int = MAX_UNITS) -> tuple[list[ScenarioChunks], CompressionReport]:
+    """
+    Returns the scenario chunks (same structure, deduplicated per scenario) with every
+    chunk reduced to its `max_units` units most similar to its question.
+    """
+    start_time: float = time.perf_counter()
+
+    scenario_chunks = [
+        (questions, ragutil.context_assembly.deduplicate(question_chunks))
+        for questions, question_chunks in scenario_chunks
+    ]
+
+    # (question embedding row, chunk, units, separator) of every chunk worth compressing
+    candidates: list[tuple[int, util.chunk.DocumentChunk, list[str], str]] = []
+    question_embeddings: list[list[float]] = []
+    characters_before: int = 0
+    units_before: int = 0
+
+    for questions, question_chunks in scenario_chunks:
+        for question, chunks in zip(questions, question_chunks):
+            question_embeddings.append(question.embedding)
+
+            for chunk in chunks:
+                units, separator = split_units(chunk.chunk_text)
+
+                characters_before += len(chunk.chunk_text)
+                units_before += len(units)
+
+                if len(units) > max_units:
+                    candidates.append((len(question_embeddings) - 1, chunk, units, separator))
+
+    all_units: list[str] = [
+        unit
+        for _, _, units, _ in candidates
+        for unit in units
+    ]
+
+    compressed: dict[int, util.chunk.DocumentChunk] = {}
+
+    if all_units:
+        unit_embeddings: numpy.ndarray = util.embedding.build_embeddings(all_units)
+        unit_embeddings /= numpy.maximum(numpy.linalg.norm(unit_embeddings, axis=1, keepdims=True), 1e-12)
+
+        questions_matrix: numpy.ndarray = numpy.asarray(question_embeddings, dtype=numpy.float32)
+        questions_matrix /= numpy.maximum(numpy.linalg.norm(questions_matrix, axis=1, keepdims=True), 1e-12)
+
+        offset: int = 0
+
+        for question_row, chunk, units, separator in candidates:
+            similarities: numpy.ndarray = unit_embeddings[offset:offset + len(units)] @ questions_matrix[question_row]
+            offset += len(units)
+
+            # Best units, restored to their original order
+            keep: list[int] = sorted(numpy.argsort(-similarities, kind="stable")[:max_units].tolist())
+            text: str = _join([units[i] for i in keep], separator, separator == ", ")
+
+            # Counted again by the token budget
+            compressed[id(chunk)] = dataclasses.replace(chunk, chunk_text=text, character_count=len(text), token_count=None, tokenizer=None)
+
+    result: list[ScenarioChunks] = [
+        (
+            questions,
+            [
+                [compressed.get(id(chunk), chunk) for chunk in chunks]
+                for chunks in question_chunks
+            ]
+        )
+        for questions, question_chunks in scenario_chunks
+    ]
+
+    characters_after: int = sum(
+        len(chunk.chunk_text)
+        for _, question_chunks in result
+        for chunks in question_chunks
+        for chunk in chunks
+    )
+    units_after: int = units_before - sum(len(units) - max_units for _, _, units, _ in candidates)
+
+    report: CompressionReport = CompressionReport(characters_before, characters_after, units_before, units_after, time.perf_counter() - start_time)
+
+    with _stats_lock:
+        _stats["prompts"] += 1
+        _stats["characters_before"] += report.characters_before
+        _stats["characters_after"] += report.characters_after
+        _stats["units_before"] += report.units_before
+        _stats["units_after"] += report.units_after
+        _stats["total_latency"] += report.latency
+
+    logging.info(f"Context compression: kept {report.compression_ratio:.0%} of {report.characters_before} characters ({report.units_after}/{report.units_before} units) in {report.latency * 1000:.1f}ms")
+
+    return result, report
@@ -0,0 +1,118 @@
+"""
+Local keyword extraction, an alternative to the first Perplexity call.
+
+KeyBERT-style: all 1- to 3-word n-grams of the user input (without leading or
+trailing stop words) are embedded with the already loaded MiniLM model, ranked
+by cosine similarity to the embedding of the whole input and picked with
+Maximal Marginal Relevance, so the keywords do not all repeat the same aspect.
+One batched `encode` call per request, no network round trip.
+"""
+import re
+
+import numpy
+
+import util.embedding
+
+
+MAX_KEYWORDS: int = 10
+MAX_NGRAM_LENGTH: int = 3
+# 0 ranks purely by relevance, 1 purely by diversity
+DIVERSITY: float = 0.5
+
+_WORD: re.Pattern = re.compile(r"[\w][\w\-\.\+#]*[\w\+#]|[\w]", re.UNICODE)
+
+STOP_WORDS: frozenset[str] = frozenset("""
+aber alle allem allen aller alles als also am an ander andere anderem anderen anderer anderes
+auch auf aus bei bin bis bist da damit dann das dass dasselbe dazu dein deine deinem deinen
+deiner dem den denn der des desselben dessen dich die dies diese dieselbe dieselben diesem
+diesen dieser dieses dir doch dort du durch ein eine einem einen einer eines einig einige
+einigem einigen einiger einiges einmal er es etwas euch euer eure für gegen gewesen hab habe
+haben hat hatte hatten hier hin hinter ich ihm ihn ihnen ihr ihre ihrem ihren ihrer ihres im
+in indem ins ist jede jedem jeden jeder jedes jene jenem jenen jener jenes jetzt kann kein
+keine keinem keinen keiner keines können könnte machen man manche manchem manchen mancher
+manches mein meine meinem meinen meiner meines mich mir mit muss musste möchte möchten nach
+nicht nichts noch nun nur ob oder ohne sehr sein seine seinem seinen seiner seines selbst
+sich sie sind so solche solchem solchen solcher solches soll sollen sollte sondern sonst
+über um und uns unser unsere unserem unseren unserer unseres unter viel viele vom von vor
+während war waren warst was weg weil weiter welche welchem welchen welcher welches wenn
+werde werden wie wieder will wir wird wirst wo wollen wollte würde würden zu zum zur zwar
+zwischen sowie hierfür hierbei dafür darf benötige benötigen benötigt geeignet gibt ganz bitte
+a an and are as at be by for from has have how i in is it of on or that the this to was
+what which with would you your
+""".split())
+
+
+def _tokenize(user_input: str) -> list[str]:
+    return _WORD.findall(user_input)
+
+
+def build_candidates(user_input: str, max_ngram_length: int = MAX_NGRAM_LENGTH) -> list[str]:
+    """
+    All n-grams of up to `max_ngram_length` words that neither start nor end with a stop word
+    and are not purely numeric, in order of their first occurrence.
+    """
+    words: list[str] = _tokenize(user_input)
+    candidates: dict[str, None] = {}
+
+    for start in range(len(words)):
+        for length in range(1, max_ngram_length + 1):
+            ngram: list[str] = words[start:start + length]
+
+            if len(ngram) < length:
+                break
+
+            first: str = ngram[0].casefold()
+            last: str = ngram[-1].casefold()
+
+            if first in STOP_WORDS or last in STOP_WORDS:
+                continue
+            if all(word.isdigit() for word in ngram):
+                continue
+
+            candidates.setdefault(" ".join(ngram), None)
+
+    return list(candidates)
+
+
+def _normalize(matrix: numpy.ndarray) -> numpy.ndarray:
+    norms: numpy.ndarray = numpy.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def maximal_marginal_relevance(document_embedding: numpy.ndarray, candidate_embeddings: numpy.ndarray, number_of_keywords: int, diversity: float = DIVERSITY) -> list[int]:
+    """
+    Returns the indices of the selected candidates, most relevant first.
+    Expects normalized embeddings.
+    """
+    relevance: numpy.ndarray = candidate_embeddings @ document_embedding
+    similarities: numpy.ndarray = candidate_embeddings @ candidate_embeddings.T
+
+    selected: list[int] = [int(numpy.argmax(relevance))]
+    remaining: list[int] = [i for i in range(len(relevance)) if i != selected[0]]
+
+    while remaining and len(selected) < number_of_keywords:
+        redundancy: numpy.ndarray = similarities[numpy.ix_(remaining, selected)].max(axis=1)
+        scores: numpy.ndarray = (1.0 - diversity) * relevance[remaining] - diversity * redundancy
+
+        best: int = remaining[int(numpy.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+
+    return selected
+
+
+def extract_keywords(user_input: str, number_of_keywords: int = MAX_KEYWORDS, diversity: float = DIVERSITY) -> list[str]:
+    candidates: list[str] = build_candidates(user_input)
+
+    if not candidates:
+        return []
+
+    embeddings: numpy.ndarray = _normalize(util.embedding.build_embeddings([user_input] + candidates))
+
+    selected: list[int] = maximal_marginal_relevance(embeddings[0], embeddings[1:], number_of_keywords, diversity)
+
+    return [
+        candidates[i]
+        for i in selected
+    ]
@@ -0,0 +1,176 @@
+"""
+Disk-backed cache for LLM completions.
+Stored in a local SQLite file (LLM_CACHE_PATH).
+
+The key is a SHA-256 over the complete request payload (model, messages and
+sampling parameters), so changing any of them is a miss. Once the cache holds
+more than LLM_CACHE_MAX_ENTRIES completions, the least recently used ones are
+deleted. Shared by all threads and worker processes of one machine.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+LLM_CACHE_PATH: str = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "..", ".cache", "llm_cache.sqlite3"))
+LLM_CACHE_MAX_ENTRIES: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+
+
+def build_key(payload: dict[str, any]) -> str:
+    serialized: str = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LLMCache(object):
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path: str = path
+        self.max_entries: int = max_entries
+
+        self._connection: sqlite3.Connection = None
+        self._connection_pid: int = None
+        self._lock: threading.Lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.errors: int = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections must not be used across fork()
+        if self._connection is not None and self._connection_pid == os.getpid():
+            return self._connection
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        connection: sqlite3.Connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            """
+            CREATE INDEX IF NOT EXISTS completions_last_used_idx ON completions (last_used)
+            """
+        )
+
+        self._connection = connection
+        self._connection_pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> str:
+        try:
+            with self._lock:
+                connection: sqlite3.Connection = self._connect()
+                row: tuple[str] = connection.execute(
+                    """
+                    SELECT response FROM completions WHERE key = ?
+                    """,
+                    (key,)
+                ).fetchone()
+
+                if row is None:
+                    self.misses += 1
+                    return None
+
+                connection.execute(
+                    """
+                    UPDATE completions SET last_used = ? WHERE key = ?
+                    """,
+                    (time.time(), key)
+                )
+                self.hits += 1
+                return row[0]
+        except sqlite3.Error:
+            # The cache is optional, a broken or locked file must not fail the request
+            logging.exception("Reading the LLM cache failed")
+            self.errors += 1
+            return None
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now: float = time.time()
+
+        try:
+            with self._lock:
+                connection: sqlite3.Connection = self._connect()
+                connection.execute(
+                    """
+                    INSERT INTO completions (key, model, response, created_at, last_used)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE
+                    SET response = excluded.response, created_at = excluded.created_at, last_used = excluded.last_used
+                    """,
+                    (key, model, response, now, now)
+                )
+
+                evicted: int = connection.execute(
+                    """
+                    DELETE FROM completions WHERE key IN (
+                        SELECT key FROM completions
+                        ORDER BY last_used DESC
+                        LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,)
+                ).rowcount
+                self.evictions += max(evicted, 0)
+        except sqlite3.Error:
+            logging.exception("Writing the LLM cache failed")
+            self.errors += 1
+
+    def delete(self, key: str) -> None:
+        try:
+            with self._lock:
+                self._connect().execute(
+                    """
+                    DELETE FROM completions WHERE key = ?
+                    """,
+                    (key,)
+                )
+        except sqlite3.Error:
+            logging.exception("Deleting from the LLM cache failed")
+            self.errors += 1
+
+    def stats(self) -> dict[str, any]:
+        try:
+            with self._lock:
+                size: int = self._connect().execute(
+                    """
+                    SELECT COUNT(*) FROM completions
+                    """
+                ).fetchone()[0]
+        except sqlite3.Error:
+            size = None
+
+        lookups: int = self.hits + self.misses
+
+        return {
+            "path": os.path.abspath(self.path),
+            "size": size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+
+llm_cache: LLMCache = LLMCache()
+
+
+def get_stats() -> dict[str, any]:
+    return llm_cache.stats()
@@ -1,22 +1,31 @@
+import asyncio
+import httpx
+import json
 import requests
 import os
 
+import ragutil.llm_cache
+import util.tracing
+
 class PerplexityQuerier:
     """Beantwortet Fragen - Spezialist für intelligente Fragen + Synthese"""
     
     def __init__(self):
         self.api_key = os.getenv("PERPLEXITY_API_KEY", "")
         self.base_url = 'https://api.perplexity.ai'
-    
-    def prompt(self, prompt: str) -> str:
-        model: str = "sonar"
+        self._async_client: httpx.AsyncClient = None
 
-        headers = {
+    def _build_headers(self) -> dict[str, str]:
+        return {
             'Authorization': f'Bearer {self.api_key}',
             'Content-Type': 'application/json',
         }
 
-        payload = {
+    @staticmethod
+    def _build_payload(prompt: str, stream: bool = False) -> dict[str, any]:
+        model: str = "sonar"
+
+        payload: dict[str, any] = {
             'model': model,
             'messages': [
                 {
@@ -32,18 +41,201 @@ class PerplexityQuerier:
             'temperature': 0.7,
         }
 
-        response = requests.post(
-            f'{self.base_url}/chat/completions',
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
-        response.raise_for_status()
-        
-        result = response.json()
-        answer = result['choices'][0]['message']['content']
-
-        return answer
+        if stream:
+            payload['stream'] = True
+
+        return payload
+
+    @staticmethod
+    def _parse_stream_line(line: str) -> str:
+        """
+        Returns the content delta of one `data: {...}` line of the event stream, None for anything else.
+        """
+        if not line or not line.startswith('data:'):
+            return None
+
+        data: str = line[len('data:'):].strip()
+        if data == '[DONE]':
+            return None
+
+        choices: list[dict[str, any]] = json.loads(data).get('choices') or [{}]
+        return choices[0].get('delta', {}).get('content') or None
+
+    def prompt(self, prompt: str, use_cache: bool = False) -> str:
+        """
+        With `use_cache` identical requests (same model, prompt and parameters)
+        are answered from the local LLM cache (ragutil.llm_cache).
+        """
+        payload: dict[str, any] = self._build_payload(prompt)
+
+        with util.tracing.span("llm", model=payload['model'], prompt_characters=len(prompt), cached=False) as span:
+            if use_cache:
+                key: str = ragutil.llm_cache.build_key(payload)
+                cached: str = ragutil.llm_cache.llm_cache.get(key)
+                if cached is not None:
+                    span.set("cached", True)
+                    return cached
+
+            response = requests.post(
+                f'{self.base_url}/chat/completions',
+                headers=self._build_headers(),
+                json=payload,
+                timeout=60
+            )
+            response.raise_for_status()
+
+            result = response.json()
+            answer = result['choices'][0]['message']['content']
+            self._trace_response(span, response.request.body, response.content, result)
+
+            # An empty answer would be served from the cache from then on
+            if use_cache and isinstance(answer, str) and answer:
+                ragutil.llm_cache.llm_cache.put(key, payload['model'], answer)
+
+            return answer
+
+    def prompt_stream(self, prompt: str, use_cache: bool = False):
+        """
+        Yields the answer in pieces as the API generates them (server-sent events).
+        With `use_cache` a cached answer is yielded as one piece, a streamed one is
+        stored once complete. Same entries as `prompt`.
+        """
+        payload: dict[str, any] = self._build_payload(prompt, stream=True)
+
+        with util.tracing.span("llm", model=payload['model'], prompt_characters=len(prompt), stream=True, cached=False) as span:
+            if use_cache:
+                key: str = ragutil.llm_cache.build_key(self._build_payload(prompt))
+                cached: str = ragutil.llm_cache.llm_cache.get(key)
+                if cached is not None:
+                    span.set("cached", True)
+                    yield cached
+                    return
+
+            pieces: list[str] = []
+
+            with requests.post(
+                f'{self.base_url}/chat/completions',
+                headers=self._build_headers(),
+                json=payload,
+                timeout=60,
+                stream=True
+            ) as response:
+                response.raise_for_status()
+                response_bytes: int = 0
+
+                # Decoded here, requests would assume ISO-8859-1 for text/event-stream
+                for line in response.iter_lines():
+                    response_bytes += len(line)
+                    span.set("response_bytes", response_bytes)
+
+                    content: str = self._parse_stream_line(line.decode('utf-8'))
+                    if content:
+                        pieces.append(content)
+                        yield content
+
+            if use_cache and pieces:
+                ragutil.llm_cache.llm_cache.put(key, payload['model'], "".join(pieces))
+
+    @staticmethod
+    def _trace_response(span: util.tracing.Span, request_body: bytes, response_body: bytes, result: dict[str, any]) -> None:
+        """
+        Transferred bytes and the token usage reported by the API.
+        """
+        span.set("request_bytes", len(request_body or b""))
+        span.set("response_bytes", len(response_body))
+
+        usage: dict[str, int] = result.get('usage') or {}
+        span.set("prompt_tokens", usage.get('prompt_tokens'))
+        span.set("completion_tokens", usage.get('completion_tokens'))
+
+    def forget(self, prompt: str) -> None:
+        """
+        Removes the cached answer of `prompt`, e.g. when it could not be parsed.
+        """
+        ragutil.llm_cache.llm_cache.delete(ragutil.llm_cache.build_key(self._build_payload(prompt)))
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            max_connections: int = int(os.getenv("PERPLEXITY_MAX_CONNECTIONS", "100"))
+            self._async_client = httpx.AsyncClient(
+                timeout=60,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+
+        return self._async_client
+
+    async def prompt_async(self, prompt: str, use_cache: bool = False) -> str:
+        """
+        Same as `prompt`, but waits on the API without blocking a thread.
+        The AsyncClient (and its connection pool) is shared by all requests of the event loop.
+        """
+        payload: dict[str, any] = self._build_payload(prompt)
+
+        with util.tracing.span("llm", model=payload['model'], prompt_characters=len(prompt), cached=False) as span:
+            if use_cache:
+                key: str = ragutil.llm_cache.build_key(payload)
+                cached: str = await asyncio.to_thread(ragutil.llm_cache.llm_cache.get, key)
+                if cached is not None:
+                    span.set("cached", True)
+                    return cached
+
+            response = await self._get_async_client().post(
+                f'{self.base_url}/chat/completions',
+                headers=self._build_headers(),
+                json=payload
+            )
+            response.raise_for_status()
+
+            result = response.json()
+            answer = result['choices'][0]['message']['content']
+            self._trace_response(span, response.request.content, response.content, result)
+
+            if use_cache and isinstance(answer, str) and answer:
+                await asyncio.to_thread(ragutil.llm_cache.llm_cache.put, key, payload['model'], answer)
+
+            return answer
+
+    async def prompt_stream_async(self, prompt: str, use_cache: bool = False):
+        """
+        Same as `prompt_stream` on the shared AsyncClient.
+        """
+        client: httpx.AsyncClient = self._get_async_client()
+        payload: dict[str, any] = self._build_payload(prompt, stream=True)
+
+        with util.tracing.span("llm", model=payload['model'], prompt_characters=len(prompt), stream=True, cached=False) as span:
+            if use_cache:
+                key: str = ragutil.llm_cache.build_key(self._build_payload(prompt))
+                cached: str = await asyncio.to_thread(ragutil.llm_cache.llm_cache.get, key)
+                if cached is not None:
+                    span.set("cached", True)
+                    yield cached
+                    return
+
+            pieces: list[str] = []
+
+            async with client.stream(
+                'POST',
+                f'{self.base_url}/chat/completions',
+                headers=self._build_headers(),
+                json=payload
+            ) as response:
+                response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    span.set("response_bytes", response.num_bytes_downloaded)
+
+                    content: str = self._parse_stream_line(line)
+                    if content:
+                        pieces.append(content)
+                        yield content
+
+            if use_cache and pieces:
+                await asyncio.to_thread(ragutil.llm_cache.llm_cache.put, key, payload['model'], "".join(pieces))
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
 
     
     @staticmethod
@@ -0,0 +1,130 @@
+"""
+Metrics of the RAG pipeline for /metrics (util.metrics).
+
+Latencies are taken from the request traces (util.tracing): every finished
+trace feeds the end-to-end histogram, every span the stage histogram and
+every `llm` span the LLM request counter. The cache and pool statistics
+are read from their modules at scrape time.
+"""
+import database.mongo
+import database.postgres
+import ragutil.answer_cache
+import ragutil.llm_cache
+import ragutil.semantic_cache
+import util.embedding_cache
+import util.metrics
+import util.tracing
+
+
+REQUEST_BUCKETS: tuple[float, ...] = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+STAGE_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_duration: util.metrics.Histogram = util.metrics.histogram(
+    "rag_request_duration_seconds",
+    "End-to-end duration of a RAG request",
+    ("pipeline", "outcome"),
+    REQUEST_BUCKETS
+)
+stage_duration: util.metrics.Histogram = util.metrics.histogram(
+    "rag_stage_duration_seconds",
+    "Duration of the pipeline stages (trace spans)",
+    ("stage",),
+    STAGE_BUCKETS
+)
+llm_requests: util.metrics.Counter = util.metrics.counter(
+    "rag_llm_requests_total",
+    "LLM calls by outcome (ok, cached, error)",
+    ("outcome",)
+)
+in_flight_requests: util.metrics.Gauge = util.metrics.gauge(
+    "rag_in_flight_requests",
+    "HTTP requests currently being served by this process"
+)
+
+
+def _outcome(root: util.tracing.Span) -> str:
+    if root.error is not None or "error" in root.attributes:
+        return "error"
+    if "cache" in root.attributes:
+        return "cache"
+    return "answer"
+
+
+def observe_trace(trace: util.tracing.Trace) -> None:
+    root: util.tracing.Span = trace.spans[0]
+    request_duration.observe(root.duration, pipeline=root.name, outcome=_outcome(root))
+
+    for span in trace.spans[1:]:
+        # Still running, e.g. a cancelled speculative retrieval
+        if span.duration is None:
+            continue
+
+        stage_duration.observe(span.duration, stage=span.name)
+
+        if span.name == "llm":
+            if span.error is not None:
+                llm_requests.inc(outcome="error")
+            elif span.attributes.get("cached"):
+                llm_requests.inc(outcome="cached")
+            else:
+                llm_requests.inc(outcome="ok")
+
+
+def _cache_families() -> list[util.metrics.MetricFamily]:
+    # LLMCache.stats() counts the SQLite rows, the counters are read directly
+    caches: dict[str, tuple[int, int]] = {
+        "answer": (ragutil.answer_cache.answer_cache.hits, ragutil.answer_cache.answer_cache.misses),
+        "semantic": (ragutil.semantic_cache.semantic_cache.hits, ragutil.semantic_cache.semantic_cache.misses),
+        "llm": (ragutil.llm_cache.llm_cache.hits, ragutil.llm_cache.llm_cache.misses),
+        "embedding": (
+            util.embedding_cache.embedding_cache.memory_hits + util.embedding_cache.embedding_cache.disk_hits,
+            util.embedding_cache.embedding_cache.misses
+        ),
+    }
+
+    return [
+        util.metrics.MetricFamily("rag_cache_hits_total", "counter", "Cache hits", [
+            ({"cache": cache}, hits)
+            for cache, (hits, _) in caches.items()
+        ]),
+        util.metrics.MetricFamily("rag_cache_misses_total", "counter", "Cache misses", [
+            ({"cache": cache}, misses)
+            for cache, (_, misses) in caches.items()
+        ]),
+        util.metrics.MetricFamily("rag_cache_hit_ratio", "gauge", "Cache hits per lookup since start", [
+            ({"cache": cache}, hits / (hits + misses) if hits + misses else 0.0)
+            for cache, (hits, misses) in caches.items()
+        ]),
+    ]
+
+
+def _pool_families() -> list[util.metrics.MetricFamily]:
+    in_use: list[tuple[dict[str, str], float]] = []
+    max_size: list[tuple[dict[str, str], float]] = []
+    waits: list[tuple[dict[str, str], float]] = []
+
+    mongo: dict[str, any] = database.mongo.get_pool_stats()
+    in_use.append(({"database": "mongo"}, mongo["checked_out"]))
+    max_size.append(({"database": "mongo"}, mongo["max_pool_size"]))
+    waits.append(({"database": "mongo"}, mongo["total_wait_time"]))
+
+    for pool in database.postgres.get_pool_stats():
+        labels: dict[str, str] = {"database": f"postgres/{pool['database']}"}
+        in_use.append((labels, pool["in_use"]))
+        max_size.append((labels, pool["max_size"]))
+        waits.append((labels, pool["total_wait_time"]))
+
+    return [
+        util.metrics.MetricFamily("rag_db_pool_connections_in_use", "gauge", "Connections checked out of the pool", in_use),
+        util.metrics.MetricFamily("rag_db_pool_max_size", "gauge", "Maximum pool size", max_size),
+        util.metrics.MetricFamily("rag_db_pool_utilization", "gauge", "Connections in use per maximum pool size", [
+            (labels, used / size if size else 0.0)
+            for (labels, used), (_, size) in zip(in_use, max_size)
+        ]),
+        util.metrics.MetricFamily("rag_db_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection", waits),
+    ]
+
+
+util.tracing.add_listener(observe_trace)
+util.metrics.registry.add_collector(_cache_families)
+util.metrics.registry.add_collector(_pool_families)
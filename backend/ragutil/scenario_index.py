@@ -0,0 +1,227 @@
+"""
+In-process snapshot of the scenarios, scenario_questions and
+scenario_question_chunks tables.
+
+The snapshot is loaded once at startup and afterwards only replaced when
+the data version stamps (util.data_version) change, e.g. after
+`start_setup.py` re-imported the scenarios. Requests therefore never hit
+Postgres for scenario routing.
+"""
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy
+import psycopg2.errors
+
+import database.postgres
+import util.data_version
+import util.scenario
+
+
+REFRESH_INTERVAL: float = float(os.getenv("SCENARIO_INDEX_REFRESH_SECONDS", "30"))
+
+
+def _to_matrix(raw_embeddings: list[any], dimension: int = 384) -> numpy.ndarray:
+    """
+    Converts pgvector values (text without a registered type, numpy arrays with one)
+    into a C-contiguous float32 matrix.
+    """
+    if not raw_embeddings:
+        return numpy.empty((0, dimension), dtype=numpy.float32)
+
+    rows: list[any] = [
+        json.loads(raw) if isinstance(raw, str) else raw
+        for raw in raw_embeddings
+    ]
+    return numpy.ascontiguousarray(rows, dtype=numpy.float32)
+
+
+@dataclasses.dataclass(frozen=True)
+class ScenarioSnapshot(object):
+    version: tuple[tuple[str, int], ...]
+    scenarios: list[util.scenario.Scenario]
+    scenario_embeddings: numpy.ndarray
+    questions: list[util.scenario.ScenarioQuestion]
+    question_embeddings: numpy.ndarray
+    question_rows_by_scenario: dict[int, list[int]]
+    materialized_chunks: dict[int, tuple[list[str], list[float], int]]
+
+    def match(self, keyword_embeddings: numpy.ndarray, number_of_scenarios: int) -> list[tuple[util.scenario.Scenario, float]]:
+        """
+        Scores like the former SQL query: sum over all keywords of (1 - L2 distance).
+        The distances are derived from a single matmul.
+        """
+        if not self.scenarios or len(keyword_embeddings) == 0:
+            return []
+
+        scenario_norms: numpy.ndarray = numpy.einsum("ij,ij->i", self.scenario_embeddings, self.scenario_embeddings)
+        keyword_norms: numpy.ndarray = numpy.einsum("ij,ij->i", keyword_embeddings, keyword_embeddings)
+
+        squared_distances: numpy.ndarray = scenario_norms[:, None] + keyword_norms[None, :] - 2.0 * (self.scenario_embeddings @ keyword_embeddings.T)
+        distances: numpy.ndarray = numpy.sqrt(numpy.maximum(squared_distances, 0.0))
+
+        similarities: numpy.ndarray = (1.0 - distances).sum(axis=1)
+
+        order: numpy.ndarray = numpy.argsort(-similarities, kind="stable")[:number_of_scenarios]
+
+        return [
+            (self.scenarios[i], float(similarities[i]))
+            for i in order
+        ]
+
+    def get_questions(self, scenario_id: int) -> list[util.scenario.ScenarioQuestion]:
+        return [
+            self.questions[row]
+            for row in self.question_rows_by_scenario.get(scenario_id, [])
+        ]
+
+    def get_materialized_chunk_ids(self, question_id: int, number_of_chunks: int) -> list[str]:
+        """
+        Returns the precomputed best chunk ids (rag::scenario_question_chunks),
+        None if the question was not materialized with at least `number_of_chunks`.
+        """
+        materialized: tuple[list[str], list[float], int] = self.materialized_chunks.get(question_id)
+
+        if materialized is None:
+            return None
+
+        chunk_ids, _, top_k = materialized
+
+        if number_of_chunks > top_k:
+            return None
+
+        return chunk_ids[:number_of_chunks]
+
+    def get_materialized_chunk_scores(self, question_id: int, number_of_chunks: int) -> list[float]:
+        """
+        The `vectorSearchScore` equivalents of `get_materialized_chunk_ids`.
+        """
+        materialized: tuple[list[str], list[float], int] = self.materialized_chunks.get(question_id)
+
+        if materialized is None:
+            return None
+
+        return materialized[1][:number_of_chunks]
+
+
+_snapshot: ScenarioSnapshot = None
+_last_check: float = 0.0
+_refresh_lock: threading.Lock = threading.Lock()
+
+
+def _current_version() -> tuple[tuple[str, int], ...]:
+    return tuple(sorted(util.data_version.get_versions().items()))
+
+
+def build_snapshot() -> ScenarioSnapshot:
+    # Read the stamp first, an import running during the load is picked up by the next check
+    version: tuple[tuple[str, int], ...] = _current_version()
+
+    raw_scenarios: list[dict[str, any]] = database.postgres.fetch_all(
+        """
+        SELECT id, name, description, embedding FROM scenarios
+        ORDER BY id
+        """,
+        "rag"
+    )
+    raw_questions: list[dict[str, any]] = database.postgres.fetch_all(
+        """
+        SELECT id, scenario_id, question, answer, embedding FROM scenario_questions
+        ORDER BY scenario_id, id
+        """,
+        "rag"
+    )
+
+    try:
+        raw_materialized: list[dict[str, any]] = database.postgres.fetch_all(
+            """
+            SELECT question_id, chunk_ids, scores, top_k FROM scenario_question_chunks
+            """,
+            "rag"
+        )
+    except psycopg2.errors.UndefinedTable:
+        # Not materialized yet, chunks are searched live. Every other error reaches the caller
+        raw_materialized = []
+
+    scenarios: list[util.scenario.Scenario] = [
+        util.scenario.Scenario.from_dict(raw)
+        for raw in raw_scenarios
+    ]
+    questions: list[util.scenario.ScenarioQuestion] = [
+        util.scenario.ScenarioQuestion.from_dict(raw)
+        for raw in raw_questions
+    ]
+
+    question_rows_by_scenario: dict[int, list[int]] = {}
+    for row, question in enumerate(questions):
+        question_rows_by_scenario.setdefault(question.scenario_id, []).append(row)
+
+    return ScenarioSnapshot(
+        version=version,
+        scenarios=scenarios,
+        scenario_embeddings=_to_matrix([raw["embedding"] for raw in raw_scenarios]),
+        questions=questions,
+        question_embeddings=_to_matrix([question.embedding for question in questions]),
+        question_rows_by_scenario=question_rows_by_scenario,
+        materialized_chunks={
+            raw["question_id"]: (raw["chunk_ids"], raw["scores"], raw["top_k"])
+            for raw in raw_materialized
+        }
+    )
+
+
+def load() -> ScenarioSnapshot:
+    """
+    (Re-)loads the snapshot unconditionally. Called at startup.
+    """
+    global _snapshot, _last_check
+
+    with _refresh_lock:
+        start_time: float = time.perf_counter()
+        snapshot: ScenarioSnapshot = build_snapshot()
+
+        # Swapping the reference is atomic, running requests keep their old snapshot
+        _snapshot = snapshot
+        _last_check = time.monotonic()
+
+        delta: float = time.perf_counter() - start_time
+        logging.info(f"Loaded scenario snapshot {snapshot.version}: {len(snapshot.scenarios)} scenarios, {len(snapshot.questions)} questions in {delta:.3f}s")
+
+    return snapshot
+
+
+def get_snapshot() -> ScenarioSnapshot:
+    """
+    Returns the current snapshot.
+    At most every REFRESH_INTERVAL seconds the version stamps are checked and the
+    snapshot is rebuilt if they changed. Only one thread refreshes, all others
+    continue with the current snapshot meanwhile.
+    """
+    global _last_check
+
+    snapshot: ScenarioSnapshot = _snapshot
+
+    if snapshot is None:
+        return load()
+
+    if time.monotonic() - _last_check < REFRESH_INTERVAL:
+        return snapshot
+
+    if not _refresh_lock.acquire(blocking=False):
+        return snapshot
+
+    try:
+        _last_check = time.monotonic()
+        if _current_version() == snapshot.version:
+            return snapshot
+    except Exception:
+        logging.exception("Checking the scenario data version failed, keeping the current snapshot")
+        return snapshot
+    finally:
+        _refresh_lock.release()
+
+    return load()
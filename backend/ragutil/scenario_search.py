@@ -1,64 +1,65 @@
-import pgvector.psycopg2
-import pgvector.psycopg2.vector
-import torch
+import numpy
 
-import database.postgres
+import ragutil.scenario_index
 import util.embedding
 import util.scenario
 
 
-def match_keywords(keywords: list[str], number_of_scenarios: int = 3) -> list[util.scenario.Scenario]:
-    keyword_vectors: list[pgvector.psycopg2.vector.Vector] = []
-
-    query_parts: list[str] = []
-    single_query_part: str = "1 - (embedding <-> %s)"
+def normalize_keywords(keywords: list[str]) -> list[str]:
+    """
+    Strips, collapses whitespace and casefolds the keywords.
+    Empty and duplicate keywords are dropped, the first occurrence keeps its position.
+    """
+    normalized_keywords: list[str] = []
 
     for keyword in keywords:
+        normalized: str = " ".join(str(keyword).split()).casefold()
+
+        if normalized and normalized not in normalized_keywords:
+            normalized_keywords.append(normalized)
+
+    return normalized_keywords
+
+
+def match_keywords(keywords: list[str], number_of_scenarios: int = 3, snapshot: ragutil.scenario_index.ScenarioSnapshot = None) -> list[util.scenario.Scenario]:
+    normalized_keywords: list[str] = normalize_keywords(keywords)
+
+    if not normalized_keywords:
+        return []
 
-        embedding: torch.Tensor = util.embedding.build_embedding(keyword)
-        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding.tolist())
+    if snapshot is None:
+        snapshot = ragutil.scenario_index.get_snapshot()
 
-        keyword_vectors.append(vector)
+    embeddings: numpy.ndarray = util.embedding.build_embeddings(normalized_keywords)
 
-        query_parts.append(single_query_part)
-    
-    
-    similarity_filter: str = " + ".join(query_parts)
+    results: list[tuple[util.scenario.Scenario, float]] = snapshot.match(embeddings, number_of_scenarios)
 
-    with database.postgres.create_connection("rag") as conn:
-        cursor = conn.cursor()
-        pgvector.psycopg2.register_vector(conn)
+    scenarios: list[util.scenario.Scenario] = []
 
-        cursor.execute(
-            f"""
-            SELECT
-                id,
-                name,
-                description,
-                ({similarity_filter}) AS similarity
-            FROM scenarios
-            ORDER BY similarity DESC
-            LIMIT {number_of_scenarios}
-            """,
-            tuple(keyword_vectors)
-        )
+    if results:
+        print("\nNew results")
+        for scenario, similarity in results:
+            print(f"{similarity:.5f}: {scenario.name}")
 
-        results = cursor.fetchall()
-        column_names = [col[0] for col in cursor.description]
+            scenarios.append(scenario)
 
-        scenarios: list[util.scenario.Scenario] = []
+    return scenarios
 
-        if results:
-            print("\nNew results")
-            for row in results:
-                raw_result: dict[str, any] = dict(zip(column_names, row))
 
-                scenario_name: str = raw_result["name"]
-                similarity: float = raw_result["similarity"]
+def match_input(user_input: str, number_of_scenarios: int = 3, snapshot: ragutil.scenario_index.ScenarioSnapshot = None, embedding: numpy.ndarray = None) -> list[util.scenario.Scenario]:
+    """
+    Routes on the embedding of the raw user input instead of the LLM keywords.
+    Less precise, but available before the keyword extraction returns (ragutil.speculation).
+    """
+    if snapshot is None:
+        snapshot = ragutil.scenario_index.get_snapshot()
 
-                print(f"{similarity:.5f}: {scenario_name}")
+    if embedding is None:
+        embedding = util.embedding.build_embeddings([user_input])[0]
 
-                scenario: util.scenario.Scenario = util.scenario.Scenario.from_dict(raw_result)
-                scenarios.append(scenario)
+    results: list[tuple[util.scenario.Scenario, float]] = snapshot.match(numpy.asarray(embedding, dtype=numpy.float32).reshape(1, -1), number_of_scenarios)
 
-        return scenarios
+    return [
+        scenario
+        for scenario, _ in results
+    ]
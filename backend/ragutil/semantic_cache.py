@@ -0,0 +1,231 @@
+"""
+Semantic cache for finished RAG answers.
+
+Catches paraphrases the exact-match cache (ragutil.answer_cache) misses, e.g.
+"Webshop mit vielen Bestellungen" and "Online-Shop mit hohem Bestellvolumen".
+The user input is embedded with util.embedding and compared (cosine) with the
+inputs answered before; above SEMANTIC_CACHE_THRESHOLD the stored answer is returned.
+
+The embeddings live in one preallocated float32 matrix, a lookup is a single
+matrix-vector product. Only answers of the same keyword extractor are hits.
+Entries are bound to the scenario snapshot version and expire after a TTL; when
+the cache is full the least recently used entry is replaced. An input above the
+threshold of a cached one replaces that entry instead of adding a near-duplicate.
+Like the exact-match cache it stores the parts of the answer
+(ragutil.answer_cache.CachedAnswer).
+"""
+import dataclasses
+import os
+import threading
+import time
+
+import numpy
+
+import ragutil.answer_cache
+import util.embedding
+
+
+SEMANTIC_CACHE_ENABLED: bool = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_SIZE: int = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", "1024"))
+SEMANTIC_CACHE_TTL_SECONDS: float = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600")))
+
+
+@dataclasses.dataclass
+class SemanticCacheEntry(object):
+    user_input: str
+    keyword_extractor: str
+    answer: ragutil.answer_cache.CachedAnswer
+    expires_at: float
+    last_used: float
+
+
+def _normalize(vector: numpy.ndarray) -> numpy.ndarray:
+    vector = numpy.asarray(vector, dtype=numpy.float32).reshape(-1)
+    norm: float = float(numpy.linalg.norm(vector))
+
+    if norm == 0.0:
+        return vector
+    return vector / norm
+
+
+class SemanticAnswerCache(object):
+
+    def __init__(self, max_size: int = SEMANTIC_CACHE_MAX_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD, ttl: float = SEMANTIC_CACHE_TTL_SECONDS):
+        self.max_size: int = max_size
+        self.threshold: float = threshold
+        self.ttl: float = ttl
+
+        # Allocated on the first put, once the embedding dimension is known
+        self._embeddings: numpy.ndarray = None
+        # Keyword extractor per row, masks the rows of the other extractors in `get`
+        self._extractors: numpy.ndarray = None
+        # Expiry time per row, expired rows are evicted before every lookup and insert
+        self._expires_at: numpy.ndarray = None
+        self._entries: list[SemanticCacheEntry] = []
+        self._version: any = None
+        self._lock: threading.Lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.expirations: int = 0
+        self.evictions: int = 0
+        self.replacements: int = 0
+        self.invalidations: int = 0
+        self._hit_similarity_sum: float = 0.0
+
+    def _check_version(self, version: any) -> None:
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries = []
+            self._version = version
+
+    def _remove(self, slot: int) -> None:
+        # Keep the used rows dense: move the last entry into the freed slot
+        last: int = len(self._entries) - 1
+
+        if slot != last:
+            self._entries[slot] = self._entries[last]
+            self._embeddings[slot] = self._embeddings[last]
+            self._extractors[slot] = self._extractors[last]
+            self._expires_at[slot] = self._expires_at[last]
+        self._entries.pop()
+
+    def _evict_expired(self, now: float) -> None:
+        expired: numpy.ndarray = numpy.flatnonzero(self._expires_at[:len(self._entries)] < now)
+
+        # Highest slot first, `_remove` only moves entries from behind the removed slot
+        for slot in expired[::-1]:
+            self._remove(int(slot))
+        self.expirations += len(expired)
+
+    def _most_similar(self, query: numpy.ndarray, keyword_extractor: str) -> tuple[int, float]:
+        similarities: numpy.ndarray = self._embeddings[:len(self._entries)] @ query
+        # Below any cosine similarity
+        similarities[self._extractors[:len(self._entries)] != keyword_extractor] = -2.0
+        slot: int = int(numpy.argmax(similarities))
+
+        return slot, float(similarities[slot])
+
+    def get(self, embedding: numpy.ndarray, keyword_extractor: str, version: any) -> tuple[ragutil.answer_cache.CachedAnswer, float]:
+        """
+        Returns (answer, similarity) of the most similar cached input,
+        (None, similarity) below the threshold.
+        """
+        query: numpy.ndarray = _normalize(embedding)
+        now: float = time.monotonic()
+
+        with self._lock:
+            self._check_version(version)
+
+            if self._entries:
+                self._evict_expired(now)
+
+            if not self._entries:
+                self.misses += 1
+                return None, 0.0
+
+            slot, similarity = self._most_similar(query, keyword_extractor)
+
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+
+            entry: SemanticCacheEntry = self._entries[slot]
+            entry.last_used = now
+            self.hits += 1
+            self._hit_similarity_sum += similarity
+            return entry.answer, similarity
+
+    def put(self, embedding: numpy.ndarray, keyword_extractor: str, version: any, user_input: str, answer: ragutil.answer_cache.CachedAnswer) -> None:
+        if self.max_size <= 0:
+            return
+
+        vector: numpy.ndarray = _normalize(embedding)
+        now: float = time.monotonic()
+
+        with self._lock:
+            self._check_version(version)
+
+            if self._embeddings is None:
+                self._embeddings = numpy.zeros((self.max_size, len(vector)), dtype=numpy.float32)
+                self._extractors = numpy.empty(self.max_size, dtype=object)
+                self._expires_at = numpy.zeros(self.max_size, dtype=numpy.float64)
+
+            if self._entries:
+                self._evict_expired(now)
+
+            slot: int = None
+            if self._entries:
+                slot, similarity = self._most_similar(vector, keyword_extractor)
+                if similarity < self.threshold:
+                    slot = None
+
+            if slot is not None:
+                # The same question again, or a paraphrase `get` would answer from this entry
+                self.replacements += 1
+            elif len(self._entries) < self.max_size:
+                slot = len(self._entries)
+                self._entries.append(None)
+            else:
+                slot = min(range(len(self._entries)), key=lambda i: self._entries[i].last_used)
+                self.evictions += 1
+
+            self._entries[slot] = SemanticCacheEntry(user_input, keyword_extractor, answer, now + self.ttl, now)
+            self._embeddings[slot] = vector
+            self._extractors[slot] = keyword_extractor
+            self._expires_at[slot] = now + self.ttl
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = []
+
+    def stats(self) -> dict[str, any]:
+        with self._lock:
+            lookups: int = self.hits + self.misses
+
+            return {
+                "enabled": SEMANTIC_CACHE_ENABLED,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "avg_hit_similarity": self._hit_similarity_sum / self.hits if self.hits else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "replacements": self.replacements,
+                "invalidations": self.invalidations,
+            }
+
+
+semantic_cache: SemanticAnswerCache = SemanticAnswerCache()
+
+
+def embed(user_input: str) -> numpy.ndarray:
+    """
+    Returns the embedding used for lookup and insert, None if the cache is disabled.
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    return util.embedding.build_embeddings([user_input])[0]
+
+
+def get(embedding: numpy.ndarray, keyword_extractor: str, version: any) -> ragutil.answer_cache.CachedAnswer:
+    if embedding is None:
+        return None
+
+    answer, _ = semantic_cache.get(embedding, keyword_extractor, version)
+    return answer
+
+
+def put(embedding: numpy.ndarray, keyword_extractor: str, version: any, user_input: str, answer: ragutil.answer_cache.CachedAnswer) -> None:
+    if embedding is not None:
+        semantic_cache.put(embedding, keyword_extractor, version, user_input, answer)
+
+
+def get_stats() -> dict[str, any]:
+    return semantic_cache.stats()
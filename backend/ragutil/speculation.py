@@ -0,0 +1,345 @@
+"""
+Speculative scenario routing.
+
+The keyword extraction (first Perplexity call) takes seconds, the retrieval only
+milliseconds. With RAG_SPECULATIVE_ROUTING the scenarios are routed on the
+embedding of the raw user input and their chunks are retrieved while the
+keyword call is still running. Once the keywords are there, the scenarios
+routed on them are compared with the speculative ones:
+- confirmed: all chunks are taken from the speculative retrieval
+- partially confirmed: only the scenarios missing in it are retrieved
+- re-routed: the speculative work is cancelled and everything is retrieved as before
+
+The keywords never wait longer than RAG_SPECULATION_WAIT_MS for the speculative
+task (e.g. queued behind others in the speculation pool): it is cancelled
+(timed_out) and everything is retrieved as without speculation.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+import numpy
+
+import ragutil.scenario_index
+import ragutil.scenario_search
+import util.chunk
+import util.scenario
+import util.tracing
+
+
+SPECULATIVE_ROUTING: bool = os.getenv("RAG_SPECULATIVE_ROUTING", "0") == "1"
+SPECULATION_WORKERS: int = int(os.getenv("RAG_SPECULATION_WORKERS", "4"))
+SPECULATION_WAIT_SECONDS: float = float(os.getenv("RAG_SPECULATION_WAIT_MS", "100")) / 1000
+
+ScenarioChunks = tuple[list[util.scenario.ScenarioQuestion], list[list[util.chunk.DocumentChunk]]]
+
+_executor: concurrent.futures.ThreadPoolExecutor = None
+_executor_pid: int = None
+_executor_lock: threading.Lock = threading.Lock()
+
+_stats_lock: threading.Lock = threading.Lock()
+_stats: dict[str, int] = {
+    "started": 0,
+    "confirmed": 0,
+    "partially_confirmed": 0,
+    "rerouted": 0,
+    "cancelled": 0,
+    "timed_out": 0,
+    "failed": 0,
+}
+
+
+def _get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Separate from the chunk retrieval pool, the speculative task itself may fan
+    out on that one (ragutil.chunks_search) and must not wait for its own slot.
+    """
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=SPECULATION_WORKERS, thread_name_prefix="speculation")
+            _executor_pid = os.getpid()
+
+        return _executor
+
+
+def _count(outcome: str) -> None:
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def get_stats() -> dict[str, any]:
+    with _stats_lock:
+        stats: dict[str, any] = dict(_stats)
+
+    resolved: int = stats["confirmed"] + stats["partially_confirmed"] + stats["rerouted"]
+    stats["enabled"] = SPECULATIVE_ROUTING
+    stats["confirmation_ratio"] = stats["confirmed"] / resolved if resolved else 0.0
+
+    return stats
+
+
+def _discard(outcome: str) -> None:
+    """
+    The speculative retrieval is not used at all (timed_out, failed).
+    """
+    _count(outcome)
+    util.tracing.set_attributes(speculation=outcome)
+    logging.info(f"Speculative routing {outcome}")
+
+
+def _merge(scenarios: list[util.scenario.Scenario], speculative: dict[int, ScenarioChunks]) -> tuple[list[util.scenario.Scenario], str]:
+    """
+    Returns the scenarios still to be retrieved and the outcome for the statistics.
+    """
+    missing: list[util.scenario.Scenario] = [
+        scenario
+        for scenario in scenarios
+        if scenario.id not in speculative
+    ]
+
+    if not missing:
+        return missing, "confirmed"
+    if len(missing) < len(scenarios):
+        return missing, "partially_confirmed"
+    return missing, "rerouted"
+
+
+class SpeculativeRetrieval(object):
+    """
+    Routes and retrieves on a worker thread. `retrieve_scenario_chunks`
+    is the pipeline's retrieval step: scenarios -> (questions, chunks) per scenario.
+    """
+
+    def __init__(self, user_input: str, embedding: numpy.ndarray, number_of_scenarios: int, snapshot: ragutil.scenario_index.ScenarioSnapshot, retrieve_scenario_chunks):
+        self._retrieve_scenario_chunks = retrieve_scenario_chunks
+        self._cancelled: threading.Event = threading.Event()
+        # Set once the speculative scenarios are known (or the task ended without them)
+        self._routed: threading.Event = threading.Event()
+        self._routed_ids: set[int] = set()
+
+        _count("started")
+        self._future: concurrent.futures.Future = _get_executor().submit(util.tracing.bind(self._run), user_input, embedding, number_of_scenarios, snapshot)
+        self._future.add_done_callback(lambda _: self._routed.set())
+
+    def _run(self, user_input: str, embedding: numpy.ndarray, number_of_scenarios: int, snapshot: ragutil.scenario_index.ScenarioSnapshot) -> dict[int, ScenarioChunks]:
+        with util.tracing.span("speculative_retrieval") as span:
+            scenarios: list[util.scenario.Scenario] = ragutil.scenario_search.match_input(user_input, number_of_scenarios, snapshot, embedding)
+
+            self._routed_ids = {
+                scenario.id
+                for scenario in scenarios
+            }
+            self._routed.set()
+            span.set("scenarios", len(scenarios))
+
+            # Checked between the stages, a running Mongo query is not interrupted
+            if self._cancelled.is_set():
+                span.set("cancelled", True)
+                return {}
+
+            scenario_chunks: list[ScenarioChunks] = self._retrieve_scenario_chunks(scenarios, snapshot)
+
+            return {
+                scenario.id: chunks
+                for scenario, chunks in zip(scenarios, scenario_chunks)
+            }
+
+    def _cancel(self) -> bool:
+        if self._cancelled.is_set():
+            return False
+
+        self._cancelled.set()
+        self._future.cancel()
+        return True
+
+    def cancel(self) -> None:
+        """
+        The request ended before it needed the speculation (no keywords).
+        """
+        if self._cancel():
+            _count("cancelled")
+
+    def _wait(self, scenarios: list[util.scenario.Scenario]) -> dict[int, ScenarioChunks]:
+        """
+        The speculative chunks by scenario id, None if they cannot be used at all.
+        """
+        deadline: float = time.monotonic() + SPECULATION_WAIT_SECONDS
+
+        # Routing takes milliseconds, unless the task is still queued in the pool
+        if not self._routed.wait(SPECULATION_WAIT_SECONDS):
+            self._cancel()
+            _discard("timed_out")
+            return None
+
+        if self._cancelled.is_set() or self._future.cancelled():
+            return None
+
+        # Failed before (or while) routing, `_routed_ids` says nothing then
+        if self._future.done() and self._future.exception() is not None:
+            logging.error("Speculative retrieval failed", exc_info=self._future.exception())
+            _discard("failed")
+            return None
+
+        # The retrieval is only waited for if it can be used, `resolve` counts the re-routing
+        if not any(scenario.id in self._routed_ids for scenario in scenarios):
+            self._cancel()
+            return {}
+
+        try:
+            return self._future.result(timeout=max(deadline - time.monotonic(), 0.0))
+        except concurrent.futures.TimeoutError:
+            self._cancel()
+            _discard("timed_out")
+            return None
+        except Exception:
+            logging.exception("Speculative retrieval failed")
+            _discard("failed")
+            return None
+
+    def resolve(self, scenarios: list[util.scenario.Scenario], snapshot: ragutil.scenario_index.ScenarioSnapshot) -> list[ScenarioChunks]:
+        """
+        Returns the chunks for the keyword-routed `scenarios`, reusing the speculative retrieval where it matches.
+        """
+        speculative: dict[int, ScenarioChunks] = self._wait(scenarios)
+
+        if speculative is None:
+            return self._retrieve_scenario_chunks(scenarios, snapshot)
+
+        missing, outcome = _merge(scenarios, speculative)
+        _count(outcome)
+        util.tracing.set_attributes(speculation=outcome)
+        logging.info(f"Speculative routing {outcome}")
+
+        if missing:
+            retrieved: list[ScenarioChunks] = self._retrieve_scenario_chunks(missing, snapshot)
+            speculative = {
+                **speculative,
+                **{
+                    scenario.id: chunks
+                    for scenario, chunks in zip(missing, retrieved)
+                }
+            }
+
+        return [
+            speculative[scenario.id]
+            for scenario in scenarios
+        ]
+
+
+class AsyncSpeculativeRetrieval(object):
+    """
+    asyncio variant for rag_async, runs as a task on the event loop.
+    `retrieve_scenario_chunks` is a coroutine function.
+    """
+
+    def __init__(self, user_input: str, embedding: numpy.ndarray, number_of_scenarios: int, snapshot: ragutil.scenario_index.ScenarioSnapshot, retrieve_scenario_chunks):
+        self._retrieve_scenario_chunks = retrieve_scenario_chunks
+        self._routed: asyncio.Event = asyncio.Event()
+        self._routed_ids: set[int] = set()
+
+        _count("started")
+        self._task: asyncio.Task = asyncio.create_task(self._run(user_input, embedding, number_of_scenarios, snapshot))
+        self._task.add_done_callback(lambda _: self._routed.set())
+
+    async def _run(self, user_input: str, embedding: numpy.ndarray, number_of_scenarios: int, snapshot: ragutil.scenario_index.ScenarioSnapshot) -> dict[int, ScenarioChunks]:
+        # The task runs in a copy of the request's context, its spans stay in the request trace
+        with util.tracing.span("speculative_retrieval") as span:
+            scenarios: list[util.scenario.Scenario] = await asyncio.to_thread(ragutil.scenario_search.match_input, user_input, number_of_scenarios, snapshot, embedding)
+
+            self._routed_ids = {
+                scenario.id
+                for scenario in scenarios
+            }
+            self._routed.set()
+            span.set("scenarios", len(scenarios))
+
+            scenario_chunks: list[ScenarioChunks] = await self._retrieve_scenario_chunks(scenarios, snapshot)
+
+            return {
+                scenario.id: chunks
+                for scenario, chunks in zip(scenarios, scenario_chunks)
+            }
+
+    def _cancel(self) -> bool:
+        if self._task.done():
+            return False
+
+        self._task.cancel()
+        return True
+
+    def cancel(self) -> None:
+        if self._cancel():
+            _count("cancelled")
+
+    async def _wait(self, scenarios: list[util.scenario.Scenario]) -> dict[int, ScenarioChunks]:
+        deadline: float = time.monotonic() + SPECULATION_WAIT_SECONDS
+
+        # asyncio.wait does not cancel what it waits for when it times out or the request itself is cancelled
+        routed: asyncio.Task = asyncio.ensure_future(self._routed.wait())
+        await asyncio.wait({routed}, timeout=SPECULATION_WAIT_SECONDS)
+
+        if not routed.done():
+            routed.cancel()
+            self._cancel()
+            _discard("timed_out")
+            return None
+
+        if self._task.cancelled():
+            return None
+
+        if self._task.done() and self._task.exception() is not None:
+            logging.error("Speculative retrieval failed", exc_info=self._task.exception())
+            _discard("failed")
+            return None
+
+        if not any(scenario.id in self._routed_ids for scenario in scenarios):
+            self._cancel()
+            return {}
+
+        await asyncio.wait({self._task}, timeout=max(deadline - time.monotonic(), 0.0))
+
+        if not self._task.done():
+            self._cancel()
+            _discard("timed_out")
+            return None
+
+        if self._task.cancelled():
+            return None
+
+        if self._task.exception() is not None:
+            logging.error("Speculative retrieval failed", exc_info=self._task.exception())
+            _discard("failed")
+            return None
+
+        return self._task.result()
+
+    async def resolve(self, scenarios: list[util.scenario.Scenario], snapshot: ragutil.scenario_index.ScenarioSnapshot) -> list[ScenarioChunks]:
+        speculative: dict[int, ScenarioChunks] = await self._wait(scenarios)
+
+        if speculative is None:
+            return await self._retrieve_scenario_chunks(scenarios, snapshot)
+
+        missing, outcome = _merge(scenarios, speculative)
+        _count(outcome)
+        util.tracing.set_attributes(speculation=outcome)
+        logging.info(f"Speculative routing {outcome}")
+
+        if missing:
+            retrieved: list[ScenarioChunks] = await self._retrieve_scenario_chunks(missing, snapshot)
+            speculative = {
+                **speculative,
+                **{
+                    scenario.id: chunks
+                    for scenario, chunks in zip(missing, retrieved)
+                }
+            }
+
+        return [
+            speculative[scenario.id]
+            for scenario in scenarios
+        ]
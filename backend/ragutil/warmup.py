@@ -0,0 +1,172 @@
+"""
+Startup warmup of a server process, /health reports ready once it finished.
+
+The heavy parts of the pipeline are loaded on first use (the embedding model
+with torch, the database pools, the scenario snapshot), importing app.py or
+asgi.py does not touch them. Without a warmup the first requests would pay
+for all of it. `start()` runs the warmup in a background thread:
+1. load the embedding model (util.embedding.prepare), or only connect to the
+   embedding service (embedding_service.py) if one is configured
+2. open the Postgres pool and the MongoDB connection pool
+3. load the scenario snapshot (ragutil.scenario_index)
+4. one dummy encode, the first forward pass initializes the torch kernels
+5. one dummy scenario match and chunk search ($vectorSearch)
+
+A failed attempt (e.g. a database not reachable yet) is retried every
+WARMUP_RETRY_SECONDS, /health stays at 503 until an attempt succeeded.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy
+
+import database.mongo
+import database.postgres
+import ragutil.chunks_search
+import ragutil.scenario_index
+import util.embedding
+import util.embedding_client
+
+
+WARMUP_RETRY_SECONDS: float = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+WARMUP_QUERY: str = "Welche Datenbank eignet sich für Zeitreihen?"
+
+_ready: threading.Event = threading.Event()
+_thread: threading.Thread = None
+_thread_lock: threading.Lock = threading.Lock()
+
+_stats_lock: threading.Lock = threading.Lock()
+_stats: dict[str, any] = {
+    "attempts": 0,
+    "duration": None,
+    "steps": {},
+    "error": None,
+}
+
+
+def _reset_after_fork() -> None:
+    """
+    Neither the thread nor the pools it opened exist in a forked child, it warms up on its own.
+    """
+    global _ready, _thread, _thread_lock, _stats_lock, _stats
+
+    _ready = threading.Event()
+    _thread = None
+    _thread_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _stats = {
+        "attempts": 0,
+        "duration": None,
+        "steps": {},
+        "error": None,
+    }
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def preload() -> None:
+    """
+    Loads the model and the scenario snapshot without running inference,
+    for a process that forks workers afterwards (gunicorn.conf.py).
+    Never raises for the snapshot, a failure there must not stop the master.
+    """
+    # An ONNX Runtime session starts its thread pool when it is created, it
+    # would not survive the fork. The quantized model is small, every worker loads its own.
+    if util.embedding.EMBEDDING_BACKEND == "torch" and not util.embedding_client.is_enabled():
+        util.embedding.get_model()
+
+    try:
+        ragutil.scenario_index.get_snapshot()
+    except Exception:
+        # E.g. Postgres not reachable yet, the warmup of every worker retries the load
+        logging.exception("Preloading the scenario snapshot failed, the workers load it on their own")
+
+
+def _search() -> None:
+    snapshot: ragutil.scenario_index.ScenarioSnapshot = ragutil.scenario_index.get_snapshot()
+    embeddings: numpy.ndarray = util.embedding.build_embeddings([WARMUP_QUERY])
+
+    for scenario, _ in snapshot.match(embeddings, 1):
+        for question in snapshot.get_questions(scenario.id)[:1]:
+            ragutil.chunks_search.search_chunks_for_scenario_question(question, 1)
+
+
+def warmup() -> None:
+    """
+    Runs all warmup steps once, raises on the first failing step.
+    """
+    steps: list[tuple[str, any]] = [
+        ("model", util.embedding.prepare),
+        ("postgres", lambda: database.postgres.get_pool("rag").fill()),
+        ("mongo", lambda: database.mongo.get_client().admin.command("ping")),
+        ("scenario_snapshot", ragutil.scenario_index.get_snapshot),
+        # Not through build_embeddings, a cached warmup query would skip the model
+        ("encode", lambda: util.embedding.encode([WARMUP_QUERY])),
+        ("search", _search),
+    ]
+
+    start_time: float = time.perf_counter()
+
+    with _stats_lock:
+        _stats["attempts"] += 1
+        _stats["steps"] = {}
+
+    for name, step in steps:
+        step_start: float = time.perf_counter()
+        step()
+
+        with _stats_lock:
+            _stats["steps"][name] = time.perf_counter() - step_start
+
+    delta: float = time.perf_counter() - start_time
+
+    with _stats_lock:
+        _stats["duration"] = delta
+        _stats["error"] = None
+
+    _ready.set()
+    logging.info(f"Warmup finished in {delta:.3f}s")
+
+
+def _run() -> None:
+    while True:
+        try:
+            warmup()
+            return
+        except Exception as e:
+            with _stats_lock:
+                _stats["error"] = repr(e)
+
+            logging.exception(f"Warmup failed, retrying in {WARMUP_RETRY_SECONDS}s")
+            time.sleep(WARMUP_RETRY_SECONDS)
+
+
+def start() -> None:
+    """
+    Starts the warmup in a background thread, at most once per process.
+    """
+    global _thread
+
+    with _thread_lock:
+        if _thread is not None:
+            return
+
+        _thread = threading.Thread(target=_run, name="warmup", daemon=True)
+        _thread.start()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def get_stats() -> dict[str, any]:
+    with _stats_lock:
+        stats: dict[str, any] = dict(_stats)
+        stats["steps"] = dict(_stats["steps"])
+
+    stats["ready"] = is_ready()
+
+    return stats
@@ -6,6 +6,7 @@ import setup.chunks.csv_chunker
 import setup.chunks.json_chunker
 import setup.chunks.md_chunker
 import setup.chunks.txt_chunker
+import setup.question_chunks
 
 import util.file_manager
 
@@ -19,34 +20,34 @@ def import_all() -> None:
     do_md()
     do_txt()
 
-
+    # The top-k chunks per question are merged once for all files
+    setup.question_chunks.flush()
 
     # Create Index
-    with database.mongo.create_connection() as conn:
-        db = conn["rag"]
-
-        db.command(
-            {
-                "createSearchIndexes": "chunks",
-                "indexes": [
-                    {
-                        "name": "vec_idx",
-                        "definition": {
-                            "mappings": {
-                                "dynamic": False,
-                                "fields": {
-                                    "embedding": {
-                                        "type": "vector",
-                                        "similarity": "cosine",
-                                        "numDimensions": 384
-                                    }
+    db = database.mongo.get_client()["rag"]
+
+    db.command(
+        {
+            "createSearchIndexes": "chunks",
+            "indexes": [
+                {
+                    "name": "vec_idx",
+                    "definition": {
+                        "mappings": {
+                            "dynamic": False,
+                            "fields": {
+                                "embedding": {
+                                    "type": "vector",
+                                    "similarity": "cosine",
+                                    "numDimensions": 384
                                 }
                             }
                         }
                     }
-                ]
-            }
-        )
+                }
+            ]
+        }
+    )
     
     delta = time.perf_counter() - start_time
     print(f"Chunking all took {delta:.3f} Seconds")
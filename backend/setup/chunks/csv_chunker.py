@@ -1,11 +1,12 @@
 import csv
 import json
 import logging
+import numpy
 import pgvector.psycopg2.vector
-import torch
 import uuid
 
 import database.mongo
+import setup.question_chunks
 import util.embedding
 import util.file_manager
 
@@ -53,17 +54,18 @@ def chunk_csv(content: list[dict[str, any]], file_name: str) -> None:
         content: str = json.dumps(batch)
         character_count: int = len(content)
 
-        tensor: torch.Tensor = util.embedding.build_embedding(content)
-        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(tensor)
+        embedding: numpy.ndarray = util.embedding.build_embedding(content)
+        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding)
 
         chunk: dict[str, any] = {
             "chunk_id": chunk_id,
             "document_id": doc_id,
             "chunk_index": i,
             "chunk_text": content,
-            "token_count": character_count,
+            "token_count": util.embedding.count_tokens([content])[0],
             "character_count": character_count,
             "embedding": vector.to_list(),
+            "tokenizer": util.embedding.DEFAULT_MODEL,
             "metadata": {
                 "heading": f"{file_name}",
                 "section": f"{i}",
@@ -76,8 +78,8 @@ def chunk_csv(content: list[dict[str, any]], file_name: str) -> None:
         chunks.append(chunk)
     print(f"Identified {len(chunks)} elements in {file_name}")
 
-    with database.mongo.create_connection() as conn:
-        db = conn["rag"]
-        coll = db["chunks"]
+    coll = database.mongo.get_collection("chunks")
 
-        coll.insert_many(chunks)
+    coll.insert_many(chunks)
+
+    setup.question_chunks.update_for_chunks(chunks)
@@ -1,10 +1,11 @@
 import json
+import numpy
 import pgvector.psycopg2.vector
-import torch
 import uuid
 import logging
 
 import database.mongo
+import setup.question_chunks
 import util.embedding
 import util.file_manager
 
@@ -39,17 +40,18 @@ def chunk_json(data: dict[str, any] | list[any], file_name: str) -> None:
         content: str = json.dumps(value)
         character_count: int = len(content)
 
-        tensor: torch.Tensor = util.embedding.build_embedding(f"{key}: {content}")
-        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(tensor)
+        embedding: numpy.ndarray = util.embedding.build_embedding(f"{key}: {content}")
+        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding)
 
         chunk: dict[str, any] = {
             "chunk_id": chunk_id,
             "document_id": doc_id,
             "chunk_index": i,
             "chunk_text": content,
-            "token_count": character_count,
+            "token_count": util.embedding.count_tokens([content])[0],
             "character_count": character_count,
             "embedding": vector.to_list(),
+            "tokenizer": util.embedding.DEFAULT_MODEL,
             "metadata": {
                 "heading": key,
                 "section": f"key:{i}",
@@ -61,8 +63,8 @@ def chunk_json(data: dict[str, any] | list[any], file_name: str) -> None:
 
         chunks.append(chunk)
 
-    with database.mongo.create_connection() as conn:
-        db = conn["rag"]
-        coll = db["chunks"]
+    coll = database.mongo.get_collection("chunks")
 
-        coll.insert_many(chunks)
+    coll.insert_many(chunks)
+
+    setup.question_chunks.update_for_chunks(chunks)
@@ -2,11 +2,12 @@ import json
 import langchain_text_splitters
 import langchain_core.documents
 import logging
+import numpy
 import pgvector.psycopg2.vector
-import torch
 import uuid
 
 import database.mongo
+import setup.question_chunks
 import util.embedding
 import util.file_manager
 
@@ -47,17 +48,18 @@ def chunk_md(data: str, file_name: str) -> None:
         content: str = json.dumps(raw_chunk.page_content)
         character_count: int = len(content)
 
-        tensor: torch.Tensor = util.embedding.build_embedding(f"{header_1_info}-{header_info}: {content}")
-        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(tensor)
+        embedding: numpy.ndarray = util.embedding.build_embedding(f"{header_1_info}-{header_info}: {content}")
+        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding)
 
         chunk: dict[str, any] = {
             "chunk_id": chunk_id,
             "document_id": doc_id,
             "chunk_index": i,
             "chunk_text": content,
-            "token_count": character_count,
+            "token_count": util.embedding.count_tokens([content])[0],
             "character_count": character_count,
             "embedding": vector.to_list(),
+            "tokenizer": util.embedding.DEFAULT_MODEL,
             "metadata": {
                 "heading": f"{header_1_info}-{header_info}",
                 "section": f"{header_1_info}-{header_info}-{i}",
@@ -69,8 +71,8 @@ def chunk_md(data: str, file_name: str) -> None:
 
         final_chunks.append(chunk)
 
-    with database.mongo.create_connection() as conn:
-        db = conn["rag"]
-        coll = db["chunks"]
+    coll = database.mongo.get_collection("chunks")
 
-        coll.insert_many(final_chunks)
+    coll.insert_many(final_chunks)
+
+    setup.question_chunks.update_for_chunks(final_chunks)
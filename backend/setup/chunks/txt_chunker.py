@@ -1,9 +1,10 @@
+import numpy
 import pgvector.psycopg2.vector
-import torch
 import uuid
 import logging
 
 import database.mongo
+import setup.question_chunks
 import util.embedding
 import util.file_manager
 
@@ -70,17 +71,18 @@ def chunk_txt(data: str, file_name: str) -> None:
 
         character_count: int = len(full_text)
 
-        tensor: torch.Tensor = util.embedding.build_embedding(f"{main_title}-{section_name}: {full_text}")
-        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(tensor)
+        embedding: numpy.ndarray = util.embedding.build_embedding(f"{main_title}-{section_name}: {full_text}")
+        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding)
 
         chunk: dict[str, any] = {
             "chunk_id": chunk_id,
             "document_id": doc_id,
             "chunk_index": i,
             "chunk_text": full_text,
-            "token_count": character_count,
+            "token_count": util.embedding.count_tokens([full_text])[0],
             "character_count": character_count,
             "embedding": vector.to_list(),
+            "tokenizer": util.embedding.DEFAULT_MODEL,
             "metadata": {
                 "heading": f"{main_title}-{section_name}",
                 "section": f"{main_title}-{section_name}-{i}",
@@ -92,8 +94,8 @@ def chunk_txt(data: str, file_name: str) -> None:
 
         chunks.append(chunk)
 
-    with database.mongo.create_connection() as conn:
-        db = conn["rag"]
-        coll = db["chunks"]
+    coll = database.mongo.get_collection("chunks")
 
-        coll.insert_many(chunks)
+    coll.insert_many(chunks)
+
+    setup.question_chunks.update_for_chunks(chunks)
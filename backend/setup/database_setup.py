@@ -35,4 +35,26 @@ def setup_tables() -> None:
         """
     )
 
+    # Vorberechnete Top-k Chunks je ScenarioQuestion
+    database.postgres.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scenario_question_chunks (
+            question_id BIGINT PRIMARY KEY REFERENCES scenario_questions(id) ON DELETE CASCADE,
+            chunk_ids TEXT[] NOT NULL,
+            scores REAL[] NOT NULL,
+            top_k INTEGER NOT NULL
+        )
+        """
+    )
+
+    # Versionsstempel der importierten Daten
+    database.postgres.execute(
+        """
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name VARCHAR(64) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """
+    )
 
@@ -0,0 +1,202 @@
+"""
+Materializes the top-k chunks for every ScenarioQuestion.
+Stored in a PGVectorDB
+rag::scenario_question_chunks
+
+The question embeddings are static, so the vector search per question is done
+at ingest time. The chunkers hand every newly inserted batch of chunks to
+`update_for_chunks`, `flush` merges them once per import and only writes the
+questions whose top-k changed. A scenario import recomputes the table
+(`materialize_all`). start_setup.py bumps the "chunks" data version once at the
+end, so running backends reload the lookup table once.
+"""
+import json
+import os
+
+import numpy
+
+import database.mongo
+import database.postgres
+
+
+TOP_K: int = int(os.getenv("QUESTION_CHUNKS_TOP_K", "5"))
+BATCH_SIZE: int = 1000
+
+# Chunks inserted since the last `flush`: ids and embedding batches
+_pending_chunk_ids: list[str] = []
+_pending_embeddings: list[numpy.ndarray] = []
+
+
+def _normalize(matrix: numpy.ndarray) -> numpy.ndarray:
+    norms: numpy.ndarray = numpy.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _load_questions() -> tuple[list[int], numpy.ndarray]:
+    raw_questions: list[dict[str, any]] = database.postgres.fetch_all(
+        """
+        SELECT id, embedding FROM scenario_questions
+        ORDER BY id
+        """,
+        "rag"
+    )
+
+    question_ids: list[int] = [
+        raw["id"]
+        for raw in raw_questions
+    ]
+
+    if not question_ids:
+        return [], numpy.empty((0, 384), dtype=numpy.float32)
+
+    embeddings: list[any] = [
+        json.loads(raw["embedding"]) if isinstance(raw["embedding"], str) else raw["embedding"]
+        for raw in raw_questions
+    ]
+
+    return question_ids, _normalize(numpy.asarray(embeddings, dtype=numpy.float32))
+
+
+def _load_materialized() -> dict[int, tuple[list[str], list[float]]]:
+    rows: list[dict[str, any]] = database.postgres.fetch_all(
+        """
+        SELECT question_id, chunk_ids, scores FROM scenario_question_chunks
+        """,
+        "rag"
+    )
+    return {
+        row["question_id"]: (row["chunk_ids"], row["scores"])
+        for row in rows
+    }
+
+
+def _merge(question_ids: list[int], question_matrix: numpy.ndarray, materialized: dict[int, tuple[list[str], list[float]]], chunk_ids: list[str], chunk_embeddings: numpy.ndarray) -> None:
+    """
+    Merges the chunks into the current top-k lists (in place).
+    Scores follow the `vectorSearchScore` of the cosine `vec_idx`: (1 + cos) / 2
+    """
+    if not chunk_ids or not question_ids:
+        return
+
+    scores: numpy.ndarray = (1.0 + question_matrix @ _normalize(chunk_embeddings).T) / 2.0
+
+    # Only the best TOP_K of the new chunks can make it into any top-k list
+    candidate_count: int = min(TOP_K, len(chunk_ids))
+    candidates: numpy.ndarray = numpy.argpartition(-scores, candidate_count - 1, axis=1)[:, :candidate_count]
+
+    for row, question_id in enumerate(question_ids):
+        current_ids, current_scores = materialized.get(question_id, ([], []))
+
+        merged: list[tuple[float, str]] = list(zip(current_scores, current_ids))
+        merged.extend(
+            (float(scores[row, column]), chunk_ids[column])
+            for column in candidates[row]
+        )
+        merged.sort(key=lambda entry: entry[0], reverse=True)
+        merged = merged[:TOP_K]
+
+        materialized[question_id] = (
+            [chunk_id for _, chunk_id in merged],
+            [score for score, _ in merged]
+        )
+
+
+def _merge_batched(question_ids: list[int], question_matrix: numpy.ndarray, materialized: dict[int, tuple[list[str], list[float]]], chunk_ids: list[str], chunk_embeddings: numpy.ndarray) -> None:
+    # Bounds the (questions x chunks) score matrix
+    for start in range(0, len(chunk_ids), BATCH_SIZE):
+        _merge(question_ids, question_matrix, materialized, chunk_ids[start:start + BATCH_SIZE], chunk_embeddings[start:start + BATCH_SIZE])
+
+
+def _store(materialized: dict[int, tuple[list[str], list[float]]]) -> None:
+    if not materialized:
+        return
+
+    with database.postgres.create_connection("rag") as conn:
+        cursor = conn.cursor()
+
+        cursor.executemany(
+            """
+            INSERT INTO scenario_question_chunks
+                (question_id, chunk_ids, scores, top_k)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (question_id) DO UPDATE
+            SET chunk_ids = EXCLUDED.chunk_ids, scores = EXCLUDED.scores, top_k = EXCLUDED.top_k
+            """,
+            [
+                (question_id, chunk_ids, scores, TOP_K)
+                for question_id, (chunk_ids, scores) in materialized.items()
+            ]
+        )
+
+        conn.commit()
+
+
+def update_for_chunks(chunks: list[dict[str, any]]) -> None:
+    """
+    Remembers freshly inserted chunks (with their Mongo `_id` and `embedding`), they are merged by `flush`.
+    """
+    if not chunks:
+        return
+
+    _pending_chunk_ids.extend(
+        str(chunk["_id"])
+        for chunk in chunks
+    )
+    _pending_embeddings.append(numpy.asarray([chunk["embedding"] for chunk in chunks], dtype=numpy.float32))
+
+
+def flush() -> None:
+    """
+    Merges the chunks of `update_for_chunks` into the table, called once after all files were imported.
+    """
+    if not _pending_chunk_ids:
+        return
+
+    question_ids, question_matrix = _load_questions()
+    stored: dict[int, tuple[list[str], list[float]]] = _load_materialized()
+    materialized: dict[int, tuple[list[str], list[float]]] = dict(stored)
+
+    _merge_batched(question_ids, question_matrix, materialized, _pending_chunk_ids, numpy.concatenate(_pending_embeddings))
+
+    _pending_chunk_ids.clear()
+    _pending_embeddings.clear()
+
+    _store({
+        question_id: top_k
+        for question_id, top_k in materialized.items()
+        if stored.get(question_id) != top_k
+    })
+
+
+def materialize_all() -> None:
+    """
+    Recomputes the table for all questions from all chunks in `rag::chunks`.
+    """
+    question_ids, question_matrix = _load_questions()
+    materialized: dict[int, tuple[list[str], list[float]]] = {
+        question_id: ([], [])
+        for question_id in question_ids
+    }
+
+    coll = database.mongo.get_collection("chunks")
+
+    chunk_ids: list[str] = []
+    chunk_embeddings: list[list[float]] = []
+
+    for raw_chunk in coll.find({}, projection={"embedding": True}, batch_size=BATCH_SIZE):
+        chunk_ids.append(str(raw_chunk["_id"]))
+        chunk_embeddings.append(raw_chunk["embedding"])
+
+        if len(chunk_ids) >= BATCH_SIZE:
+            _merge(question_ids, question_matrix, materialized, chunk_ids, numpy.asarray(chunk_embeddings, dtype=numpy.float32))
+            chunk_ids, chunk_embeddings = [], []
+
+    _merge(question_ids, question_matrix, materialized, chunk_ids, numpy.asarray(chunk_embeddings, dtype=numpy.float32))
+
+    database.postgres.execute(
+        """
+        DELETE FROM scenario_question_chunks
+        """
+    )
+    _store(materialized)
@@ -1,13 +1,15 @@
 import json
+import numpy
 import os.path
 import pathlib
 import pgvector.psycopg2
 import pgvector.psycopg2.vector
 import time
-import torch
 
 
 import database.postgres
+import setup.question_chunks
+import util.data_version
 import util.embedding
 
 FILE_LOCATION: str = "data/scenarios.json"
@@ -24,6 +26,12 @@ def setup_scenarios() -> None:
         questions: list[dict[str, any]] = scenario["questions"]
 
         insert_scenario_questions(scenario_id, questions)
+
+    # Signals running backends to reload their scenario snapshot
+    util.data_version.bump_version("scenarios")
+
+    # New question ids, the materialized chunks have to be recomputed
+    setup.question_chunks.materialize_all()
     
     end_time: float = time.perf_counter()
 
@@ -45,12 +53,11 @@ def insert_scenario(data: dict[str, any]) -> int:
     scenario_description: str = data["description"]
     scenario_embedding_string: str = f"{scenario_name};{scenario_description}"
 
-    tensor: torch.Tensor = util.embedding.build_embedding(scenario_embedding_string)
-    vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(tensor)
+    embedding: numpy.ndarray = util.embedding.build_embedding(scenario_embedding_string)
+    vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding)
     embedding = vector.to_list()
 
     with database.postgres.create_connection("rag") as conn:
-        pgvector.psycopg2.register_vector(conn)
         cursor = conn.cursor()
 
         cursor.execute(
@@ -81,12 +88,11 @@ def insert_scenario(data: dict[str, any]) -> int:
 def insert_scenario_questions(scenario_id: int, questions: list[dict[str, any]]) -> None:
     for question in questions:
 
-        tensor: torch.Tensor = util.embedding.build_embedding(question["response"])
-        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(tensor)
+        embedding: numpy.ndarray = util.embedding.build_embedding(question["response"])
+        vector: pgvector.psycopg2.vector.Vector = pgvector.psycopg2.vector.Vector(embedding)
         embedding = vector.to_list()
 
         with database.postgres.create_connection("rag") as conn:
-            pgvector.psycopg2.register_vector(conn)
             cursor = conn.cursor()
 
             cursor.execute(
@@ -5,6 +5,8 @@ import setup.database_setup
 import setup.scenario_setup
 
 import setup.chunker
+import util.data_version
+import util.embedding_cache
 import sys
 import logging
 # logging.basicConfig(
@@ -16,6 +18,13 @@ import logging
 # )
 
 def reset_dbs() -> None:
+    try:
+        database.postgres.execute(
+            "DROP TABLE scenario_question_chunks"
+        )
+    except:
+        pass
+
     try:
         database.postgres.execute(
             "DROP TABLE scenarios CASCADE"
@@ -30,9 +39,8 @@ def reset_dbs() -> None:
     except:
         pass
 
-    with database.mongo.create_connection() as conn:
-        db = conn["rag"]
-        db.drop_collection("chunks")
+    db = database.mongo.get_client()["rag"]
+    db.drop_collection("chunks")
 
 reset_dbs()
 
@@ -43,4 +51,9 @@ print("Import Scenarios")
 setup.scenario_setup.setup_scenarios()
 
 print("Import Chunks")
-setup.chunker.import_all()
\ No newline at end of file
+setup.chunker.import_all()
+
+# Once for the whole import, running backends reload their snapshot afterwards
+util.data_version.bump_version("chunks")
+
+print(f"Embedding cache: {util.embedding_cache.get_stats()}")
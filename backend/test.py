@@ -57,19 +57,17 @@ sys.dont_write_bytecode = True
 import database.mongo
 
 
-with database.mongo.create_connection() as conn:
-    db = conn["rag"]
-    coll = db["chunks"]
+coll = database.mongo.get_collection("chunks")
 
-    #coll.drop()
+#coll.drop()
 
-    r = coll.find({}, {"embedding": 0})
-    
-    # for i in r:
-    #     print(i)
-    #     print("\n\n")
+r = coll.find({}, {"embedding": 0})
 
-    print(coll.count_documents({}))
+# for i in r:
+#     print(i)
+#     print("\n\n")
+
+print(coll.count_documents({}))
 
 
 # import ragutil.perplexity
@@ -37,18 +37,76 @@ class DocumentChunk(object):
     token_count: int
     character_count: int
     metadata: DocumentChunkMetadata
+    # Tokenizer `token_count` was counted with, None for chunks imported before (character count)
+    tokenizer: str = None
+    # Similarity to the query when returned by a search, not stored. Not part of the equality,
+    # the same chunk found by two questions is still the same chunk.
+    score: float = dataclasses.field(default=None, compare=False)
 
     @staticmethod
     def load_from_id(_id: bson.objectid.ObjectId) -> "DocumentChunk":
-        with database.mongo.create_connection() as conn:
-            db = conn["rag"]
-            coll = db["chunks"]
+        coll = database.mongo.get_collection("chunks")
 
-            chunk_data: dict[str, any] = coll.find_one({"_id": _id}, projection={"embedding": False})
+        chunk_data: dict[str, any] = coll.find_one({"_id": _id}, projection={"embedding": False})
 
-            if not chunk_data:
-                return None
-            return DocumentChunk.from_dict(chunk_data)
+        if not chunk_data:
+            return None
+        return DocumentChunk.from_dict(chunk_data)
+
+    @staticmethod
+    def load_by_ids(ids: list[str]) -> dict[str, "DocumentChunk"]:
+        """
+        Loads all chunks in one query, keyed by their `_id` as string.
+        Chunks that do not exist (anymore) are missing in the result.
+        """
+        object_ids: list[bson.objectid.ObjectId] = [
+            bson.objectid.ObjectId(i)
+            for i in set(ids)
+        ]
+
+        coll = database.mongo.get_collection("chunks")
+
+        raw_chunks: list[dict[str, any]] = list(coll.find({"_id": {"$in": object_ids}}, projection={"embedding": False}))
+
+        return {
+            str(raw_chunk["_id"]): DocumentChunk.from_dict(raw_chunk)
+            for raw_chunk in raw_chunks
+        }
+
+    @staticmethod
+    async def load_by_ids_async(ids: list[str]) -> dict[str, "DocumentChunk"]:
+        """
+        Same as `load_by_ids` with the asyncio client.
+        """
+        object_ids: list[bson.objectid.ObjectId] = [
+            bson.objectid.ObjectId(i)
+            for i in set(ids)
+        ]
+
+        coll = database.mongo.get_async_collection("chunks")
+
+        raw_chunks: list[dict[str, any]] = await coll.find({"_id": {"$in": object_ids}}, projection={"embedding": False}).to_list()
+
+        return {
+            str(raw_chunk["_id"]): DocumentChunk.from_dict(raw_chunk)
+            for raw_chunk in raw_chunks
+        }
+
+    @staticmethod
+    def load_from_ids(ids: list[str]) -> list["DocumentChunk"]:
+        """
+        Loads all chunks in one query, keeping the order of `ids`.
+        Returns None if any of the chunks does not exist (anymore).
+        """
+        chunks_by_id: dict[str, DocumentChunk] = DocumentChunk.load_by_ids(ids)
+
+        if any(i not in chunks_by_id for i in ids):
+            return None
+
+        return [
+            chunks_by_id[i]
+            for i in ids
+        ]
 
     @classmethod
     def from_dict(cls, data) -> "DocumentChunk":
@@ -0,0 +1,43 @@
+"""
+Version stamps for imported data.
+Stored in a PGVectorDB
+rag::data_versions
+
+Every import (scenarios, chunks) bumps its stamp, so in-process
+snapshots and caches can detect that they are outdated.
+"""
+import psycopg2.errors
+
+import database.postgres
+
+
+
+def get_versions() -> dict[str, int]:
+    try:
+        rows: list[dict[str, any]] = database.postgres.fetch_all(
+            """
+            SELECT name, version FROM data_versions
+            """,
+            "rag"
+        )
+    except psycopg2.errors.UndefinedTable:
+        # Setup was not run yet, every other error reaches the caller
+        return {}
+
+    return {
+        row["name"]: row["version"]
+        for row in rows
+    }
+
+
+def bump_version(name: str) -> None:
+    database.postgres.execute(
+        """
+        INSERT INTO data_versions (name, version, updated_at)
+        VALUES (%s, 1, now())
+        ON CONFLICT (name) DO UPDATE
+        SET version = data_versions.version + 1, updated_at = now()
+        """,
+        "rag",
+        (name,)
+    )
@@ -1,12 +1,203 @@
-import sentence_transformers
-import torch
+"""
+Embeddings with the SentenceTransformer DEFAULT_MODEL.
+
+The model (and with it torch) is loaded on first use, not at import time, so
+importing the pipeline stays fast. Servers load it up front in their warmup
+(ragutil.warmup).
+
+EMBEDDING_BACKEND selects the inference backend, for the API and for the
+import (setup/) alike:
+- torch: the model on PyTorch
+- onnx: an int8 quantized ONNX export of the model (EMBEDDING_ONNX_FILE) on
+  ONNX Runtime, faster on CPU-only nodes. The model repository ships exports
+  for several instruction sets (onnx/model_qint8_avx512_vnni.onnx,
+  onnx/model_qint8_arm64.onnx, ...). Check the agreement with the torch
+  vectors before switching (benchmarks/embedding_parity.py), the stored
+  chunk and scenario embeddings were built with the torch backend.
+
+With EMBEDDING_BATCHING the encode calls of concurrent requests are merged
+into shared batches (util.embedding_batcher).
+
+With EMBEDDING_SERVICE_SOCKET the model is not loaded in this process at all,
+the texts are encoded by the local embedding service (embedding_service.py,
+util.embedding_client) that all processes of the host share.
+"""
+import os
+import threading
+
+import numpy
+
+import util.embedding_batcher
+import util.embedding_cache
+import util.embedding_client
+import util.tracing
 
 
 DEFAULT_MODEL = "all-MiniLM-L6-v2"
 
-model: sentence_transformers.SentenceTransformer = sentence_transformers.SentenceTransformer(DEFAULT_MODEL)
+EMBEDDING_BACKENDS: tuple[str, ...] = ("torch", "onnx")
+EMBEDDING_BACKEND: str = os.getenv("EMBEDDING_BACKEND", "torch")
+# AVX2 runs on every x86-64 node, the avx512(_vnni) exports are faster where supported
+EMBEDDING_ONNX_FILE: str = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+# Intra-op threads of the ONNX Runtime session, 0 leaves it to ONNX Runtime (all physical cores)
+EMBEDDING_ONNX_THREADS: int = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+
+# The vectors of the backends differ slightly, the persistent cache keeps them apart
+CACHE_MODEL_NAME: str = DEFAULT_MODEL if EMBEDDING_BACKEND == "torch" else f"{DEFAULT_MODEL}/{EMBEDDING_ONNX_FILE}"
+
+_model = None
+_model_lock: threading.Lock = threading.Lock()
+
+
+def load_model(backend: str = EMBEDDING_BACKEND):
+    """
+    Loads a new sentence_transformers.SentenceTransformer of DEFAULT_MODEL on `backend`.
+    """
+    # torch is imported here, see the module docstring
+    import sentence_transformers
+
+    if backend == "torch":
+        return sentence_transformers.SentenceTransformer(DEFAULT_MODEL)
+
+    if backend == "onnx":
+        model_kwargs: dict[str, any] = {
+            "file_name": EMBEDDING_ONNX_FILE,
+            "provider": "CPUExecutionProvider",
+        }
+
+        if EMBEDDING_ONNX_THREADS > 0:
+            import onnxruntime
+
+            session_options: onnxruntime.SessionOptions = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = EMBEDDING_ONNX_THREADS
+            model_kwargs["session_options"] = session_options
+
+        return sentence_transformers.SentenceTransformer(DEFAULT_MODEL, backend="onnx", model_kwargs=model_kwargs)
+
+    raise ValueError(f"Unknown embedding backend `{backend}`, expected one of {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def get_model():
+    """
+    Loads the sentence_transformers.SentenceTransformer once per process.
+    A model loaded before fork() (gunicorn preload_app) is shared with the workers.
+    """
+    global _model
+
+    model = _model
+
+    if model is not None:
+        return model
+
+    with _model_lock:
+        if _model is None:
+            _model = load_model(EMBEDDING_BACKEND)
+
+        return _model
+
+
+def is_loaded() -> bool:
+    return _model is not None
+
+
+def _run_model(contents: list[str]) -> numpy.ndarray:
+    return get_model().encode(contents, convert_to_numpy=True)
+
+
+batcher: util.embedding_batcher.EmbeddingBatcher = util.embedding_batcher.EmbeddingBatcher(_run_model)
+
+
+def _call(service_function, local_function, *args):
+    """
+    Through the embedding service if configured, with the model of this process otherwise
+    or while the service is not reachable (EMBEDDING_SERVICE_FALLBACK).
+    """
+    if util.embedding_client.is_enabled():
+        try:
+            return service_function(*args)
+        except OSError as e:
+            if not util.embedding_client.EMBEDDING_SERVICE_FALLBACK:
+                raise
+            util.embedding_client.client.record_fallback(e)
+
+    return local_function(*args)
+
+
+def prepare() -> None:
+    """
+    Loads the model, with the embedding service only checks that it answers.
+    """
+    _call(util.embedding_client.client.info, get_model)
+
+
+def get_dimension() -> int:
+    return _call(util.embedding_client.client.get_dimension, lambda: get_model().get_sentence_embedding_dimension())
+
+
+def encode_with_model(contents: list[str]) -> numpy.ndarray:
+    """
+    Encodes with the model of this process, also used by the embedding service itself.
+    """
+    if util.embedding_batcher.EMBEDDING_BATCHING:
+        return batcher.encode(contents)
+
+    return _run_model(contents)
+
+
+def encode(contents: list[str]) -> numpy.ndarray:
+    """
+    Encodes without util.embedding_cache.
+    """
+    embeddings: numpy.ndarray = _call(util.embedding_client.client.encode, encode_with_model, contents)
+
+    return numpy.ascontiguousarray(embeddings, dtype=numpy.float32)
+
+
+def _encode(contents: list[str]) -> numpy.ndarray:
+    # Only the cache misses reach the model
+    util.tracing.set_attributes(encoded=len(contents))
+
+    return encode(contents)
+
+
+def count_tokens(contents: list[str]) -> list[int]:
+    """
+    Number of tokens per content with the tokenizer of the embedding model,
+    without special tokens and without the model's 256 token truncation.
+    """
+    if not contents:
+        return []
+
+    return _call(util.embedding_client.client.count_tokens, count_tokens_with_model, contents)
+
+
+def count_tokens_with_model(contents: list[str]) -> list[int]:
+    encoded = get_model().tokenizer(contents, add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False, verbose=False)
+
+    return [
+        len(input_ids)
+        for input_ids in encoded["input_ids"]
+    ]
+
+
+def build_embedding(content: str) -> numpy.ndarray:
+    return build_embeddings([content])[0]
+
+
+def build_embeddings(contents: list[str]) -> numpy.ndarray:
+    """
+    Encodes all contents with a single batched `encode` call
+    (shared with concurrent calls with EMBEDDING_BATCHING).
+    Returns a C-contiguous float32 matrix with one row per content.
+    Contents already encoded before are served from util.embedding_cache.
+    """
+    if not contents:
+        return numpy.empty((0, get_dimension()), dtype=numpy.float32)
+
+    with util.tracing.span("embedding", vectors=len(contents), encoded=0):
+        if not util.embedding_cache.EMBEDDING_CACHE_ENABLED:
+            return _encode(contents)
 
+        vectors: list[numpy.ndarray] = util.embedding_cache.embedding_cache.get_or_compute(CACHE_MODEL_NAME, contents, _encode)
 
-def build_embedding(content: str) -> torch.Tensor:
-    return model.encode(content)
-    
\ No newline at end of file
+        return numpy.ascontiguousarray(vectors, dtype=numpy.float32)
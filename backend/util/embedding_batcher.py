@@ -0,0 +1,169 @@
+"""
+Micro-batching of concurrent encode calls (util.embedding).
+
+Every request thread encodes its few texts on its own, torch runs these small
+batches one after another. With EMBEDDING_BATCHING the calls are queued instead:
+one dispatcher thread per process collects them for up to
+EMBEDDING_BATCH_MAX_WAIT_MS after the first one or until EMBEDDING_BATCH_MAX_SIZE
+texts, runs a single batched `encode` and resolves each caller's future with its rows.
+Calls arriving while a batch is encoded are collected for the next one.
+
+A single caller waits up to EMBEDDING_BATCH_MAX_WAIT_MS longer, so it is only
+enabled for the servers (gunicorn.conf.py), not for the sequential import.
+"""
+import concurrent.futures
+import dataclasses
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy
+
+import util.metrics
+
+
+EMBEDDING_BATCHING: bool = os.getenv("EMBEDDING_BATCHING", "0") == "1"
+EMBEDDING_BATCH_MAX_WAIT_MS: float = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "2"))
+# A call is never split, a batch can exceed this by the texts of its last call
+EMBEDDING_BATCH_MAX_SIZE: int = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "64"))
+
+batch_texts: util.metrics.Histogram = util.metrics.histogram(
+    "rag_embedding_batch_texts",
+    "Texts per batched encode call of the embedding dispatcher",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+batch_calls: util.metrics.Histogram = util.metrics.histogram(
+    "rag_embedding_batch_calls",
+    "Callers served by one batched encode call of the embedding dispatcher",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32)
+)
+queue_wait: util.metrics.Histogram = util.metrics.histogram(
+    "rag_embedding_queue_wait_seconds",
+    "Time an encode call waited in the queue of the embedding dispatcher",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+
+
+@dataclasses.dataclass
+class EncodeCall(object):
+    contents: list[str]
+    future: concurrent.futures.Future
+    enqueued: float
+
+
+class EmbeddingBatcher(object):
+
+    def __init__(self, encode, max_wait: float = EMBEDDING_BATCH_MAX_WAIT_MS / 1000, max_size: int = EMBEDDING_BATCH_MAX_SIZE):
+        """
+        `encode` (list[str] -> matrix, one row per text) is only called by the dispatcher thread.
+        """
+        self.encode_function = encode
+        self.max_wait: float = max_wait
+        self.max_size: int = max_size
+
+        self._queue: queue.SimpleQueue = None
+        self._thread: threading.Thread = None
+        self._pid: int = None
+        self._lock: threading.Lock = threading.Lock()
+
+        self.calls: int = 0
+        self.batches: int = 0
+        self.texts: int = 0
+        self.errors: int = 0
+
+    def _get_queue(self) -> queue.SimpleQueue:
+        """
+        The dispatcher thread is started lazily and per process, it does not survive fork().
+        """
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name="embedding-batcher", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+            return self._queue
+
+    def submit(self, contents: list[str]) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._get_queue().put(EncodeCall(contents, future, time.perf_counter()))
+        return future
+
+    def encode(self, contents: list[str]) -> numpy.ndarray:
+        """
+        Blocks until the batch containing `contents` was encoded, returns their rows.
+        """
+        return self.submit(contents).result()
+
+    def _collect(self, calls: queue.SimpleQueue) -> list[EncodeCall]:
+        batch: list[EncodeCall] = [calls.get()]
+        size: int = len(batch[0].contents)
+        deadline: float = batch[0].enqueued + self.max_wait
+
+        while size < self.max_size:
+            try:
+                # Calls queued while the previous batch was encoded are taken without waiting
+                call: EncodeCall = calls.get(timeout=max(deadline - time.perf_counter(), 0.0))
+            except queue.Empty:
+                break
+
+            batch.append(call)
+            size += len(call.contents)
+
+        return batch
+
+    def _run(self, calls: queue.SimpleQueue) -> None:
+        while True:
+            batch: list[EncodeCall] = self._collect(calls)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: list[EncodeCall]) -> None:
+        start_time: float = time.perf_counter()
+        contents: list[str] = [
+            content
+            for call in batch
+            for content in call.contents
+        ]
+
+        for call in batch:
+            queue_wait.observe(start_time - call.enqueued)
+        batch_texts.observe(len(contents))
+        batch_calls.observe(len(batch))
+
+        with self._lock:
+            self.calls += len(batch)
+            self.batches += 1
+            self.texts += len(contents)
+
+        try:
+            embeddings: numpy.ndarray = self.encode_function(contents)
+        except Exception as e:
+            logging.exception(f"Batched encode of {len(contents)} texts failed")
+
+            with self._lock:
+                self.errors += 1
+
+            for call in batch:
+                call.future.set_exception(e)
+            return
+
+        offset: int = 0
+        for call in batch:
+            call.future.set_result(embeddings[offset:offset + len(call.contents)])
+            offset += len(call.contents)
+
+    def stats(self) -> dict[str, any]:
+        with self._lock:
+            return {
+                "enabled": EMBEDDING_BATCHING,
+                "max_wait_ms": self.max_wait * 1000,
+                "max_size": self.max_size,
+                "calls": self.calls,
+                "batches": self.batches,
+                "texts": self.texts,
+                "errors": self.errors,
+                "avg_batch_texts": self.texts / self.batches if self.batches else 0.0,
+                "avg_batch_calls": self.calls / self.batches if self.batches else 0.0,
+            }
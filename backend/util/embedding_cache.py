@@ -0,0 +1,282 @@
+"""
+Content-addressed cache for embeddings.
+
+The key is the xxh3-128 hash of the model name and the text, so identical
+strings (recurring keywords, unchanged chunks on a re-import) are only encoded once.
+
+Two tiers:
+- memory: LRU of the most recently used vectors (EMBEDDING_CACHE_MEMORY_SIZE)
+- disk: SQLite file (EMBEDDING_CACHE_PATH) with the raw float32 bytes per vector,
+  1.5 KB for MiniLM. Shared by all processes, kept across restarts. At most every
+  _PRUNE_INTERVAL seconds a write deletes the vectors older than
+  EMBEDDING_CACHE_DISK_MAX_AGE_DAYS and all but the EMBEDDING_CACHE_DISK_MAX_ENTRIES
+  newest ones (by created_at), user inputs and keyword candidates are stored as well.
+
+The lock only guards the memory tier and the counters, every thread reads and
+writes the SQLite file over its own connection (WAL: readers do not wait for a writer).
+"""
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy
+import xxhash
+
+
+EMBEDDING_CACHE_ENABLED: bool = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+EMBEDDING_CACHE_MEMORY_SIZE: int = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "10000"))
+EMBEDDING_CACHE_DISK_ENABLED: bool = os.getenv("EMBEDDING_CACHE_DISK_ENABLED", "1") == "1"
+EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(__file__), "..", ".cache", "embeddings.sqlite3"))
+# ~300 MB of MiniLM vectors, 0 disables the limit
+EMBEDDING_CACHE_DISK_MAX_ENTRIES: int = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_DISK_MAX_AGE_DAYS: float = float(os.getenv("EMBEDDING_CACHE_DISK_MAX_AGE_DAYS", "30"))
+
+# SQLite limits the number of host parameters per statement
+_SQLITE_BATCH_SIZE: int = 500
+_PRUNE_INTERVAL: float = 60.0
+
+
+def build_key(model_name: str, text: str) -> bytes:
+    hasher = xxhash.xxh3_128()
+    hasher.update(model_name.encode("utf-8"))
+    hasher.update(b"\0")
+    hasher.update(text.encode("utf-8"))
+    return hasher.digest()
+
+
+class EmbeddingCache(object):
+
+    def __init__(self, memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE, path: str = EMBEDDING_CACHE_PATH if EMBEDDING_CACHE_DISK_ENABLED else None, disk_max_entries: int = EMBEDDING_CACHE_DISK_MAX_ENTRIES, disk_max_age: float = EMBEDDING_CACHE_DISK_MAX_AGE_DAYS * 86400):
+        self.memory_size: int = memory_size
+        self.path: str = path
+        self.disk_max_entries: int = disk_max_entries
+        self.disk_max_age: float = disk_max_age
+
+        self._memory: collections.OrderedDict[bytes, numpy.ndarray] = collections.OrderedDict()
+        # One SQLite connection per thread
+        self._local: threading.local = threading.local()
+        self._lock: threading.Lock = threading.Lock()
+        self._pruned_at: float = None
+
+        self.memory_hits: int = 0
+        self.disk_hits: int = 0
+        self.misses: int = 0
+        self.disk_errors: int = 0
+        self.disk_evictions: int = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite connections must not be used across fork()
+        connection: sqlite3.Connection = getattr(self._local, "connection", None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key BLOB PRIMARY KEY,
+                dimension INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        connection.execute(
+            """
+            CREATE INDEX IF NOT EXISTS embeddings_created_at_idx ON embeddings (created_at)
+            """
+        )
+
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _remember(self, key: bytes, vector: numpy.ndarray) -> None:
+        # Caller holds the lock
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _load_from_disk(self, keys: list[bytes]) -> dict[bytes, numpy.ndarray]:
+        found: dict[bytes, numpy.ndarray] = {}
+
+        if self.path is None or not keys:
+            return found
+
+        try:
+            connection: sqlite3.Connection = self._connect()
+
+            for start in range(0, len(keys), _SQLITE_BATCH_SIZE):
+                batch: list[bytes] = keys[start:start + _SQLITE_BATCH_SIZE]
+                placeholders: str = ", ".join("?" * len(batch))
+
+                rows = connection.execute(
+                    f"""
+                    SELECT key, vector FROM embeddings WHERE key IN ({placeholders})
+                    """,
+                    batch
+                )
+                for key, blob in rows:
+                    found[key] = numpy.frombuffer(blob, dtype=numpy.float32)
+        except sqlite3.Error:
+            # The disk tier is optional, fall back to encoding
+            logging.exception("Reading the embedding cache failed")
+            with self._lock:
+                self.disk_errors += 1
+
+        return found
+
+    def _store_on_disk(self, vectors: dict[bytes, numpy.ndarray]) -> None:
+        if self.path is None or not vectors:
+            return
+
+        now: float = time.time()
+
+        try:
+            connection: sqlite3.Connection = self._connect()
+            connection.executemany(
+                """
+                INSERT OR REPLACE INTO embeddings (key, dimension, vector, created_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                [
+                    (key, len(vector), vector.tobytes(), now)
+                    for key, vector in vectors.items()
+                ]
+            )
+
+            if self._should_prune():
+                self._prune(connection)
+        except sqlite3.Error:
+            logging.exception("Writing the embedding cache failed")
+            with self._lock:
+                self.disk_errors += 1
+
+    def _should_prune(self) -> bool:
+        with self._lock:
+            now: float = time.monotonic()
+
+            if self._pruned_at is not None and now - self._pruned_at < _PRUNE_INTERVAL:
+                return False
+
+            self._pruned_at = now
+            return True
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        deleted: int = 0
+
+        if self.disk_max_age > 0:
+            deleted += connection.execute(
+                """
+                DELETE FROM embeddings WHERE created_at < ?
+                """,
+                (time.time() - self.disk_max_age,)
+            ).rowcount
+
+        if self.disk_max_entries > 0:
+            deleted += connection.execute(
+                """
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings
+                    ORDER BY created_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.disk_max_entries,)
+            ).rowcount
+
+        with self._lock:
+            self.disk_evictions += max(deleted, 0)
+
+    def get_or_compute(self, model_name: str, texts: list[str], compute) -> list[numpy.ndarray]:
+        """
+        Returns one float32 vector per text. Only texts found in neither tier are
+        passed to `compute` (list[str] -> float32 matrix), in a single batch.
+        """
+        keys: list[bytes] = [
+            build_key(model_name, text)
+            for text in texts
+        ]
+        vectors: dict[bytes, numpy.ndarray] = {}
+
+        with self._lock:
+            for key in keys:
+                vector: numpy.ndarray = self._memory.get(key)
+
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[key] = vector
+
+            self.memory_hits += sum(1 for key in keys if key in vectors)
+
+        # SQLite is read and written outside of the lock, memory hits of other threads do not wait for it
+        missing: list[bytes] = list(dict.fromkeys(key for key in keys if key not in vectors))
+        from_disk: dict[bytes, numpy.ndarray] = self._load_from_disk(missing)
+
+        with self._lock:
+            self.disk_hits += sum(1 for key in keys if key in from_disk)
+            for key, vector in from_disk.items():
+                vectors[key] = vector
+                self._remember(key, vector)
+
+        # Encode outside of the lock, other threads can keep hitting the cache
+        missing_texts: dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing_texts.setdefault(key, text)
+
+        if missing_texts:
+            computed: numpy.ndarray = compute(list(missing_texts.values()))
+            computed_vectors: dict[bytes, numpy.ndarray] = {
+                key: numpy.ascontiguousarray(vector, dtype=numpy.float32)
+                for key, vector in zip(missing_texts.keys(), computed)
+            }
+
+            with self._lock:
+                self.misses += sum(1 for key in keys if key in computed_vectors)
+                for key, vector in computed_vectors.items():
+                    vectors[key] = vector
+                    self._remember(key, vector)
+
+            self._store_on_disk(computed_vectors)
+
+        return [
+            vectors[key]
+            for key in keys
+        ]
+
+    def stats(self) -> dict[str, any]:
+        with self._lock:
+            lookups: int = self.memory_hits + self.disk_hits + self.misses
+
+            return {
+                "enabled": EMBEDDING_CACHE_ENABLED,
+                "memory_size": len(self._memory),
+                "memory_max_size": self.memory_size,
+                "disk_path": os.path.abspath(self.path) if self.path else None,
+                "disk_max_entries": self.disk_max_entries,
+                "disk_max_age_days": self.disk_max_age / 86400,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_hit_ratio": self.memory_hits / lookups if lookups else 0.0,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "disk_errors": self.disk_errors,
+                "disk_evictions": self.disk_evictions,
+            }
+
+
+embedding_cache: EmbeddingCache = EmbeddingCache()
+
+
+def get_stats() -> dict[str, any]:
+    return embedding_cache.stats()
@@ -0,0 +1,230 @@
+"""
+Client of the local embedding service (embedding_service.py).
+
+With EMBEDDING_SERVICE_SOCKET set, util.embedding does not load the model in
+this process but sends the texts to the service over its Unix socket. The API
+workers and the import scripts of a host then share one model instance.
+
+Protocol: every message is a 4 byte big-endian length followed by a JSON
+object. The vectors are not serialized: each connection owns a
+multiprocessing.shared_memory segment, its name is part of the encode request
+and the service writes the float32 rows into it. The client copies them out
+before the next request reuses the segment. The service only writes into
+segments named by `is_segment_name` (SEGMENT_PREFIX), not into any other one in /dev/shm.
+"""
+import json
+import logging
+import multiprocessing.shared_memory
+import os
+import re
+import secrets
+import socket
+import struct
+import threading
+
+import numpy
+
+
+EMBEDDING_SERVICE_SOCKET: str = os.getenv("EMBEDDING_SERVICE_SOCKET", "")
+EMBEDDING_SERVICE_TIMEOUT: float = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", "60"))
+# Encode with a model of this process while the service is not reachable
+EMBEDDING_SERVICE_FALLBACK: bool = os.getenv("EMBEDDING_SERVICE_FALLBACK", "1") == "1"
+
+SEGMENT_PREFIX: str = "rag_embedding_"
+
+_SEGMENT_NAME: re.Pattern = re.compile(rf"{SEGMENT_PREFIX}[0-9]+_[0-9a-f]+")
+_HEADER: struct.Struct = struct.Struct(">I")
+# Initial shared memory per connection: 128 MiniLM vectors
+_INITIAL_SEGMENT_SIZE: int = 128 * 384 * 4
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data: bytearray = bytearray()
+
+    while len(data) < size:
+        chunk: bytes = connection.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+
+    return bytes(data)
+
+
+def create_segment_name() -> str:
+    return f"{SEGMENT_PREFIX}{os.getpid()}_{secrets.token_hex(8)}"
+
+
+def is_segment_name(name: str) -> bool:
+    """
+    Only segments created by `ServiceConnection` are written to.
+    """
+    return isinstance(name, str) and _SEGMENT_NAME.fullmatch(name) is not None
+
+
+def send_message(connection: socket.socket, message: dict[str, any]) -> None:
+    payload: bytes = json.dumps(message).encode("utf-8")
+    connection.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def receive_message(connection: socket.socket) -> dict[str, any]:
+    """
+    The next message, None once the peer closed the connection.
+    """
+    header: bytes = _receive_exactly(connection, _HEADER.size)
+    if header is None:
+        return None
+
+    payload: bytes = _receive_exactly(connection, _HEADER.unpack(header)[0])
+    if payload is None:
+        return None
+
+    return json.loads(payload)
+
+
+class ServiceConnection(object):
+    """
+    One socket and one shared memory segment, used by one thread at a time.
+    """
+
+    def __init__(self, path: str, timeout: float):
+        self.pid: int = os.getpid()
+        self.segment: multiprocessing.shared_memory.SharedMemory = None
+        self.socket: socket.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Connected in blocking mode, with a timeout a full accept backlog fails with EAGAIN instead of waiting
+        self.socket.connect(path)
+        self.socket.settimeout(timeout)
+
+    def ensure_capacity(self, size: int) -> None:
+        if self.segment is not None and self.segment.size >= size:
+            return
+
+        self._release_segment()
+        self.segment = multiprocessing.shared_memory.SharedMemory(name=create_segment_name(), create=True, size=max(size, _INITIAL_SEGMENT_SIZE))
+
+    def request(self, message: dict[str, any]) -> dict[str, any]:
+        send_message(self.socket, message)
+        response: dict[str, any] = receive_message(self.socket)
+
+        if response is None:
+            raise ConnectionError("Embedding service closed the connection")
+        if "error" in response:
+            raise RuntimeError(f"Embedding service failed: {response['error']}")
+
+        return response
+
+    def _release_segment(self) -> None:
+        if self.segment is None:
+            return
+
+        self.segment.close()
+        self.segment.unlink()
+        self.segment = None
+
+    def close(self) -> None:
+        try:
+            self.socket.close()
+        finally:
+            # A connection inherited through fork() belongs to the parent
+            if self.pid == os.getpid():
+                self._release_segment()
+
+    def __del__(self) -> None:
+        # Dropped with the thread-local of a finished thread, the segment would stay in /dev/shm
+        self.close()
+
+
+class EmbeddingServiceClient(object):
+
+    def __init__(self, path: str = EMBEDDING_SERVICE_SOCKET, timeout: float = EMBEDDING_SERVICE_TIMEOUT):
+        self.path: str = path
+        self.timeout: float = timeout
+
+        # One connection per thread, a request holds its connection until the answer is read
+        self._local: threading.local = threading.local()
+        self._dimension: int = None
+        self._lock: threading.Lock = threading.Lock()
+
+        self.requests: int = 0
+        self.errors: int = 0
+        self.fallbacks: int = 0
+
+    def _get_connection(self) -> ServiceConnection:
+        connection: ServiceConnection = getattr(self._local, "connection", None)
+
+        if connection is None or connection.pid != os.getpid():
+            connection = ServiceConnection(self.path, self.timeout)
+            self._local.connection = connection
+
+        return connection
+
+    def _request(self, message: dict[str, any], capacity: int = 0) -> tuple[dict[str, any], ServiceConnection]:
+        with self._lock:
+            self.requests += 1
+
+        try:
+            connection: ServiceConnection = self._get_connection()
+            if capacity:
+                connection.ensure_capacity(capacity)
+                message["shared_memory"] = connection.segment.name
+
+            return connection.request(message), connection
+        except (OSError, ValueError):
+            # Broken socket or an unparseable answer, the next request reconnects
+            connection = getattr(self._local, "connection", None)
+            if connection is not None:
+                connection.close()
+                self._local.connection = None
+
+            with self._lock:
+                self.errors += 1
+            raise
+
+    def get_dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self.info()["dimension"]
+        return self._dimension
+
+    def info(self) -> dict[str, any]:
+        response, _ = self._request({"op": "info"})
+        return response
+
+    def encode(self, contents: list[str]) -> numpy.ndarray:
+        """
+        Float32 matrix with one row per content, copied out of the shared memory.
+        """
+        dimension: int = self.get_dimension()
+        response, connection = self._request({"op": "encode", "contents": contents}, len(contents) * dimension * 4)
+
+        rows: numpy.ndarray = numpy.ndarray((response["rows"], response["dimension"]), dtype=numpy.float32, buffer=connection.segment.buf)
+        return rows.copy()
+
+    def count_tokens(self, contents: list[str]) -> list[int]:
+        response, _ = self._request({"op": "count_tokens", "contents": contents})
+        return response["counts"]
+
+    def record_fallback(self, error: Exception) -> None:
+        with self._lock:
+            self.fallbacks += 1
+            fallbacks: int = self.fallbacks
+
+        # Every call falls back while the service is down, not every one is logged
+        if fallbacks == 1 or fallbacks % 100 == 0:
+            logging.warning(f"Embedding service at {self.path} not available ({error!r}), encoding in this process ({fallbacks} times)")
+
+    def stats(self) -> dict[str, any]:
+        with self._lock:
+            return {
+                "socket": self.path,
+                "fallback": EMBEDDING_SERVICE_FALLBACK,
+                "requests": self.requests,
+                "errors": self.errors,
+                "fallbacks": self.fallbacks,
+            }
+
+
+client: EmbeddingServiceClient = EmbeddingServiceClient()
+
+
+def is_enabled() -> bool:
+    return bool(EMBEDDING_SERVICE_SOCKET)
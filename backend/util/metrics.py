@@ -0,0 +1,243 @@
+"""
+Minimal metrics registry with the Prometheus text exposition format (version 0.0.4).
+
+Counters, gauges and histograms with labels, updated in constant time under a
+lock per metric, cheap enough to stay on in production. Values that already
+exist elsewhere (cache and pool statistics) are not duplicated but read by
+collectors at scrape time.
+
+Values are per process, every worker process is scraped (or aggregated) on its own.
+"""
+import bisect
+import dataclasses
+import math
+import threading
+
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@dataclasses.dataclass
+class MetricFamily(object):
+    """
+    Samples of one metric as returned by a collector: (labels, value) pairs.
+    """
+    name: str
+    type: str
+    help: str
+    samples: list[tuple[dict[str, str], float]]
+
+
+def _format_value(value: float) -> str:
+    if value is None or math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    joined: str = ",".join(
+        f'{name}="{_escape(value)}"'
+        for name, value in labels.items()
+    )
+    return "{" + joined + "}"
+
+
+class Metric(object):
+    type: str = None
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name: str = name
+        self.help: str = help
+        self.labelnames: tuple[str, ...] = tuple(labelnames)
+        self._lock: threading.Lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {tuple(labels)}")
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...]) -> dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> list[str]:
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1.0, **labels) -> None:
+        key: tuple[str, ...] = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values: list[tuple[tuple[str, ...], float]] = list(self._values.items())
+
+        return [
+            f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key: tuple[str, ...] = self._key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, value: float = 1.0, **labels) -> None:
+        key: tuple[str, ...] = self._key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def dec(self, value: float = 1.0, **labels) -> None:
+        self.inc(-value, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values: list[tuple[tuple[str, ...], float]] = list(self._values.items())
+
+        return [
+            f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    """
+    Fixed upper bounds, an observation increments one bucket (cumulated when rendered).
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # Per label set: counts per bucket (+Inf last), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key: tuple[str, ...] = self._key(labels)
+        # Upper bounds are inclusive (le)
+        index: int = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            entry: tuple[list[int], list[float]] = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+
+            counts, total = entry
+            counts[index] += 1
+            total[0] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values: list[tuple[tuple[str, ...], list[int], float]] = [
+                (key, list(counts), total[0])
+                for key, (counts, total) in self._values.items()
+            ]
+
+        lines: list[str] = []
+
+        for key, counts, total in values:
+            labels: dict[str, str] = self._labels(key)
+            cumulative: int = 0
+
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+
+        return lines
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list = []
+        self._lock: threading.Lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Returns the metric already registered under the name, if any (modules may be imported twice).
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def add_collector(self, collector) -> None:
+        """
+        `collector()` is called on every scrape and returns a list of MetricFamily.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics: list[Metric] = list(self._metrics.values())
+            collectors: list = list(self._collectors)
+
+        lines: list[str] = []
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            for family in collector():
+                lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.type}")
+                lines.extend(
+                    f"{family.name}{_format_labels(labels)} {_format_value(value)}"
+                    for labels, value in family.samples
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+registry: Registry = Registry()
+
+CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+    return registry.register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+    return registry.register(Gauge(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help, labelnames, buckets))
+
+
+def render() -> str:
+    return registry.render()
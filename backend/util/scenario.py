@@ -23,9 +23,13 @@ class ScenarioQuestion(object):
             if f.name.lower() in data
             or f.name in data
         }
-        # Conversion to list[float]
+        # Conversion to list[float], text without and numpy array with registered pgvector type
         if "embedding" in filtered_data:
-            filtered_data["embedding"] = json.loads(filtered_data["embedding"])
+            embedding: any = filtered_data["embedding"]
+            if isinstance(embedding, str):
+                filtered_data["embedding"] = json.loads(embedding)
+            elif embedding is not None:
+                filtered_data["embedding"] = [float(value) for value in embedding]
 
         return cls(**filtered_data)
 
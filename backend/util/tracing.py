@@ -0,0 +1,293 @@
+"""
+Lightweight structured tracing for the RAG pipeline.
+
+A request opens a trace (`trace`), every stage inside it a span (`span`):
+
+    with util.tracing.trace("rag") as root:
+        with util.tracing.span("scenario_search", keywords=len(keywords)) as span:
+            ...
+            span.set("scenarios", len(scenarios))
+
+The current span is kept in a context variable, so spans nest across function
+calls and asyncio tasks (asyncio.to_thread copies the context). Work submitted
+to a thread pool is wrapped with `bind` to stay in the trace.
+Outside of a trace `span` returns a detached span that is not recorded, library
+code (util.embedding, ragutil.perplexity) can open spans unconditionally.
+
+Finished traces are exported to
+- an in-memory ring buffer of the last TRACE_BUFFER_SIZE traces (/debug/traces)
+- a JSON-lines file (TRACE_EXPORT_PATH, one trace per line) if configured,
+  serialized and written by a background thread, not by the request (event loop) thread
+- the listeners registered with `add_listener` (ragutil.pipeline_metrics)
+"""
+import collections
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+
+TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+# Empty disables the JSON-lines export
+TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH", "")
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+_buffer: collections.deque = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+_buffer_lock: threading.Lock = threading.Lock()
+_export_queue: queue.SimpleQueue = None
+_export_thread: threading.Thread = None
+_export_pid: int = None
+_export_lock: threading.Lock = threading.Lock()
+_listeners: list = []
+
+
+class Trace(object):
+    """
+    The spans of one request, exported once its root span has ended.
+    """
+
+    def __init__(self):
+        self.trace_id: str = uuid.uuid4().hex
+        self.spans: list[Span] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    def _add(self, span: "Span") -> None:
+        with self._lock:
+            self.spans.append(span)
+
+            if span.parent is not None:
+                span.parent.children.append(span)
+
+    def to_dict(self) -> dict[str, any]:
+        with self._lock:
+            spans: list[Span] = list(self.spans)
+
+        root: Span = spans[0]
+
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "start_time": root.start_time,
+            "duration_ms": root.duration * 1000 if root.duration is not None else None,
+            "spans": [
+                span.to_dict()
+                for span in spans
+            ]
+        }
+
+
+class Span(object):
+    """
+    Timed section of a trace with attributes (counts, bytes, tokens).
+    Used as a context manager, exceptions are recorded and re-raised.
+    """
+
+    def __init__(self, name: str, attributes: dict[str, any], trace: Trace = None, parent: "Span" = None):
+        self.name: str = name
+        self.attributes: dict[str, any] = attributes
+        self.trace: Trace = trace
+        self.parent: Span = parent
+        self.children: list[Span] = []
+        self.span_id: int = next(_span_ids)
+
+        self.start_time: float = None
+        self.duration: float = None
+        self.error: str = None
+
+        self._start: float = None
+        self._token: contextvars.Token = None
+
+    def __enter__(self) -> "Span":
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+
+        if self.trace is not None:
+            self.trace._add(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self.duration = time.perf_counter() - self._start
+
+        if exc_type is not None:
+            self.error = exc_type.__name__
+
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Generator closed from another context (client disconnected), nothing to restore
+            pass
+
+        if self.trace is not None and self.parent is None:
+            _export(self.trace)
+
+        return False
+
+    def set(self, key: str, value: any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Duration of a finished span, the time since the start of a running one.
+        """
+        if self.duration is not None:
+            return self.duration
+        if self._start is None:
+            return 0.0
+        return time.perf_counter() - self._start
+
+    def child_duration(self, name: str) -> float:
+        """
+        Summed durations of the direct children called `name`, 0.0 if there are none.
+        """
+        lock: threading.Lock = self.trace._lock if self.trace is not None else threading.Lock()
+
+        with lock:
+            return sum(
+                child.elapsed
+                for child in self.children
+                if child.name == name
+            )
+
+    def to_dict(self) -> dict[str, any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "start_time": self.start_time,
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "attributes": dict(self.attributes),
+            "error": self.error,
+        }
+
+
+def trace(name: str, **attributes) -> Span:
+    """
+    Root span of a new trace.
+    """
+    return Span(name, attributes, Trace())
+
+
+def span(name: str, **attributes) -> Span:
+    """
+    Child of the current span, detached (not recorded) outside of a trace.
+    """
+    parent: Span = _current_span.get()
+
+    if parent is None or parent.trace is None:
+        return Span(name, attributes)
+
+    return Span(name, attributes, parent.trace, parent)
+
+
+def current() -> Span:
+    return _current_span.get()
+
+
+def set_attributes(**attributes) -> None:
+    """
+    Sets attributes on the current span, if there is one.
+    """
+    current_span: Span = _current_span.get()
+
+    if current_span is not None:
+        current_span.attributes.update(attributes)
+
+
+def bind(function):
+    """
+    Runs `function` in a copy of the current context, for work submitted to a thread pool.
+    One copy per submitted call, a context cannot be entered by two threads at once.
+    """
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+def add_listener(listener) -> None:
+    """
+    `listener(trace)` is called with every finished Trace, on the thread that ended it.
+    """
+    _listeners.append(listener)
+
+
+def _export(finished: Trace) -> None:
+    for listener in _listeners:
+        try:
+            listener(finished)
+        except Exception:
+            logging.exception(f"Trace listener {listener} failed")
+
+    exported: dict[str, any] = finished.to_dict()
+
+    if TRACE_BUFFER_SIZE > 0:
+        with _buffer_lock:
+            _buffer.append(exported)
+
+    if TRACE_EXPORT_PATH:
+        _get_export_queue().put(exported)
+
+
+def _get_export_queue() -> queue.SimpleQueue:
+    """
+    The writer thread is started lazily and per process, it does not survive fork().
+    """
+    global _export_queue, _export_thread, _export_pid
+
+    with _export_lock:
+        if _export_thread is None or _export_pid != os.getpid():
+            _export_queue = queue.SimpleQueue()
+            _export_thread = threading.Thread(target=_write_exports, args=(_export_queue,), name="trace-export", daemon=True)
+            _export_pid = os.getpid()
+            _export_thread.start()
+
+        return _export_queue
+
+
+def _write_exports(exports: queue.SimpleQueue) -> None:
+    # Traces still queued when the process exits are lost
+    while True:
+        batch: list[dict[str, any]] = [exports.get()]
+
+        # Everything queued meanwhile is appended with one open()
+        while True:
+            try:
+                batch.append(exports.get_nowait())
+            except queue.Empty:
+                break
+
+        lines: str = "".join(
+            json.dumps(exported, ensure_ascii=False, default=str) + "\n"
+            for exported in batch
+        )
+
+        try:
+            with open(TRACE_EXPORT_PATH, "a", encoding="utf-8") as file:
+                file.write(lines)
+        except OSError:
+            logging.exception(f"Exporting {len(batch)} traces to {TRACE_EXPORT_PATH} failed")
+
+
+def get_traces(limit: int = None, name: str = None) -> list[dict[str, any]]:
+    """
+    The buffered traces, newest first.
+    """
+    with _buffer_lock:
+        traces: list[dict[str, any]] = list(reversed(_buffer))
+
+    if name is not None:
+        traces = [
+            exported
+            for exported in traces
+            if exported["name"] == name
+        ]
+
+    return traces[:limit] if limit is not None else traces